@@ -1,4 +1,4 @@
-cdef extern from 'lmdb.h':
+cdef extern from 'lmdb.h' nogil:
     cdef enum:
         # env creation flags
         MDB_FIXEDMAP = 0x01
@@ -103,6 +103,8 @@ cdef extern from 'lmdb.h':
 
 
 
+    ctypedef int MDB_msg_func(const char *msg, void *ctx) except -1
+
     char *mdb_strerror(int err)
     int  mdb_env_create(MDB_env **env)
     int  mdb_env_open(MDB_env *env, char *path, unsigned int flags, unsigned int mode)
@@ -116,11 +118,13 @@ cdef extern from 'lmdb.h':
     int  mdb_env_set_mapsize(MDB_env *env, size_t size)
     int  mdb_env_set_maxdbs(MDB_env *env, MDB_dbi dbs)
     int  mdb_env_set_maxreaders(MDB_env *env, unsigned int readers)
+    int  mdb_reader_list(MDB_env *env, MDB_msg_func *func, void *ctx)
     void mdb_env_close(MDB_env *env)
 
     int  mdb_txn_begin(MDB_env *env, MDB_txn *parent, unsigned int flags, MDB_txn **txn)
     int  mdb_txn_commit(MDB_txn *txn)
     void mdb_txn_abort(MDB_txn *txn)
+    size_t mdb_txn_id(MDB_txn *txn)
     void mdb_txn_reset(MDB_txn *txn)
     int  mdb_txn_renew(MDB_txn *txn)
 
@@ -131,6 +135,8 @@ cdef extern from 'lmdb.h':
     int  mdb_get(MDB_txn *txn, MDB_dbi dbi, MDB_val *key, MDB_val *data)
     int  mdb_put(MDB_txn *txn, MDB_dbi dbi, MDB_val *key, MDB_val *data, unsigned int flags)
     int  mdb_del(MDB_txn *txn, MDB_dbi dbi, MDB_val *key, MDB_val *data)
+    int  mdb_cmp(MDB_txn *txn, MDB_dbi dbi, MDB_val *a, MDB_val *b)
+    int  mdb_dcmp(MDB_txn *txn, MDB_dbi dbi, MDB_val *a, MDB_val *b)
 
     int  mdb_cursor_open(MDB_txn *txn, MDB_dbi dbi, MDB_cursor **cursor)
     void mdb_cursor_close(MDB_cursor *cursor)
@@ -1,4 +1,58 @@
 cimport cmdb
+from cpython cimport array
+from cpython.buffer cimport PyBuffer_FillInfo, PyBuffer_Release
+from cpython.buffer cimport PyObject_GetBuffer, PyBUF_FORMAT, PyBUF_ND
+from cpython.buffer cimport PyBUF_SIMPLE
+from cpython.bytearray cimport PyByteArray_AS_STRING
+from cpython.bytes cimport PyBytes_AS_STRING, PyBytes_FromStringAndSize
+from cpython.mem cimport PyMem_Free, PyMem_Malloc
+from libc.string cimport memcmp, memcpy, memset
+from posix.time cimport clock_gettime, timespec, CLOCK_MONOTONIC
+
+cdef extern from 'Python.h':
+    # not in the cpython.ref of older Cython releases
+    Py_ssize_t Py_REFCNT(object o)
+
+cdef extern from 'zlib.h':
+    ctypedef struct z_stream:
+        const unsigned char *next_in
+        unsigned int avail_in
+        unsigned char *next_out
+        unsigned int avail_out
+        unsigned long total_out
+
+    enum:
+        Z_OK
+        Z_STREAM_END
+        Z_FINISH
+        Z_DEFLATED
+        Z_DEFAULT_STRATEGY
+
+    int deflateInit2(z_stream *strm, int level, int method, int windowBits,
+                     int memLevel, int strategy)
+    int deflateReset(z_stream *strm)
+    int deflateSetDictionary(z_stream *strm, const unsigned char *dictionary,
+                             unsigned int dictLength)
+    unsigned long deflateBound(z_stream *strm, unsigned long sourceLen)
+    int deflate(z_stream *strm, int flush)
+    int deflateEnd(z_stream *strm)
+    int inflateInit2(z_stream *strm, int windowBits)
+    int inflateReset(z_stream *strm)
+    int inflateSetDictionary(z_stream *strm, const unsigned char *dictionary,
+                             unsigned int dictLength)
+    int inflate(z_stream *strm, int flush)
+    int inflateEnd(z_stream *strm)
+
+import array
+import collections
+import threading
+import time
+import weakref
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 # env creation flags
 MDB_FIXEDMAP = 0x01
@@ -73,47 +127,391 @@ class TxnFullError(Exception):
     pass
 
 
+cdef extern from *:
+    """
+    static inline void mdb_metric_add(unsigned long long *p,
+                                      unsigned long long v) {
+        __atomic_fetch_add(p, v, __ATOMIC_RELAXED);
+    }
+    static inline void mdb_metric_max(unsigned long long *p,
+                                      unsigned long long v) {
+        unsigned long long cur = __atomic_load_n(p, __ATOMIC_RELAXED);
+        while (v > cur && !__atomic_compare_exchange_n(
+                   p, &cur, v, 1, __ATOMIC_RELAXED, __ATOMIC_RELAXED)) {
+        }
+    }
+    static inline int mdb_metric_bucket(unsigned long long v) {
+        int e;
+        if (v < 8)
+            return (int)v;
+        e = 63 - __builtin_clzll(v);
+        return (e - 2) * 8 + (int)((v >> (e - 3)) & 7);
+    }
+    """
+    void mdb_metric_add(unsigned long long *p, unsigned long long v) nogil
+    void mdb_metric_max(unsigned long long *p, unsigned long long v) nogil
+    int mdb_metric_bucket(unsigned long long v) nogil
+
+# operations timed by the metrics of an Env, see Env.set_metrics
+METRIC_OPS = ('txn_begin', 'txn_commit', 'txn_abort', 'txn_renew', 'get',
+              'put', 'delete', 'cursor_get', 'cursor_put', 'cursor_delete',
+              'sync')
+
+cdef enum:
+    _OP_TXN_BEGIN
+    _OP_TXN_COMMIT
+    _OP_TXN_ABORT
+    _OP_TXN_RENEW
+    _OP_GET
+    _OP_PUT
+    _OP_DELETE
+    _OP_CURSOR_GET
+    _OP_CURSOR_PUT
+    _OP_CURSOR_DELETE
+    _OP_SYNC
+    _NOPS
+    # log-linear buckets, 8 per power of two, up to 2 ** 64 ns
+    _NBUCKETS = 496
+
+ctypedef struct _Histogram:
+    unsigned long long count
+    unsigned long long notfound
+    unsigned long long errors
+    unsigned long long sum_ns
+    unsigned long long max_ns
+    unsigned long long buckets[_NBUCKETS]
+
+ctypedef struct _Metrics:
+    bint enabled
+    unsigned long long map_full
+    unsigned long long txn_full
+    unsigned long long map_grows
+    _Histogram ops[_NOPS]
+
+
+cdef inline unsigned long long _metrics_start(_Metrics *m) nogil:
+    cdef timespec now
+    if not m.enabled:
+        return 0
+    clock_gettime(CLOCK_MONOTONIC, &now)
+    return <unsigned long long>now.tv_sec * 1000000000ULL + now.tv_nsec
+
+
+cdef inline int _metrics_stop(_Metrics *m, int op, unsigned long long started,
+                              int err) nogil:
+    """Record an op begun at started, 0 if metrics were disabled, which
+    returned err, and return err.
+    """
+    cdef unsigned long long elapsed
+    cdef _Histogram *h
+    if not started:
+        return err
+    elapsed = _metrics_start(m)
+    elapsed = elapsed - started if elapsed > started else 0
+    h = &m.ops[op]
+    mdb_metric_add(&h.count, 1)
+    mdb_metric_add(&h.sum_ns, elapsed)
+    mdb_metric_max(&h.max_ns, elapsed)
+    mdb_metric_add(&h.buckets[mdb_metric_bucket(elapsed)], 1)
+    if err == cmdb.MDB_NOTFOUND:
+        mdb_metric_add(&h.notfound, 1)
+    elif err:
+        mdb_metric_add(&h.errors, 1)
+        if err == cmdb.MDB_MAP_FULL:
+            mdb_metric_add(&m.map_full, 1)
+        elif err == cmdb.MDB_TXN_FULL:
+            mdb_metric_add(&m.txn_full, 1)
+    return err
+
+
+cdef inline int _mdb_get(_Metrics *m, cmdb.MDB_txn *txn, cmdb.MDB_dbi dbi,
+                         cmdb.MDB_val *key, cmdb.MDB_val *data) nogil:
+    cdef unsigned long long started = _metrics_start(m)
+    return _metrics_stop(m, _OP_GET, started,
+                         cmdb.mdb_get(txn, dbi, key, data))
+
+
+cdef inline int _mdb_put(_Metrics *m, cmdb.MDB_txn *txn, cmdb.MDB_dbi dbi,
+                         cmdb.MDB_val *key, cmdb.MDB_val *data,
+                         unsigned int flags) nogil:
+    cdef unsigned long long started = _metrics_start(m)
+    return _metrics_stop(m, _OP_PUT, started,
+                         cmdb.mdb_put(txn, dbi, key, data, flags))
+
+
+cdef inline int _mdb_del(_Metrics *m, cmdb.MDB_txn *txn, cmdb.MDB_dbi dbi,
+                         cmdb.MDB_val *key, cmdb.MDB_val *data) nogil:
+    cdef unsigned long long started = _metrics_start(m)
+    return _metrics_stop(m, _OP_DELETE, started,
+                         cmdb.mdb_del(txn, dbi, key, data))
+
+
+cdef inline int _mdb_cursor_get(_Metrics *m, cmdb.MDB_cursor *cursor,
+                                cmdb.MDB_val *key, cmdb.MDB_val *data,
+                                unsigned int op) nogil:
+    cdef unsigned long long started = _metrics_start(m)
+    return _metrics_stop(m, _OP_CURSOR_GET, started,
+                         cmdb.mdb_cursor_get(cursor, key, data, op))
+
+
+cdef inline int _mdb_cursor_put(_Metrics *m, cmdb.MDB_cursor *cursor,
+                                cmdb.MDB_val *key, cmdb.MDB_val *data,
+                                unsigned int flags) nogil:
+    cdef unsigned long long started = _metrics_start(m)
+    return _metrics_stop(m, _OP_CURSOR_PUT, started,
+                         cmdb.mdb_cursor_put(cursor, key, data, flags))
+
+
+cdef inline int _mdb_cursor_del(_Metrics *m, cmdb.MDB_cursor *cursor,
+                                unsigned int flags) nogil:
+    cdef unsigned long long started = _metrics_start(m)
+    return _metrics_stop(m, _OP_CURSOR_DELETE, started,
+                         cmdb.mdb_cursor_del(cursor, flags))
+
+
+cdef double _bucket_limit(int bucket):
+    # the exclusive upper bound, in ns, of the values counted in bucket
+    cdef int e
+    bucket += 1
+    if bucket < 8:
+        return bucket
+    e = bucket // 8 + 2
+    return <double>(8 + bucket % 8) * (<double>2 ** (e - 3))
+
+
+cdef dict _histogram_stats(_Histogram *h):
+    """Return the counts and latencies, in microseconds, of h. Percentiles
+    are the upper bound of their bucket, within 12.5% of the true value.
+    """
+    cdef unsigned long long buckets[_NBUCKETS]
+    cdef unsigned long long count = 0, seen = 0
+    cdef int i, q
+
+    memcpy(buckets, h.buckets, sizeof(buckets))
+    for i in range(_NBUCKETS):
+        count += buckets[i]
+    stats = dict(count=h.count, notfound=h.notfound, errors=h.errors,
+                 total_seconds=h.sum_ns / 1e9,
+                 mean_us=h.sum_ns / 1e3 / h.count if h.count else 0.0,
+                 max_us=h.max_ns / 1e3)
+    quantiles = [(0.5, 'p50_us'), (0.9, 'p90_us'), (0.99, 'p99_us'),
+                 (0.999, 'p999_us')]
+    q = 0
+    for i in range(_NBUCKETS):
+        seen += buckets[i]
+        while q < len(quantiles) and count and seen >= quantiles[q][0] * count:
+            stats[quantiles[q][1]] = min(_bucket_limit(i), h.max_ns) / 1e3
+            q += 1
+    while q < len(quantiles):
+        stats[quantiles[q][1]] = 0.0
+        q += 1
+    return stats
+
+
+cdef int _collect_reader(const char *msg, void *ctx) except -1 with gil:
+    (<object>ctx).append(msg)
+    return 0
+
+
+cdef enum:
+    # views a txn tracks before it prunes the ones no longer referenced
+    _VIEWS_MIN = 64
+
+# memoryview.release() is new in Python 3.2
+cdef bint _RELEASABLE_VIEWS = hasattr(memoryview, 'release')
+
+
+cdef class MapBuffer:
+    """Read-only buffer over a value stored in the memory map.
+
+    Instances are only handed out wrapped in a memoryview, see Txn.view.
+    exports counts the buffers still held by that view and its slices.
+    """
+    cdef void *data
+    cdef Py_ssize_t size
+    cdef Py_ssize_t exports
+
+    def __getbuffer__(self, Py_buffer *buffer, int flags):
+        PyBuffer_FillInfo(buffer, self, self.data, self.size, 1, flags)
+        self.exports += 1
+
+    def __releasebuffer__(self, Py_buffer *buffer):
+        self.exports -= 1
+
+
 cdef class Txn:
     cdef cmdb.MDB_txn *txn
+    cdef list views
+    cdef list buffers
+    cdef Py_ssize_t views_limit
+    cdef Env env
+    cdef _Metrics *metrics
 
     def __init__(self, Env env, Txn parent=None, unsigned int flags=0):
         cdef cmdb.MDB_txn *parent_txn = NULL
+        cdef unsigned long long started
+        cdef int err
         if parent:
             parent_txn = parent.txn
 
-        err = cmdb.mdb_txn_begin(env.env, parent_txn, flags, &self.txn)
+        self.views = []
+        self.buffers = []
+        self.views_limit = _VIEWS_MIN
+        self.env = env
+        self.metrics = &env.metrics_data
+        with nogil:
+            started = _metrics_start(self.metrics)
+            err = cmdb.mdb_txn_begin(env.env, parent_txn, flags, &self.txn)
+            _metrics_stop(self.metrics, _OP_TXN_BEGIN, started, err)
+        if err == cmdb.MDB_MAP_RESIZED:
+            # another process grew the map, adopt its new size and retry
+            with nogil:
+                err = cmdb.mdb_env_set_mapsize(env.env, 0)
+                if not err:
+                    err = cmdb.mdb_txn_begin(env.env, parent_txn, flags,
+                                             &self.txn)
         if err:
             raise Exception("Error creating master transaction: %s"
                             % cmdb.mdb_strerror(err))
+        if parent is None and not flags & MDB_RDONLY:
+            env.write_txn = self
+
+    cdef view(self, void *data, size_t size):
+        """Return a read-only memoryview of size bytes at data in the map.
+
+        The view is released when this transaction commits, aborts or
+        resets, after which any access to it raises ValueError. Slices of
+        the view cannot be released, so ending the transaction while one
+        is still alive raises BufferError. Python 2 memoryviews cannot be
+        released at all and must not be used once the transaction ends.
+        """
+        cdef MapBuffer buf = MapBuffer.__new__(MapBuffer)
+
+        if len(self.views) >= self.views_limit:
+            self.prune_views()
+        buf.data = data
+        buf.size = size
+        view = memoryview(buf)
+        self.views.append(view)
+        self.buffers.append(buf)
+        return view
+
+    cdef prune_views(self):
+        # Release the views nobody but this txn refers to any more, so a
+        # long scan only keeps the views the caller holds on to. Doubling
+        # the limit keeps the cost per view constant.
+        cdef MapBuffer buf
+        cdef list views = []
+
+        for view in self.views:
+            # one reference from the list, one from the loop variable
+            if Py_REFCNT(view) > 2:
+                views.append(view)
+            elif _RELEASABLE_VIEWS:
+                view.release()
+        self.views = views
+        self.buffers = [buf for buf in self.buffers if buf.exports]
+        self.views_limit = max(_VIEWS_MIN, 2 * len(self.buffers))
+
+    cdef release_views(self):
+        cdef MapBuffer buf
+
+        if not _RELEASABLE_VIEWS:
+            # Python 2 memoryviews cannot be invalidated, the caller must
+            # not use them past the end of the txn
+            self.views = []
+            self.buffers = []
+            self.views_limit = _VIEWS_MIN
+            return
+        # release() raises BufferError if a view is still exported, e.g.
+        # to a numpy array, in which case the txn is left untouched.
+        while self.views:
+            self.views[-1].release()
+            self.views.pop()
+        # whatever is still exported is a slice pointing into the map
+        for buf in self.buffers:
+            if buf.exports:
+                raise BufferError("Error ending transaction: a slice of a "
+                                  "map buffer is still alive")
+        self.buffers = []
+        self.views_limit = _VIEWS_MIN
 
     def commit(self):
-        err = cmdb.mdb_txn_commit(self.txn)
-        if err:
+        cdef int err
+
+        cdef unsigned long long started
+
+        self.release_views()
+        self.ended()
+        with nogil:
+            started = _metrics_start(self.metrics)
+            err = _metrics_stop(self.metrics, _OP_TXN_COMMIT, started,
+                                cmdb.mdb_txn_commit(self.txn))
+        if err == cmdb.MDB_MAP_FULL:
+            raise MapFullError("Error committing transaction: %s"
+                               % cmdb.mdb_strerror(err))
+        elif err:
             raise Exception("Error committing transaction: %s"
                             % cmdb.mdb_strerror(err))
 
     def abort(self):
-        cmdb.mdb_txn_abort(self.txn)
+        cdef unsigned long long started
+
+        self.release_views()
+        self.ended()
+        with nogil:
+            started = _metrics_start(self.metrics)
+            cmdb.mdb_txn_abort(self.txn)
+            _metrics_stop(self.metrics, _OP_TXN_ABORT, started, 0)
+
+    cdef ended(self):
+        # a commit or abort frees the txn even when it fails
+        if self.env.write_txn is self:
+            self.env.write_txn = None
 
     def reset(self):
         '''Both reset and renew work on only readonly transaction.
         '''
+        self.release_views()
         cmdb.mdb_txn_reset(self.txn)
 
+    @property
+    def id(self):
+        """The id of the snapshot a read txn sees, or of a write txn.
+        """
+        return cmdb.mdb_txn_id(self.txn)
+
     def renew(self):
-        err = cmdb.mdb_txn_renew(self.txn)
+        cdef unsigned long long started
+        cdef int err
+
+        with nogil:
+            started = _metrics_start(self.metrics)
+            err = _metrics_stop(self.metrics, _OP_TXN_RENEW, started,
+                                cmdb.mdb_txn_renew(self.txn))
         if err:
             raise Exception("Error renewing transaction: %s"
                             % cmdb.mdb_strerror(err))
 
 
 cdef class Env:
+    """An LMDB environment.
+
+    With metrics, every txn, get, put, delete, cursor step and sync made
+    through it is counted and timed, see set_metrics.
+    """
     cdef cmdb.MDB_env *env
+    cdef _Metrics metrics_data
+    # the top-level write txn in progress, aborted by close
+    cdef Txn write_txn
 
     def __init__(self, char *filename,
                  unsigned int flags=MDB_WRITEMAP | MDB_NOSYNC,
                  int permissions=0664, size_t mapsize=0, int max_dbs=8,
-                 int max_readers=1024):
+                 int max_readers=1024, bint metrics=False):
+        cdef int err
+
+        self.metrics_data.enabled = metrics
         err = cmdb.mdb_env_create(&self.env)
         if err:
             raise Exception("Error creating environment: %s"
@@ -134,7 +532,8 @@ cdef class Env:
                 raise Exception("Could not set max dbs: %s"
                                 % cmdb.mdb_strerror(err))
 
-        err = cmdb.mdb_env_open(self.env, filename, flags, permissions)
+        with nogil:
+            err = cmdb.mdb_env_open(self.env, filename, flags, permissions)
         if err:
             raise Exception("Error opening environment: %s"
                             % cmdb.mdb_strerror(err))
@@ -145,11 +544,37 @@ cdef class Env:
             raise Exception("Could not set environment size, make sure all\
                             txns have been closed: %s" % cmdb.mdb_strerror(err))
 
+    def grow_mapsize(self, double factor=2, size_t max_mapsize=0):
+        """Multiply the map size by factor, capped to max_mapsize unless it
+        is 0, and return the new size. Raises MapFullError if the map can
+        not grow any further. No txn may be active in this process.
+        """
+        cdef size_t mapsize = self.info()['me_mapsize']
+        cdef size_t new_mapsize = <size_t>(mapsize * factor)
+
+        if max_mapsize and new_mapsize > max_mapsize:
+            new_mapsize = max_mapsize
+        if new_mapsize <= mapsize:
+            raise MapFullError("Error growing environment: map is already "
+                               "%d bytes" % mapsize)
+        self.set_mapsize(new_mapsize)
+        mdb_metric_add(&self.metrics_data.map_grows, 1)
+        return new_mapsize
+
     def close(self):
-        cmdb.mdb_env_close(self.env)
+        """Close the environment, aborting the write txn still open in it,
+        which would otherwise keep holding the write lock.
+        """
+        if self.write_txn is not None:
+            self.write_txn.abort()
+        with nogil:
+            cmdb.mdb_env_close(self.env)
 
     def copy(self, char *filename):
-        err = cmdb.mdb_env_copy(self.env, filename)
+        cdef int err
+
+        with nogil:
+            err = cmdb.mdb_env_copy(self.env, filename)
         if err:
             raise Exception("Error copying environment: %s"
                             % cmdb.mdb_strerror(err))
@@ -182,12 +607,96 @@ cdef class Env:
                     me_maxreaders=info.me_maxreaders,
                     me_numreaders=info.me_numreaders)
 
-    def sync(self, force=False):
-        err = cmdb.mdb_env_sync(self.env, force)
+    def sync(self, bint force=False):
+        cdef _Metrics *metrics = &self.metrics_data
+        cdef unsigned long long started
+        cdef int err
+
+        with nogil:
+            started = _metrics_start(metrics)
+            err = _metrics_stop(metrics, _OP_SYNC, started,
+                                cmdb.mdb_env_sync(self.env, force))
         if err:
             raise Exception("Error sycning environment: %s"
                             % cmdb.mdb_strerror(err))
 
+    def set_metrics(self, bint enabled=True):
+        """Start or stop counting and timing the operations made through
+        this Env, see metrics. The figures gathered so far are kept.
+        """
+        self.metrics_data.enabled = enabled
+
+    def reset_metrics(self):
+        cdef bint enabled = self.metrics_data.enabled
+        memset(&self.metrics_data, 0, sizeof(_Metrics))
+        self.metrics_data.enabled = enabled
+
+    def reader_list(self):
+        """Return the slots of the reader table in use, as dicts of pid,
+        thread and txnid, None for a reader between txns.
+        """
+        cdef list lines = []
+        cdef int err
+
+        err = cmdb.mdb_reader_list(self.env, _collect_reader, <void*>lines)
+        if err < 0:
+            raise Exception("Error listing readers: %s"
+                            % cmdb.mdb_strerror(err))
+        readers = []
+        for line in lines:
+            fields = line.split()
+            if len(fields) != 3 or not fields[0].isdigit():
+                # the header, or '(no active readers)'
+                continue
+            pid, thread, txnid = fields
+            readers.append(dict(pid=int(pid), thread=int(thread, 16),
+                                txnid=None if txnid == b'-' else int(txnid)))
+        return readers
+
+    def metrics(self):
+        """Return a snapshot of the metrics of this Env.
+
+        ops maps each of METRIC_OPS to its count, the number of calls that
+        found nothing or failed, and its mean, max and p50 to p99.9
+        latencies in microseconds. map_full, txn_full and map_grows count
+        the writes that filled the map or the txn and the times the map
+        was grown. gauges, read whether metrics are enabled or not, hold:
+
+        - map_utilisation: me_last_pgno * ms_psize / me_mapsize
+        - reader_utilisation: me_numreaders / me_maxreaders
+        - active_readers: the readers in a txn
+        - oldest_reader_lag: the number of txns committed since the
+          oldest active reader began, which keeps their pages from being
+          reused
+        """
+        ops = {}
+        for op in range(_NOPS):
+            ops[METRIC_OPS[op]] = _histogram_stats(&self.metrics_data.ops[op])
+        info = self.info()
+        psize = self.stat()['ms_psize']
+        readers = [reader['txnid'] for reader in self.reader_list()
+                   if reader['txnid'] is not None]
+        last_txnid = info['me_last_txnid']
+        gauges = dict(
+            mapsize=info['me_mapsize'],
+            map_used=info['me_last_pgno'] * psize,
+            map_utilisation=(float(info['me_last_pgno'] * psize) /
+                             info['me_mapsize']),
+            readers=info['me_numreaders'],
+            max_readers=info['me_maxreaders'],
+            reader_utilisation=(float(info['me_numreaders']) /
+                                info['me_maxreaders']),
+            active_readers=len(readers),
+            oldest_reader_lag=(last_txnid - min(readers)
+                               if readers else 0),
+            last_txnid=last_txnid)
+        return dict(enabled=self.metrics_data.enabled,
+                    ops=ops,
+                    map_full=self.metrics_data.map_full,
+                    txn_full=self.metrics_data.txn_full,
+                    map_grows=self.metrics_data.map_grows,
+                    gauges=gauges)
+
     def set_flags(self, unsigned int flags, int onoff):
         err = cmdb.mdb_env_set_flags(self.env, flags, onoff)
         if err:
@@ -210,7 +719,12 @@ cdef class Env:
         return txn
 
     def open_db(self, Txn txn, name=None,
-                unsigned int flags=MDB_CREATE | MDB_DUPSORT):
+                unsigned int flags=MDB_CREATE | MDB_DUPSORT,
+                bint binary=False):
+        """Open a database, typed after its integer flags. A string keyed
+        and valued database is a BytesDB if binary, otherwise a DB of NUL
+        terminated strings.
+        """
         cdef DB db
 
         if flags & MDB_INTEGERKEY:
@@ -221,19 +735,161 @@ cdef class Env:
         else:
             if flags & MDB_INTEGERDUP:
                 db = StrIntDB(self, txn, name, flags)
+            elif binary:
+                db = BytesDB(self, txn, name, flags)
             else:
                 db = DB(self, txn, name, flags)
         return db
 
 
+# the set operations of DB.dup_sets
+cdef bint _is_long_format(const char *fmt):
+    # native C long, or long long where that has the same size
+    if fmt == NULL:
+        return False
+    if fmt[0] == b'@':
+        fmt += 1
+    if fmt[0] == 0 or fmt[1] != 0:
+        return False
+    return fmt[0] == b'l' or (fmt[0] == b'q' and
+                              sizeof(long long) == sizeof(long))
+
+
+cdef enum:
+    _INTERSECT
+    _UNION
+    _DIFFERENCE
+
+
+cdef inline int _step_dup(_Metrics *m, cmdb.MDB_cursor *cursor,
+                          cmdb.MDB_val *key, unsigned long *head,
+                          unsigned int op) nogil:
+    # move cursor to its next dup, or with MDB_GET_BOTH_RANGE to the first
+    # dup >= head, and store it in head
+    cdef cmdb.MDB_val api_key = key[0]
+    cdef cmdb.MDB_val api_value
+    cdef unsigned long target = head[0]
+    cdef int err
+
+    api_value.mv_size = sizeof(long)
+    api_value.mv_data = <void *>&target
+    err = _mdb_cursor_get(m, cursor, &api_key, &api_value, op)
+    if not err:
+        head[0] = (<unsigned long *>api_value.mv_data)[0]
+    return err
+
+
+cdef size_t _intersect_dups(_Metrics *m, cmdb.MDB_cursor **cursors,
+                            cmdb.MDB_val *keys, unsigned long *heads,
+                            size_t nkeys, long *out, size_t limit,
+                            int *err) nogil:
+    # leapfrog: each cursor in turn seeks the candidate, which moves up to
+    # the dup it lands on until all of them agree on it
+    cdef unsigned long candidate = heads[0]
+    cdef size_t i = 0, matched = 1, n = 0
+
+    while n < limit:
+        if matched == nkeys:
+            out[n] = <long>candidate
+            n += 1
+            err[0] = _step_dup(m, cursors[i], &keys[i], &heads[i],
+                               cmdb.MDB_NEXT_DUP)
+            if err[0]:
+                break
+            candidate = heads[i]
+            matched = 1
+            continue
+        i = (i + 1) % nkeys
+        if heads[i] < candidate:
+            heads[i] = candidate
+            err[0] = _step_dup(m, cursors[i], &keys[i], &heads[i],
+                               cmdb.MDB_GET_BOTH_RANGE)
+            if err[0]:
+                break
+        if heads[i] == candidate:
+            matched += 1
+        else:
+            candidate = heads[i]
+            matched = 1
+    return n
+
+
+cdef size_t _union_dups(_Metrics *m, cmdb.MDB_cursor **cursors,
+                        cmdb.MDB_val *keys, unsigned long *heads,
+                        size_t *counts, size_t nkeys, long *out,
+                        size_t limit, int *err) nogil:
+    # merge the cursors, counts[i] being 0 once cursor i is exhausted
+    cdef unsigned long low = 0
+    cdef size_t i, n = 0
+    cdef bint found
+
+    while n < limit:
+        found = False
+        for i in range(nkeys):
+            if counts[i] and (not found or heads[i] < low):
+                low = heads[i]
+                found = True
+        if not found:
+            break
+        out[n] = <long>low
+        n += 1
+        for i in range(nkeys):
+            if counts[i] and heads[i] == low:
+                err[0] = _step_dup(m, cursors[i], &keys[i], &heads[i],
+                                   cmdb.MDB_NEXT_DUP)
+                if err[0] == cmdb.MDB_NOTFOUND:
+                    counts[i] = 0
+                elif err[0]:
+                    return n
+    err[0] = cmdb.MDB_NOTFOUND
+    return n
+
+
+cdef size_t _difference_dups(_Metrics *m, cmdb.MDB_cursor **cursors,
+                             cmdb.MDB_val *keys, unsigned long *heads,
+                             size_t *counts, size_t nkeys, long *out,
+                             size_t limit, int *err) nogil:
+    # walk the first cursor, seeking the others to each of its dups
+    cdef size_t i, n = 0
+    cdef bint excluded
+
+    while n < limit:
+        excluded = False
+        for i in range(1, nkeys):
+            if not counts[i]:
+                continue
+            if heads[i] < heads[0]:
+                heads[i] = heads[0]
+                err[0] = _step_dup(m, cursors[i], &keys[i], &heads[i],
+                                   cmdb.MDB_GET_BOTH_RANGE)
+                if err[0] == cmdb.MDB_NOTFOUND:
+                    counts[i] = 0
+                    continue
+                elif err[0]:
+                    return n
+            if heads[i] == heads[0]:
+                excluded = True
+                break
+        if not excluded:
+            out[n] = <long>heads[0]
+            n += 1
+        err[0] = _step_dup(m, cursors[0], &keys[0], &heads[0],
+                           cmdb.MDB_NEXT_DUP)
+        if err[0]:
+            break
+    return n
+
+
 cdef class DB:
     cdef cmdb.MDB_dbi dbi
     cdef Env env
+    cdef _Metrics *metrics
 
     def __init__(self, Env env, Txn txn, name=None,
                  unsigned int flags=MDB_DUPSORT | MDB_CREATE):
         cdef char *cname
         self.env = env
+        self.metrics = &env.metrics_data
         cname = NULL if name is None else <char*>name
         err = cmdb.mdb_dbi_open(txn.txn, cname, flags, &self.dbi)
         if err:
@@ -244,7 +900,10 @@ cdef class DB:
         cmdb.mdb_dbi_close(self.env.env, self.dbi)
 
     def drop(self, Txn txn, bint delete = False):
-        err = cmdb.mdb_drop(txn.txn, self.dbi, delete)
+        cdef int err
+
+        with nogil:
+            err = cmdb.mdb_drop(txn.txn, self.dbi, delete)
         if err:
             raise Exception("Error dropping datsabase: %s"
                             % cmdb.mdb_strerror(err))
@@ -268,12 +927,15 @@ cdef class DB:
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
         cdef size_t key_len
+        cdef int err
 
         key_len = len(key) + 1
         api_key.mv_size = key_len
         api_key.mv_data = <char*>key
 
-        err = cmdb.mdb_get(txn.txn, self.dbi, &api_key, &api_value)
+        with nogil:
+            err = _mdb_get(self.metrics, txn.txn, self.dbi, &api_key,
+                           &api_value)
         if err == cmdb.MDB_NOTFOUND:
             raise KeyNotFoundError("Error getting data: %s"
                                    % cmdb.mdb_strerror(err))
@@ -282,18 +944,99 @@ cdef class DB:
         cdef char *rval = <char*>api_value.mv_data
         return rval[:api_value.mv_size-1]
 
+    def get_buffer(self, Txn txn, key):
+        """Like get, but return a read-only memoryview pointing directly
+        into the memory map instead of a copy of the value.
+
+        The view is only valid for the lifetime of txn, see Txn.view.
+        """
+        cdef cmdb.MDB_val api_key
+        cdef cmdb.MDB_val api_value
+        cdef int err
+
+        api_key.mv_size = len(key) + 1
+        api_key.mv_data = <char*>key
+
+        with nogil:
+            err = _mdb_get(self.metrics, txn.txn, self.dbi, &api_key,
+                           &api_value)
+        if err == cmdb.MDB_NOTFOUND:
+            raise KeyNotFoundError("Error getting data: %s"
+                                   % cmdb.mdb_strerror(err))
+        elif err:
+            raise Exception("Error getting data: %s" % cmdb.mdb_strerror(err))
+        return txn.view(api_value.mv_data, api_value.mv_size - 1)
+
+    def get_many(self, Txn txn, keys, default=None, bint dup=False,
+                 Cursor reuse=None):
+        """Look up a sequence of keys with a single cursor.
+
+        Keys are visited in sorted order, so that consecutive lookups mostly
+        land on the leaf page the cursor is already positioned on, and the
+        values are returned in the order of the input keys. Missing keys map
+        to default. If dup is True, each entry is the list of all the
+        duplicate values of the key. Pass reuse, a Cursor of this database
+        in txn, to look the keys up with it instead of opening one.
+        """
+        cdef cmdb.MDB_cursor *cursor
+        cdef cmdb.MDB_val api_key
+        cdef cmdb.MDB_val api_value
+        cdef long ikey
+        cdef Py_ssize_t i
+        cdef int err
+
+        keys = list(keys)
+        values = [default] * len(keys)
+        if reuse is not None:
+            cursor = reuse.cursor
+        else:
+            err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursor)
+            if err:
+                raise Exception("Error creating cursor: %s"
+                                % cmdb.mdb_strerror(err))
+        try:
+            for i in sorted(range(len(keys)), key=keys.__getitem__):
+                self.set_key(&api_key, keys[i], &ikey)
+                with nogil:
+                    err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                          &api_value, cmdb.MDB_SET)
+                if err == cmdb.MDB_NOTFOUND:
+                    continue
+                elif err:
+                    raise Exception("Error getting data: %s"
+                                    % cmdb.mdb_strerror(err))
+                if not dup:
+                    values[i] = self.value_of(&api_value)
+                    continue
+                dups = [self.value_of(&api_value)]
+                while True:
+                    with nogil:
+                        err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                              &api_value, cmdb.MDB_NEXT_DUP)
+                    if err:
+                        break
+                    dups.append(self.value_of(&api_value))
+                values[i] = dups
+        finally:
+            if reuse is None:
+                cmdb.mdb_cursor_close(cursor)
+        return values
+
     def put(self, Txn txn, key, value, unsigned int flags=0):
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
         cdef size_t key_len = len(key)
         cdef size_t value_len = len(value)
+        cdef int err
 
         api_key.mv_size = key_len + 1
         api_key.mv_data = <char*>key
         api_value.mv_size = value_len + 1
         api_value.mv_data = <char*>value
 
-        err = cmdb.mdb_put(txn.txn, self.dbi, &api_key, &api_value, flags)
+        with nogil:
+            err = _mdb_put(self.metrics, txn.txn, self.dbi, &api_key,
+                           &api_value, flags)
         if err == cmdb.MDB_MAP_FULL:
             raise MapFullError("Error putting data: %s"
                                % cmdb.mdb_strerror(err))
@@ -310,26 +1053,74 @@ cdef class DB:
         """Delete key/value from MDB
 
         If value is not specified, delete all values with this key. Otherwise,
-        delete the specified key/value.
+        delete the specified key/value. Raises KeyNotFoundError if there is
+        nothing to delete.
         """
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
+        cdef int err
 
         api_key.mv_size = len(key) + 1
         api_key.mv_data = <char*>key
         if value:
             api_value.mv_size = len(value) + 1
             api_value.mv_data = <char*>value
-            err = cmdb.mdb_del(txn.txn, self.dbi, &api_key, &api_value)
-            if err:
+            with nogil:
+                err = _mdb_del(self.metrics, txn.txn, self.dbi, &api_key,
+                               &api_value)
+            if err == cmdb.MDB_NOTFOUND:
+                raise KeyNotFoundError("Error deleting data: %s"
+                                       % cmdb.mdb_strerror(err))
+            elif err:
                 raise Exception("Error deleting data: %s"
                                 % cmdb.mdb_strerror(err))
         else:
-            err = cmdb.mdb_del(txn.txn, self.dbi, &api_key, NULL)
-            if err:
+            with nogil:
+                err = _mdb_del(self.metrics, txn.txn, self.dbi, &api_key, NULL)
+            if err == cmdb.MDB_NOTFOUND:
+                raise KeyNotFoundError("Error deleting data: %s"
+                                       % cmdb.mdb_strerror(err))
+            elif err:
                 raise Exception("Error deleting data: %s"
                                 % cmdb.mdb_strerror(err))
 
+    def put_sorted(self, Txn txn, items, bint strict=True):
+        """Write (key, value) pairs sorted by key, then value, in append mode.
+
+        A new key is written with MDB_APPEND and further values of the same
+        key with MDB_APPENDDUP, which skips the tree descent and leaves the
+        pages densely packed. Keys are ordered as LMDB orders them, which
+        puts negative integer keys after the positive ones. An out of order
+        pair raises KeyExistError if strict, otherwise it is written with a
+        regular put. Returns the number of pairs written.
+        """
+        cdef cmdb.MDB_val api_key
+        cdef cmdb.MDB_val api_last
+        cdef long ikey, ilast
+        cdef int cmp
+
+        count = 0
+        last_key = _MISSING
+        for key, value in items:
+            cmp = 1
+            if last_key is not _MISSING:
+                self.set_key(&api_key, key, &ikey)
+                self.set_key(&api_last, last_key, &ilast)
+                cmp = cmdb.mdb_cmp(txn.txn, self.dbi, &api_key, &api_last)
+            try:
+                if cmp < 0:
+                    raise KeyExistError()
+                flags = MDB_APPENDDUP if cmp == 0 else MDB_APPEND
+                self.put(txn, key, value, flags)
+            except KeyExistError:
+                if strict:
+                    raise KeyExistError("Error putting data: %r is out of "
+                                        "order" % (key,))
+                self.put(txn, key, value)
+            last_key = key
+            count += 1
+        return count
+
     def items(self, Txn txn):
         '''Return all the unique key values
         '''
@@ -363,7 +1154,7 @@ cdef class DB:
     def get_dup(self, Txn txn, key):
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
-        cdef char *value_
+        cdef int err
 
         api_key.mv_size = len(key) + 1
         api_key.mv_data = <char*>key
@@ -373,14 +1164,17 @@ cdef class DB:
         if err:
             raise Exception("Error creating cursor: %s"
                             % cmdb.mdb_strerror(err))
-        if not cmdb.mdb_cursor_get(cursor, &api_key, &api_value, MDB_SET):
-            value_ = <char*>api_value.mv_data
-            yield value_[:api_value.mv_size-1]
+        with nogil:
+            err = _mdb_cursor_get(self.metrics, cursor, &api_key, &api_value,
+                                  cmdb.MDB_SET)
+        if not err:
+            yield self.value_of(&api_value)
             while True:
-                if not cmdb.mdb_cursor_get(cursor, &api_key,
-                                           &api_value, MDB_NEXT_DUP):
-                    value_ = <char*>api_value.mv_data
-                    yield value_[:api_value.mv_size-1]
+                with nogil:
+                    err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                          &api_value, cmdb.MDB_NEXT_DUP)
+                if not err:
+                    yield self.value_of(&api_value)
                 else:
                     break
         cmdb.mdb_cursor_close(cursor)
@@ -389,10 +1183,463 @@ cdef class DB:
         for value in self.get_dup(txn, key_):
             yield key_, value
 
+    cdef set_key(self, cmdb.MDB_val *api_key, key, long *ikey):
+        # ikey is storage for integer keys, unused by string keys
+        api_key.mv_size = len(key) + 1
+        api_key.mv_data = <char*>key
+
+    cdef object key_of(self, cmdb.MDB_val *api_key):
+        return (<char*>api_key.mv_data)[:api_key.mv_size-1]
+
+    cdef object value_of(self, cmdb.MDB_val *api_value):
+        return (<char*>api_value.mv_data)[:api_value.mv_size-1]
+
+    cdef object dup_array(self, Txn txn, key):
+        # the dups of key as an array('l'), fetched a page at a time; only
+        # valid for MDB_DUPFIXED databases of long values
+        cdef cmdb.MDB_cursor *cursor
+        cdef cmdb.MDB_val api_key
+        cdef cmdb.MDB_val api_value
+        cdef long ikey
+        cdef int err
+        cdef array.array values = array.array('l')
+
+        self.set_key(&api_key, key, &ikey)
+        err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursor)
+        if err:
+            raise Exception("Error creating cursor: %s"
+                            % cmdb.mdb_strerror(err))
+        try:
+            with nogil:
+                err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                      &api_value, cmdb.MDB_SET)
+                if not err:
+                    # leaves the single value from MDB_SET in place when
+                    # the key has no dups
+                    err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                          &api_value, cmdb.MDB_GET_MULTIPLE)
+            while not err:
+                array.extend_buffer(values, <char *>api_value.mv_data,
+                                    api_value.mv_size // sizeof(long))
+                with nogil:
+                    err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                          &api_value, cmdb.MDB_NEXT_MULTIPLE)
+            if err != cmdb.MDB_NOTFOUND:
+                raise Exception("Error getting data: %s"
+                                % cmdb.mdb_strerror(err))
+        finally:
+            cmdb.mdb_cursor_close(cursor)
+        return values
+
+    cdef object dup_sets(self, Txn txn, keys, int op, limit):
+        # intersect, union or subtract the dups of keys as an array('l'),
+        # in the order of the database: as unsigned longs. Only valid for
+        # MDB_DUPFIXED databases of long values
+        cdef cmdb.MDB_cursor **cursors
+        cdef cmdb.MDB_val *api_keys
+        cdef cmdb.MDB_val api_value
+        cdef unsigned long *heads
+        cdef size_t *counts
+        cdef long *ikeys
+        cdef size_t i, nkeys, bound, n = 0
+        cdef size_t max_n = <size_t>-1 if limit is None else limit
+        cdef int err = 0
+        cdef array.array values = array.array('l')
+
+        keys = list(keys)
+        nkeys = len(keys)
+        if not nkeys or not max_n:
+            return values
+        cursors = <cmdb.MDB_cursor **>PyMem_Malloc(
+            nkeys * sizeof(cmdb.MDB_cursor *))
+        api_keys = <cmdb.MDB_val *>PyMem_Malloc(nkeys * sizeof(cmdb.MDB_val))
+        heads = <unsigned long *>PyMem_Malloc(nkeys * sizeof(unsigned long))
+        counts = <size_t *>PyMem_Malloc(nkeys * sizeof(size_t))
+        ikeys = <long *>PyMem_Malloc(nkeys * sizeof(long))
+        try:
+            if (cursors == NULL or api_keys == NULL or heads == NULL or
+                    counts == NULL or ikeys == NULL):
+                raise MemoryError()
+            memset(cursors, 0, nkeys * sizeof(cmdb.MDB_cursor *))
+            for i in range(nkeys):
+                self.set_key(&api_keys[i], keys[i], &ikeys[i])
+                err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursors[i])
+                if err:
+                    raise Exception("Error creating cursor: %s"
+                                    % cmdb.mdb_strerror(err))
+                with nogil:
+                    err = _step_dup(self.metrics, cursors[i], &api_keys[i],
+                                    &heads[i], cmdb.MDB_SET)
+                    counts[i] = 0
+                    if not err:
+                        err = cmdb.mdb_cursor_count(cursors[i], &counts[i])
+                if err and err != cmdb.MDB_NOTFOUND:
+                    raise Exception("Error getting data: %s"
+                                    % cmdb.mdb_strerror(err))
+
+            if op == _INTERSECT:
+                # the smallest list leads, and bounds the result
+                bound = counts[0]
+                for i in range(1, nkeys):
+                    if counts[i] < bound:
+                        bound = counts[i]
+                        cursors[0], cursors[i] = cursors[i], cursors[0]
+                        api_keys[0], api_keys[i] = api_keys[i], api_keys[0]
+                        heads[0], heads[i] = heads[i], heads[0]
+                        counts[0], counts[i] = counts[i], counts[0]
+            elif op == _UNION:
+                bound = 0
+                for i in range(nkeys):
+                    bound += counts[i]
+            else:
+                bound = counts[0]
+            bound = min(bound, max_n)
+            if not bound:
+                return values
+            array.resize(values, bound)
+            with nogil:
+                if op == _INTERSECT:
+                    n = _intersect_dups(self.metrics, cursors, api_keys,
+                                        heads, nkeys, values.data.as_longs,
+                                        bound, &err)
+                elif op == _UNION:
+                    n = _union_dups(self.metrics, cursors, api_keys, heads,
+                                    counts, nkeys, values.data.as_longs,
+                                    bound, &err)
+                else:
+                    n = _difference_dups(self.metrics, cursors, api_keys,
+                                         heads, counts, nkeys,
+                                         values.data.as_longs, bound, &err)
+            if err and err != cmdb.MDB_NOTFOUND:
+                raise Exception("Error getting data: %s"
+                                % cmdb.mdb_strerror(err))
+            array.resize(values, n)
+        finally:
+            if cursors != NULL:
+                for i in range(nkeys):
+                    if cursors[i] != NULL:
+                        cmdb.mdb_cursor_close(cursors[i])
+            PyMem_Free(cursors)
+            PyMem_Free(api_keys)
+            PyMem_Free(heads)
+            PyMem_Free(counts)
+            PyMem_Free(ikeys)
+        return values
+
+    cdef object put_dup_array(self, Txn txn, key, values,
+                              unsigned int flags):
+        # write a buffer of longs as dups of key with one MDB_MULTIPLE put;
+        # only valid for MDB_DUPFIXED databases of long values
+        cdef cmdb.MDB_cursor *cursor
+        cdef cmdb.MDB_val api_key
+        cdef cmdb.MDB_val api_values[2]
+        cdef Py_buffer view
+        cdef bint has_view = False
+        cdef void *buf
+        cdef Py_ssize_t nbytes
+        cdef long ikey
+        cdef int err
+
+        # arrays are read directly, as they lack the buffer interface on
+        # Python 2
+        if not isinstance(values, array.array):
+            try:
+                PyObject_GetBuffer(values, &view, PyBUF_ND | PyBUF_FORMAT)
+            except TypeError:
+                values = array.array('l', values)
+            else:
+                has_view = True
+                if not _is_long_format(view.format):
+                    PyBuffer_Release(&view)
+                    raise TypeError("Error putting data: values are not longs")
+                buf = view.buf
+                nbytes = view.len
+        if not has_view:
+            if values.itemsize != sizeof(long) or values.typecode not in 'lq':
+                raise TypeError("Error putting data: values are not longs")
+            buf = (<array.array>values).data.as_voidptr
+            nbytes = len(values) * sizeof(long)
+        try:
+            if not nbytes:
+                return 0
+            self.set_key(&api_key, key, &ikey)
+            api_values[0].mv_size = sizeof(long)
+            api_values[0].mv_data = buf
+            api_values[1].mv_size = nbytes // sizeof(long)
+            api_values[1].mv_data = NULL
+            err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursor)
+            if err:
+                raise Exception("Error creating cursor: %s"
+                                % cmdb.mdb_strerror(err))
+            with nogil:
+                err = _mdb_cursor_put(self.metrics, cursor, &api_key,
+                                      api_values, flags | cmdb.MDB_MULTIPLE)
+                cmdb.mdb_cursor_close(cursor)
+        finally:
+            if has_view:
+                PyBuffer_Release(&view)
+        if err == cmdb.MDB_MAP_FULL:
+            raise MapFullError("Error putting data: %s"
+                               % cmdb.mdb_strerror(err))
+        elif err == cmdb.MDB_TXN_FULL:
+            raise TxnFullError("Error putting data: %s"
+                               % cmdb.mdb_strerror(err))
+        elif err == cmdb.MDB_KEYEXIST:
+            raise KeyExistError("Error putting data: %s"
+                                % cmdb.mdb_strerror(err))
+        elif err:
+            raise Exception("Error putting data: %s" % cmdb.mdb_strerror(err))
+        return api_values[1].mv_size
+
     def get_ne(self, Txn txn, key_):
-        for key, value in self.dup_items(txn):
-            if key != key_:
-                yield key, value
+        """Return all the key values except those of key_, whose dups are
+        skipped with MDB_NEXT_NODUP.
+
+        Keys are compared with key_ by mdb_cmp only until the scan passes
+        it, as they come in order.
+        """
+        cdef cmdb.MDB_cursor *cursor
+        cdef cmdb.MDB_val api_key
+        cdef cmdb.MDB_val api_value
+        cdef cmdb.MDB_val api_excluded
+        cdef bint pending = True
+        cdef long ikey
+        cdef int err, cmp
+
+        self.set_key(&api_excluded, key_, &ikey)
+        err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursor)
+        if err:
+            raise Exception("Error creating Cursor: %s"
+                    % cmdb.mdb_strerror(err))
+        try:
+            with nogil:
+                err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                      &api_value, cmdb.MDB_FIRST)
+            while not err:
+                if pending:
+                    cmp = cmdb.mdb_cmp(txn.txn, self.dbi, &api_key,
+                                       &api_excluded)
+                    if cmp >= 0:
+                        pending = False
+                    if cmp == 0:
+                        with nogil:
+                            err = _mdb_cursor_get(self.metrics, cursor,
+                                                  &api_key, &api_value,
+                                                  cmdb.MDB_NEXT_NODUP)
+                        continue
+                yield self.key_of(&api_key), self.value_of(&api_value)
+                with nogil:
+                    err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                          &api_value, cmdb.MDB_NEXT)
+            if err != cmdb.MDB_NOTFOUND:
+                raise Exception("Error getting data: %s"
+                                % cmdb.mdb_strerror(err))
+        finally:
+            cmdb.mdb_cursor_close(cursor)
+
+    def get_range(self, Txn txn, start=None, end=None, bint reverse=False,
+                  limit=None):
+        """Return the key values with start <= key <= end, in key order or
+        in reverse order. A bound of None leaves that side open, and at
+        most limit key values are returned unless it is None.
+        """
+        return self._scan(txn, start, end, reverse, limit, True, True)
+
+    def get_lt(self, Txn txn, key, bint reverse=False, limit=None):
+        """Return the key values with keys less than key, see get_range.
+
+        With reverse, the cursor seeks straight to key and walks backwards,
+        so the cost only depends on the number of key values returned.
+        """
+        return self._scan(txn, None, key, reverse, limit, True, False)
+
+    def get_le(self, Txn txn, key, bint reverse=False, limit=None):
+        """Return the key values with keys less than or equal to key, see
+        get_lt.
+        """
+        return self._scan(txn, None, key, reverse, limit, True, True)
+
+    def _scan(self, Txn txn, start, end, bint reverse, limit,
+              bint include_start, bint include_end):
+        cdef cmdb.MDB_cursor *cursor
+        cdef cmdb.MDB_val api_key
+        cdef cmdb.MDB_val api_value
+        cdef cmdb.MDB_val api_start
+        cdef cmdb.MDB_val api_end
+        cdef long istart, iend
+        cdef unsigned int op
+        cdef int err, cmp
+        cdef long count = 0
+
+        if start is not None:
+            self.set_key(&api_start, start, &istart)
+        if end is not None:
+            self.set_key(&api_end, end, &iend)
+        if start is not None and end is not None and \
+                cmdb.mdb_cmp(txn.txn, self.dbi, &api_start, &api_end) > 0:
+            raise KeyError("Keys are out of order")
+        err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursor)
+        if err:
+            raise Exception("Error creating Cursor: %s"
+                    % cmdb.mdb_strerror(err))
+        try:
+            if not reverse:
+                op = cmdb.MDB_NEXT
+                if start is None:
+                    with nogil:
+                        err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                              &api_value, cmdb.MDB_FIRST)
+                else:
+                    api_key = api_start
+                    with nogil:
+                        err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                              &api_value, cmdb.MDB_SET_RANGE)
+                        if not err and not include_start and \
+                                cmdb.mdb_cmp(txn.txn, self.dbi,
+                                             &api_key, &api_start) == 0:
+                            err = _mdb_cursor_get(self.metrics, cursor,
+                                                  &api_key, &api_value,
+                                                  cmdb.MDB_NEXT_NODUP)
+            else:
+                op = cmdb.MDB_PREV
+                if end is None:
+                    with nogil:
+                        err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                              &api_value, cmdb.MDB_LAST)
+                else:
+                    # seek to the first key >= end, then step back onto
+                    # the last dup of the last key within the range
+                    api_key = api_end
+                    with nogil:
+                        err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                              &api_value, cmdb.MDB_SET_RANGE)
+                        if err == cmdb.MDB_NOTFOUND:
+                            err = _mdb_cursor_get(self.metrics, cursor,
+                                                  &api_key, &api_value,
+                                                  cmdb.MDB_LAST)
+                        elif not err:
+                            cmp = cmdb.mdb_cmp(txn.txn, self.dbi,
+                                               &api_key, &api_end)
+                            if cmp > 0 or (cmp == 0 and not include_end):
+                                err = _mdb_cursor_get(self.metrics, cursor,
+                                                      &api_key, &api_value,
+                                                      cmdb.MDB_PREV)
+                            else:
+                                # step past the dups of end and back, as
+                                # MDB_LAST_DUP fails without MDB_DUPSORT
+                                err = _mdb_cursor_get(self.metrics, cursor,
+                                                      &api_key, &api_value,
+                                                      cmdb.MDB_NEXT_NODUP)
+                                if err == cmdb.MDB_NOTFOUND:
+                                    op = cmdb.MDB_LAST
+                                elif not err:
+                                    op = cmdb.MDB_PREV
+                                err = _mdb_cursor_get(self.metrics, cursor,
+                                                      &api_key, &api_value, op)
+                                op = cmdb.MDB_PREV
+            while not err:
+                if limit is not None and count >= limit:
+                    break
+                if not reverse and end is not None:
+                    cmp = cmdb.mdb_cmp(txn.txn, self.dbi, &api_key, &api_end)
+                    if cmp > 0 or (cmp == 0 and not include_end):
+                        break
+                if reverse and start is not None:
+                    cmp = cmdb.mdb_cmp(txn.txn, self.dbi,
+                                       &api_key, &api_start)
+                    if cmp < 0 or (cmp == 0 and not include_start):
+                        break
+                yield self.key_of(&api_key), self.value_of(&api_value)
+                count += 1
+                with nogil:
+                    err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                          &api_value, op)
+        finally:
+            cmdb.mdb_cursor_close(cursor)
+
+    def _keys_at(self, Txn txn, ranks):
+        """Return, for each of the ascending entry positions ranks, the
+        first key whose entries start at or after it, walking the keys
+        once with a cursor and counting their dups. Used by split_keys.
+        """
+        cdef cmdb.MDB_cursor *cursor
+        cdef cmdb.MDB_val api_key
+        cdef cmdb.MDB_val api_value
+        cdef unsigned int op = cmdb.MDB_FIRST
+        cdef size_t pos = 0, target, count
+        cdef int err = 0
+        cdef list keys = []
+
+        err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursor)
+        if err:
+            raise Exception("Error creating Cursor: %s"
+                    % cmdb.mdb_strerror(err))
+        try:
+            for rank in ranks:
+                target = rank
+                with nogil:
+                    while True:
+                        err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                              &api_value, op)
+                        if err or pos >= target:
+                            break
+                        # fails with EINVAL without MDB_DUPSORT
+                        if cmdb.mdb_cursor_count(cursor, &count):
+                            count = 1
+                        pos += count
+                        op = cmdb.MDB_NEXT_NODUP
+                if err == cmdb.MDB_NOTFOUND:
+                    break
+                elif err:
+                    raise Exception("Error getting data: %s"
+                                    % cmdb.mdb_strerror(err))
+                keys.append(self.key_of(&api_key))
+                # count the key found before moving on from it
+                op = cmdb.MDB_GET_CURRENT
+        finally:
+            cmdb.mdb_cursor_close(cursor)
+        return keys
+
+    def get_prefix(self, Txn txn, prefix, limit=None):
+        """Return the key values whose key starts with prefix, in key
+        order, seeking straight to the first of them.
+        """
+        cdef cmdb.MDB_cursor *cursor
+        cdef cmdb.MDB_val api_key
+        cdef cmdb.MDB_val api_value
+        cdef char *prefix_ = prefix
+        cdef size_t prefix_len = len(prefix)
+        cdef unsigned int op
+        cdef int err
+        cdef long count = 0
+
+        err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursor)
+        if err:
+            raise Exception("Error creating Cursor: %s"
+                    % cmdb.mdb_strerror(err))
+        api_key.mv_size = prefix_len
+        api_key.mv_data = prefix_
+        # LMDB rejects empty keys, an empty prefix matches all of them
+        op = cmdb.MDB_SET_RANGE
+        if not prefix_len:
+            op = cmdb.MDB_FIRST
+        try:
+            with nogil:
+                err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                      &api_value, op)
+            while not err:
+                if limit is not None and count >= limit:
+                    break
+                if api_key.mv_size < prefix_len or \
+                        memcmp(api_key.mv_data, prefix_, prefix_len):
+                    break
+                yield self.key_of(&api_key), self.value_of(&api_value)
+                count += 1
+                with nogil:
+                    err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                          &api_value, cmdb.MDB_NEXT)
+        finally:
+            cmdb.mdb_cursor_close(cursor)
 
 
 cdef class StrIntDB(DB):
@@ -401,16 +1648,22 @@ cdef class StrIntDB(DB):
         flags |= (MDB_DUPSORT | MDB_INTEGERDUP | MDB_DUPFIXED)
         super(StrIntDB, self).__init__(env, txn, name, flags)
 
+    cdef object value_of(self, cmdb.MDB_val *api_value):
+        return (<long *>api_value.mv_data)[0]
+
     def get(self, Txn txn, key):
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
         cdef size_t key_len
+        cdef int err
 
         key_len = len(key) + 1
         api_key.mv_size = key_len
         api_key.mv_data = <char*>key
 
-        err = cmdb.mdb_get(txn.txn, self.dbi, &api_key, &api_value)
+        with nogil:
+            err = _mdb_get(self.metrics, txn.txn, self.dbi, &api_key,
+                           &api_value)
         if err == cmdb.MDB_NOTFOUND:
             raise KeyNotFoundError("Error getting data: %s"
                                    % cmdb.mdb_strerror(err))
@@ -418,18 +1671,56 @@ cdef class StrIntDB(DB):
             raise Exception("Error getting data: %s" % cmdb.mdb_strerror(err))
         return  (<long *>api_value.mv_data)[0]
 
+    def get_dup_array(self, Txn txn, key):
+        """Return all the dups of key as an array.array('l'), empty if the
+        key is not found.
+
+        The dups are copied a page at a time with MDB_GET_MULTIPLE, so no
+        Python int is created per value; numpy.frombuffer can wrap the
+        result without another copy.
+        """
+        return self.dup_array(txn, key)
+
+    def intersect(self, Txn txn, keys, limit=None):
+        """Return the values that are dups of every one of keys as an
+        array.array('l'), at most limit of them.
+
+        The dup cursors of the keys leapfrog each other with
+        MDB_GET_BOTH_RANGE seeks, so the cost follows the shortest list
+        rather than the total. Values come in database order, which
+        compares them as unsigned.
+        """
+        return self.dup_sets(txn, keys, _INTERSECT, limit)
+
+    def union(self, Txn txn, keys, limit=None):
+        """Return the values that are dups of any of keys as an
+        array.array('l') without repeats, at most limit of them, see
+        intersect.
+        """
+        return self.dup_sets(txn, keys, _UNION, limit)
+
+    def difference(self, Txn txn, keys, limit=None):
+        """Return the dups of the first of keys that are dups of none of
+        the others as an array.array('l'), at most limit of them, see
+        intersect.
+        """
+        return self.dup_sets(txn, keys, _DIFFERENCE, limit)
+
     def put(self, Txn txn, key, long value, unsigned int flags=0):
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
         cdef size_t key_len = len(key)
         cdef size_t value_len = sizeof(long)
+        cdef int err
 
         api_key.mv_size = key_len + 1
         api_key.mv_data = <char*>key
         api_value.mv_size = value_len
         api_value.mv_data = <void *>&value
 
-        err = cmdb.mdb_put(txn.txn, self.dbi, &api_key, &api_value, flags)
+        with nogil:
+            err = _mdb_put(self.metrics, txn.txn, self.dbi, &api_key,
+                           &api_value, flags)
         if err == cmdb.MDB_MAP_FULL:
             raise MapFullError("Error putting data: %s"
                                % cmdb.mdb_strerror(err))
@@ -442,15 +1733,26 @@ cdef class StrIntDB(DB):
         elif err:
             raise Exception("Error putting data: %s" % cmdb.mdb_strerror(err))
 
+    def put_multiple(self, Txn txn, key, values, unsigned int flags=0):
+        """Store values, an array.array('l') or other buffer of longs, as
+        dups of key with a single MDB_MULTIPLE cursor put. Any other
+        iterable of ints is converted to an array first.
+
+        Returns the number of values written.
+        """
+        return self.put_dup_array(txn, key, values, flags)
+
     def delete(self, Txn txn, key, value=None):
         """Delete key/value from MDB
 
         If value is not specified, delete all values with this key. Otherwise,
-        delete the specified key/value.
+        delete the specified key/value. Raises KeyNotFoundError if there is
+        nothing to delete.
         """
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
         cdef long value_
+        cdef int err
 
         api_key.mv_size = len(key) + 1
         api_key.mv_data = <char*>key
@@ -458,13 +1760,22 @@ cdef class StrIntDB(DB):
             value_ = value
             api_value.mv_size = sizeof(long)
             api_value.mv_data = <void *>&value_
-            err = cmdb.mdb_del(txn.txn, self.dbi, &api_key, &api_value)
-            if err:
+            with nogil:
+                err = _mdb_del(self.metrics, txn.txn, self.dbi, &api_key,
+                               &api_value)
+            if err == cmdb.MDB_NOTFOUND:
+                raise KeyNotFoundError("Error deleting data: %s"
+                                       % cmdb.mdb_strerror(err))
+            elif err:
                 raise Exception("Error deleting data: %s"
                                 % cmdb.mdb_strerror(err))
         else:
-            err = cmdb.mdb_del(txn.txn, self.dbi, &api_key, NULL)
-            if err:
+            with nogil:
+                err = _mdb_del(self.metrics, txn.txn, self.dbi, &api_key, NULL)
+            if err == cmdb.MDB_NOTFOUND:
+                raise KeyNotFoundError("Error deleting data: %s"
+                                       % cmdb.mdb_strerror(err))
+            elif err:
                 raise Exception("Error deleting data: %s"
                                 % cmdb.mdb_strerror(err))
 
@@ -476,6 +1787,7 @@ cdef class StrIntDB(DB):
         cdef cmdb.MDB_val api_value
         cdef char *key_
         cdef long value_
+        cdef int err
 
         err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursor)
         if err:
@@ -487,8 +1799,12 @@ cdef class StrIntDB(DB):
         api_value.mv_data =  NULL
 
         try:
-            while not cmdb.mdb_cursor_get(cursor, &api_key,
-                                          &api_value, MDB_NEXT_NODUP):
+            while True:
+                with nogil:
+                    err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                          &api_value, cmdb.MDB_NEXT_NODUP)
+                if err:
+                    break
                 key_ = <char *>api_key.mv_data
                 value_ = (<long *>api_value.mv_data)[0]
                 yield key_[:api_value.mv_size-1], value_
@@ -503,6 +1819,7 @@ cdef class StrIntDB(DB):
         cdef cmdb.MDB_val api_value
         cdef long value_
         cdef char *key_
+        cdef int err
 
         err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursor)
         if err:
@@ -514,8 +1831,12 @@ cdef class StrIntDB(DB):
         api_value.mv_data =  NULL
 
         try:
-            while not cmdb.mdb_cursor_get(cursor, &api_key,
-                                          &api_value, MDB_NEXT):
+            while True:
+                with nogil:
+                    err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                          &api_value, cmdb.MDB_NEXT)
+                if err:
+                    break
                 key_ = <char *>api_key.mv_data
                 value_ = (<long *>api_value.mv_data)[0]
                 yield key_, value_
@@ -526,6 +1847,7 @@ cdef class StrIntDB(DB):
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
         cdef long value_
+        cdef int err
 
         api_key.mv_size = len(key) + 1
         api_key.mv_data = <char *>key
@@ -535,12 +1857,17 @@ cdef class StrIntDB(DB):
         if err:
             raise Exception("Error creating cursor: %s"
                             % cmdb.mdb_strerror(err))
-        if not cmdb.mdb_cursor_get(cursor, &api_key, &api_value, MDB_SET):
+        with nogil:
+            err = _mdb_cursor_get(self.metrics, cursor, &api_key, &api_value,
+                                  cmdb.MDB_SET)
+        if not err:
             value_ = (<long *>api_value.mv_data)[0]
             yield value_
             while True:
-                if not cmdb.mdb_cursor_get(cursor, &api_key,
-                                           &api_value, MDB_NEXT_DUP):
+                with nogil:
+                    err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                          &api_value, cmdb.MDB_NEXT_DUP)
+                if not err:
                     value_ = (<long *>api_value.mv_data)[0]
                     yield value_
                 else:
@@ -554,16 +1881,27 @@ cdef class IntStrDB(DB):
         flags |= MDB_INTEGERKEY
         super(IntStrDB, self).__init__(env, txn, name, flags)
 
+    cdef set_key(self, cmdb.MDB_val *api_key, key, long *ikey):
+        ikey[0] = key
+        api_key.mv_size = sizeof(long)
+        api_key.mv_data = <void *>ikey
+
+    cdef object key_of(self, cmdb.MDB_val *api_key):
+        return (<long *>api_key.mv_data)[0]
+
     def get(self, Txn txn, long key):
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
         cdef long ikey
+        cdef int err
 
         ikey = key
         api_key.mv_size = sizeof(long)
         api_key.mv_data = <void *>&ikey
 
-        err = cmdb.mdb_get(txn.txn, self.dbi, &api_key, &api_value)
+        with nogil:
+            err = _mdb_get(self.metrics, txn.txn, self.dbi, &api_key,
+                           &api_value)
         if err == cmdb.MDB_NOTFOUND:
             raise KeyNotFoundError("Error getting data: %s"
                                    % cmdb.mdb_strerror(err))
@@ -572,11 +1910,35 @@ cdef class IntStrDB(DB):
         cdef char *rval = <char*>api_value.mv_data
         return rval[:api_value.mv_size-1]
 
+    def get_buffer(self, Txn txn, long key):
+        """Like get, but return a read-only memoryview into the memory map,
+        see DB.get_buffer.
+        """
+        cdef cmdb.MDB_val api_key
+        cdef cmdb.MDB_val api_value
+        cdef long ikey
+        cdef int err
+
+        ikey = key
+        api_key.mv_size = sizeof(long)
+        api_key.mv_data = <void *>&ikey
+
+        with nogil:
+            err = _mdb_get(self.metrics, txn.txn, self.dbi, &api_key,
+                           &api_value)
+        if err == cmdb.MDB_NOTFOUND:
+            raise KeyNotFoundError("Error getting data: %s"
+                                   % cmdb.mdb_strerror(err))
+        elif err:
+            raise Exception("Error getting data: %s" % cmdb.mdb_strerror(err))
+        return txn.view(api_value.mv_data, api_value.mv_size - 1)
+
     def put(self, Txn txn, long key, value, unsigned int flags=0):
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
         cdef size_t value_len = len(value)
         cdef long ikey
+        cdef int err
 
         ikey = key
         api_key.mv_size = sizeof(long)
@@ -584,7 +1946,9 @@ cdef class IntStrDB(DB):
         api_value.mv_size = value_len + 1
         api_value.mv_data = <char *>value
 
-        err = cmdb.mdb_put(txn.txn, self.dbi, &api_key, &api_value, flags)
+        with nogil:
+            err = _mdb_put(self.metrics, txn.txn, self.dbi, &api_key,
+                           &api_value, flags)
         if err == cmdb.MDB_MAP_FULL:
             raise MapFullError("Error putting data: %s"
                                % cmdb.mdb_strerror(err))
@@ -602,11 +1966,13 @@ cdef class IntStrDB(DB):
         """Delete key/value from MDB
 
         If value is not specified, delete all values with this key. Otherwise,
-        delete the specified key/value.
+        delete the specified key/value. Raises KeyNotFoundError if there is
+        nothing to delete.
         """
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
         cdef long ikey
+        cdef int err
 
         ikey = key
         api_key.mv_size = sizeof(long)
@@ -614,13 +1980,22 @@ cdef class IntStrDB(DB):
         if value:
             api_value.mv_size = len(value) + 1
             api_value.mv_data = <char*>value
-            err = cmdb.mdb_del(txn.txn, self.dbi, &api_key, &api_value)
-            if err:
+            with nogil:
+                err = _mdb_del(self.metrics, txn.txn, self.dbi, &api_key,
+                               &api_value)
+            if err == cmdb.MDB_NOTFOUND:
+                raise KeyNotFoundError("Error deleting data: %s"
+                                       % cmdb.mdb_strerror(err))
+            elif err:
                 raise Exception("Error deleting data: %s"
                                 % cmdb.mdb_strerror(err))
         else:
-            err = cmdb.mdb_del(txn.txn, self.dbi, &api_key, NULL)
-            if err:
+            with nogil:
+                err = _mdb_del(self.metrics, txn.txn, self.dbi, &api_key, NULL)
+            if err == cmdb.MDB_NOTFOUND:
+                raise KeyNotFoundError("Error deleting data: %s"
+                                       % cmdb.mdb_strerror(err))
+            elif err:
                 raise Exception("Error deleting data: %s"
                                 % cmdb.mdb_strerror(err))
 
@@ -632,6 +2007,7 @@ cdef class IntStrDB(DB):
         cdef cmdb.MDB_val api_value
         cdef char *value_
         cdef long key_
+        cdef int err
 
         err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursor)
         if err:
@@ -643,8 +2019,12 @@ cdef class IntStrDB(DB):
         api_value.mv_data = NULL
 
         try:
-            while not cmdb.mdb_cursor_get(cursor, &api_key,
-                                          &api_value, MDB_NEXT_NODUP):
+            while True:
+                with nogil:
+                    err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                          &api_value, cmdb.MDB_NEXT_NODUP)
+                if err:
+                    break
                 value_ = <char*>api_value.mv_data
                 key_ = (<long*>api_key.mv_data)[0]
                 yield key_, value_[:api_value.mv_size-1]
@@ -659,6 +2039,7 @@ cdef class IntStrDB(DB):
         cdef cmdb.MDB_val api_value
         cdef char *value_
         cdef long key_
+        cdef int err
 
         err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursor)
         if err:
@@ -670,8 +2051,12 @@ cdef class IntStrDB(DB):
         api_value.mv_data = NULL
 
         try:
-            while not cmdb.mdb_cursor_get(cursor, &api_key,
-                                          &api_value, MDB_NEXT):
+            while True:
+                with nogil:
+                    err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                          &api_value, cmdb.MDB_NEXT)
+                if err:
+                    break
                 value_ = <char*>api_value.mv_data
                 key_ = (<long*>api_key.mv_data)[0]
                 yield key_, value_[:api_value.mv_size-1]
@@ -684,6 +2069,7 @@ cdef class IntStrDB(DB):
         cdef char *value_
         cdef long ikey
         cdef cmdb.MDB_cursor *cursor
+        cdef int err
 
         err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursor)
         if err:
@@ -694,12 +2080,17 @@ cdef class IntStrDB(DB):
         api_key.mv_data = <void *>&ikey
 
         try:
-            if not cmdb.mdb_cursor_get(cursor, &api_key, &api_value, MDB_SET):
+            with nogil:
+                err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                      &api_value, cmdb.MDB_SET)
+            if not err:
                 value_ = <char*>api_value.mv_data
                 yield value_[:api_value.mv_size-1]
                 while True:
-                    if not cmdb.mdb_cursor_get(cursor, &api_key,
-                                            &api_value, MDB_NEXT_DUP):
+                    with nogil:
+                        err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                              &api_value, cmdb.MDB_NEXT_DUP)
+                    if not err:
                         value_ = <char*>api_value.mv_data
                         yield value_[:api_value.mv_size-1]
                     else:
@@ -707,47 +2098,13 @@ cdef class IntStrDB(DB):
         finally:
             cmdb.mdb_cursor_close(cursor)
 
-    def get_lt(self, Txn txn, long key):
-        cdef cmdb.MDB_cursor *cursor
-        cdef cmdb.MDB_val api_key
-        cdef cmdb.MDB_val api_value
-        cdef char *value_
-        cdef long key_
-
-        err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursor)
-        if err:
-            raise Exception("Error creating Cursor: %s"
-                    % cmdb.mdb_strerror(err))
-        api_key.mv_size = sizeof(long)
-        api_key.mv_data = <void*>&key_
-        api_value.mv_size = 0
-        api_value.mv_data = NULL
-
-        try:
-            while not cmdb.mdb_cursor_get(cursor, &api_key,
-                                          &api_value, MDB_NEXT):
-                value_ = <char*>api_value.mv_data
-                key_ = (<long*>api_key.mv_data)[0]
-                if key_ < key:
-                    yield key_, value_[:api_value.mv_size-1]
-                else:
-                    break
-        finally:
-            cmdb.mdb_cursor_close(cursor)
-
-    def get_le(self, Txn txn, long key_):
-        for key, value in self.get_lt(txn, key_):
-            yield key, value
-        for key, value in self.get_eq(txn, key_):
-            yield key, value
-
-
     def get_gt(self, Txn txn, long key):
         cdef cmdb.MDB_cursor *cursor
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
         cdef char *value_
         cdef long key_
+        cdef int err
 
         err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursor)
         if err:
@@ -760,17 +2117,24 @@ cdef class IntStrDB(DB):
         api_value.mv_data = NULL
 
         try:
-            if not cmdb.mdb_cursor_get(cursor, &api_key,
-                                    &api_value, MDB_SET_RANGE):
+            with nogil:
+                err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                      &api_value, cmdb.MDB_SET_RANGE)
+            if not err:
                 key_ = (<long*>api_key.mv_data)[0]
                 if key == key_:
                     # if the key is present, skip all the possible dups
                     api_value.mv_size = 0
                     api_value.mv_data = NULL
-                    cmdb.mdb_cursor_get(cursor, &api_key,
-                                        &api_value, MDB_LAST_DUP)
-                while not cmdb.mdb_cursor_get(cursor, &api_key,
-                                                &api_value, MDB_NEXT):
+                    with nogil:
+                        _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                        &api_value, cmdb.MDB_LAST_DUP)
+                while True:
+                    with nogil:
+                        err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                              &api_value, cmdb.MDB_NEXT)
+                    if err:
+                        break
                     value_ = <char*>api_value.mv_data
                     key_ = (<long*>api_key.mv_data)[0]
                     yield key_, value_[:api_value.mv_size-1]
@@ -785,15 +2149,6 @@ cdef class IntStrDB(DB):
         for key, value in self.get_gt(txn, key_):
             yield key, value
 
-    def get_range(self, Txn txn, long key_begin, long key_end):
-        if key_begin > key_end:
-            raise KeyError("Keys are out of order")
-        for key, value in self.get_ge(txn, key_begin):
-            if key <= key_end:
-                yield key, value
-            else:
-                break
-
 
 cdef class IntIntDB(DB):
     def __init__(self, Env env, Txn txn, name=None,
@@ -801,16 +2156,30 @@ cdef class IntIntDB(DB):
         flags |= (MDB_INTEGERKEY | MDB_INTEGERDUP | MDB_DUPFIXED)
         super(IntIntDB, self).__init__(env, txn, name, flags)
 
+    cdef set_key(self, cmdb.MDB_val *api_key, key, long *ikey):
+        ikey[0] = key
+        api_key.mv_size = sizeof(long)
+        api_key.mv_data = <void *>ikey
+
+    cdef object key_of(self, cmdb.MDB_val *api_key):
+        return (<long *>api_key.mv_data)[0]
+
+    cdef object value_of(self, cmdb.MDB_val *api_value):
+        return (<long *>api_value.mv_data)[0]
+
     def get(self, Txn txn, long key):
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
         cdef long ikey, value
+        cdef int err
 
         ikey = key
         api_key.mv_size = sizeof(long)
         api_key.mv_data = <void *>&ikey
 
-        err = cmdb.mdb_get(txn.txn, self.dbi, &api_key, &api_value)
+        with nogil:
+            err = _mdb_get(self.metrics, txn.txn, self.dbi, &api_key,
+                           &api_value)
         if err == cmdb.MDB_NOTFOUND:
             raise KeyNotFoundError("Error getting data: %s"
                                    % cmdb.mdb_strerror(err))
@@ -819,10 +2188,46 @@ cdef class IntIntDB(DB):
         value = (<long*>api_value.mv_data)[0]
         return value
 
+    def get_dup_array(self, Txn txn, key):
+        """Return all the dups of key as an array.array('l'), empty if the
+        key is not found.
+
+        The dups are copied a page at a time with MDB_GET_MULTIPLE, so no
+        Python int is created per value; numpy.frombuffer can wrap the
+        result without another copy.
+        """
+        return self.dup_array(txn, key)
+
+    def intersect(self, Txn txn, keys, limit=None):
+        """Return the values that are dups of every one of keys as an
+        array.array('l'), at most limit of them.
+
+        The dup cursors of the keys leapfrog each other with
+        MDB_GET_BOTH_RANGE seeks, so the cost follows the shortest list
+        rather than the total. Values come in database order, which
+        compares them as unsigned.
+        """
+        return self.dup_sets(txn, keys, _INTERSECT, limit)
+
+    def union(self, Txn txn, keys, limit=None):
+        """Return the values that are dups of any of keys as an
+        array.array('l') without repeats, at most limit of them, see
+        intersect.
+        """
+        return self.dup_sets(txn, keys, _UNION, limit)
+
+    def difference(self, Txn txn, keys, limit=None):
+        """Return the dups of the first of keys that are dups of none of
+        the others as an array.array('l'), at most limit of them, see
+        intersect.
+        """
+        return self.dup_sets(txn, keys, _DIFFERENCE, limit)
+
     def put(self, Txn txn, long key, long value, unsigned int flags=0):
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
         cdef long ikey
+        cdef int err
 
         ikey = key
         api_key.mv_size = sizeof(long)
@@ -830,7 +2235,9 @@ cdef class IntIntDB(DB):
         api_value.mv_size = sizeof(long)
         api_value.mv_data = <void *>&value
 
-        err = cmdb.mdb_put(txn.txn, self.dbi, &api_key, &api_value, flags)
+        with nogil:
+            err = _mdb_put(self.metrics, txn.txn, self.dbi, &api_key,
+                           &api_value, flags)
         if err == cmdb.MDB_MAP_FULL:
             raise MapFullError("Error putting data: %s"
                                % cmdb.mdb_strerror(err))
@@ -844,15 +2251,26 @@ cdef class IntIntDB(DB):
             raise Exception("Error putting data: %s" % cmdb.mdb_strerror(err))
 
 
+    def put_multiple(self, Txn txn, key, values, unsigned int flags=0):
+        """Store values, an array.array('l') or other buffer of longs, as
+        dups of key with a single MDB_MULTIPLE cursor put. Any other
+        iterable of ints is converted to an array first.
+
+        Returns the number of values written.
+        """
+        return self.put_dup_array(txn, key, values, flags)
+
     def delete(self, Txn txn, long key, value=None):
         """Delete key/value from MDB
 
         If value is not specified, delete all values with this key. Otherwise,
-        delete the specified key/value.
+        delete the specified key/value. Raises KeyNotFoundError if there is
+        nothing to delete.
         """
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
         cdef long ikey, value_
+        cdef int err
 
         ikey = key
         api_key.mv_size = sizeof(long)
@@ -861,13 +2279,22 @@ cdef class IntIntDB(DB):
             value_ = value
             api_value.mv_size = sizeof(long)
             api_value.mv_data = <void *>&value_
-            err = cmdb.mdb_del(txn.txn, self.dbi, &api_key, &api_value)
-            if err:
+            with nogil:
+                err = _mdb_del(self.metrics, txn.txn, self.dbi, &api_key,
+                               &api_value)
+            if err == cmdb.MDB_NOTFOUND:
+                raise KeyNotFoundError("Error deleting data: %s"
+                                       % cmdb.mdb_strerror(err))
+            elif err:
                 raise Exception("Error deleting data: %s"
                                 % cmdb.mdb_strerror(err))
         else:
-            err = cmdb.mdb_del(txn.txn, self.dbi, &api_key, NULL)
-            if err:
+            with nogil:
+                err = _mdb_del(self.metrics, txn.txn, self.dbi, &api_key, NULL)
+            if err == cmdb.MDB_NOTFOUND:
+                raise KeyNotFoundError("Error deleting data: %s"
+                                       % cmdb.mdb_strerror(err))
+            elif err:
                 raise Exception("Error deleting data: %s"
                                 % cmdb.mdb_strerror(err))
 
@@ -878,6 +2305,7 @@ cdef class IntIntDB(DB):
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
         cdef long key, value
+        cdef int err
 
         err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursor)
         if err:
@@ -889,8 +2317,12 @@ cdef class IntIntDB(DB):
         api_value.mv_data = NULL
 
         try:
-            while not cmdb.mdb_cursor_get(cursor, &api_key,
-                                          &api_value, MDB_NEXT_NODUP):
+            while True:
+                with nogil:
+                    err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                          &api_value, cmdb.MDB_NEXT_NODUP)
+                if err:
+                    break
                 value = (<long*>api_value.mv_data)[0]
                 key = (<long*>api_key.mv_data)[0]
                 yield key, value
@@ -904,6 +2336,7 @@ cdef class IntIntDB(DB):
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
         cdef long key, value
+        cdef int err
 
         err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursor)
         if err:
@@ -915,8 +2348,12 @@ cdef class IntIntDB(DB):
         api_value.mv_data = NULL
 
         try:
-            while not cmdb.mdb_cursor_get(cursor, &api_key,
-                                          &api_value, MDB_NEXT):
+            while True:
+                with nogil:
+                    err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                          &api_value, cmdb.MDB_NEXT)
+                if err:
+                    break
                 key = (<long*>api_key.mv_data)[0]
                 value = (<long*>api_value.mv_data)[0]
                 yield key, value
@@ -928,6 +2365,7 @@ cdef class IntIntDB(DB):
         cdef cmdb.MDB_val api_value
         cdef long ikey, value
         cdef cmdb.MDB_cursor *cursor
+        cdef int err
 
         err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursor)
         if err:
@@ -938,12 +2376,17 @@ cdef class IntIntDB(DB):
         api_key.mv_data = <void *>&ikey
 
         try:
-            if not cmdb.mdb_cursor_get(cursor, &api_key, &api_value, MDB_SET):
+            with nogil:
+                err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                      &api_value, cmdb.MDB_SET)
+            if not err:
                 value = (<long *>api_value.mv_data)[0]
                 yield value
                 while True:
-                    if not cmdb.mdb_cursor_get(cursor, &api_key,
-                                               &api_value, MDB_NEXT_DUP):
+                    with nogil:
+                        err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                              &api_value, cmdb.MDB_NEXT_DUP)
+                    if not err:
                         value = (<long *>api_value.mv_data)[0]
                         yield value
                     else:
@@ -951,109 +2394,253 @@ cdef class IntIntDB(DB):
         finally:
             cmdb.mdb_cursor_close(cursor)
 
-    def get_lt(self, Txn txn, long key):
+    def get_gt(self, Txn txn, long key):
         cdef cmdb.MDB_cursor *cursor
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
         cdef long key_, value
+        cdef int err
 
         err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursor)
         if err:
             raise Exception("Error creating Cursor: %s"
                     % cmdb.mdb_strerror(err))
+        key_ = key
         api_key.mv_size = sizeof(long)
         api_key.mv_data = <void*>&key_
         api_value.mv_size = 0
         api_value.mv_data = NULL
 
         try:
-            while not cmdb.mdb_cursor_get(cursor, &api_key,
-                                          &api_value, MDB_NEXT):
-                value = (<long *>api_value.mv_data)[0]
+            with nogil:
+                err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                      &api_value, cmdb.MDB_SET_RANGE)
+            if not err:
                 key_ = (<long*>api_key.mv_data)[0]
-                if key_ < key:
+                if key == key_:
+                    # if the key is present, skip all the possible dups
+                    api_value.mv_size = 0
+                    api_value.mv_data = NULL
+                    with nogil:
+                        _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                        &api_value, cmdb.MDB_LAST_DUP)
+                while True:
+                    with nogil:
+                        err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                              &api_value, cmdb.MDB_NEXT)
+                    if err:
+                        break
+                    key_ = (<long*>api_key.mv_data)[0]
+                    value = (<long *>api_value.mv_data)[0]
                     yield key_, value
-                else:
-                    break
+            else:
+                yield None, None
         finally:
             cmdb.mdb_cursor_close(cursor)
 
-    def get_le(self, Txn txn, long key_):
-        for key, value in self.get_lt(txn, key_):
-            yield key, value
+    def get_ge(self, Txn txn, long key_):
         for key, value in self.get_eq(txn, key_):
             yield key, value
+        for key, value in self.get_gt(txn, key_):
+            yield key, value
 
 
-    def get_gt(self, Txn txn, long key):
+cdef class BytesDB(DB):
+    """A DB of binary keys and values stored with their exact length.
+
+    Unlike DB, no NUL byte is appended, so keys and values may hold any
+    bytes. Keys must be bytes, anything else raises TypeError; values may
+    be any object supporting the buffer protocol and are written without
+    an intermediate copy.
+    """
+    cdef set_key(self, cmdb.MDB_val *api_key, key, long *ikey):
+        if not isinstance(key, bytes):
+            raise TypeError("Error using key: expected bytes, got %s"
+                            % type(key).__name__)
+        api_key.mv_size = len(key)
+        api_key.mv_data = <char*>key
+
+    cdef object key_of(self, cmdb.MDB_val *api_key):
+        return (<char*>api_key.mv_data)[:api_key.mv_size]
+
+    cdef object value_of(self, cmdb.MDB_val *api_value):
+        return (<char*>api_value.mv_data)[:api_value.mv_size]
+
+    def get(self, Txn txn, key):
+        cdef cmdb.MDB_val api_key
+        cdef cmdb.MDB_val api_value
+        cdef int err
+
+        self.set_key(&api_key, key, NULL)
+        with nogil:
+            err = _mdb_get(self.metrics, txn.txn, self.dbi, &api_key,
+                           &api_value)
+        if err == cmdb.MDB_NOTFOUND:
+            raise KeyNotFoundError("Error getting data: %s"
+                                   % cmdb.mdb_strerror(err))
+        elif err:
+            raise Exception("Error getting data: %s" % cmdb.mdb_strerror(err))
+        return self.value_of(&api_value)
+
+    def get_buffer(self, Txn txn, key):
+        """Like get, but return a read-only memoryview pointing directly
+        into the memory map, see DB.get_buffer.
+        """
+        cdef cmdb.MDB_val api_key
+        cdef cmdb.MDB_val api_value
+        cdef int err
+
+        self.set_key(&api_key, key, NULL)
+        with nogil:
+            err = _mdb_get(self.metrics, txn.txn, self.dbi, &api_key,
+                           &api_value)
+        if err == cmdb.MDB_NOTFOUND:
+            raise KeyNotFoundError("Error getting data: %s"
+                                   % cmdb.mdb_strerror(err))
+        elif err:
+            raise Exception("Error getting data: %s" % cmdb.mdb_strerror(err))
+        return txn.view(api_value.mv_data, api_value.mv_size)
+
+    def put(self, Txn txn, key, value, unsigned int flags=0):
+        cdef cmdb.MDB_val api_key
+        cdef cmdb.MDB_val api_value
+        cdef Py_buffer view
+        cdef int err
+
+        self.set_key(&api_key, key, NULL)
+        PyObject_GetBuffer(value, &view, PyBUF_SIMPLE)
+        api_value.mv_size = view.len
+        api_value.mv_data = view.buf
+        try:
+            with nogil:
+                err = _mdb_put(self.metrics, txn.txn, self.dbi, &api_key,
+                               &api_value, flags)
+        finally:
+            PyBuffer_Release(&view)
+        if err == cmdb.MDB_MAP_FULL:
+            raise MapFullError("Error putting data: %s"
+                               % cmdb.mdb_strerror(err))
+        elif err == cmdb.MDB_TXN_FULL:
+            raise TxnFullError("Error putting data: %s"
+                               % cmdb.mdb_strerror(err))
+        elif err == cmdb.MDB_KEYEXIST:
+            raise KeyExistError("Error putting data: %s"
+                                % cmdb.mdb_strerror(err))
+        elif err:
+            raise Exception("Error putting data: %s" % cmdb.mdb_strerror(err))
+
+    def delete(self, Txn txn, key, value=None):
+        """Delete key/value from MDB
+
+        If value is not specified, delete all values with this key. Otherwise,
+        delete the specified key/value. Raises KeyNotFoundError if there is
+        nothing to delete.
+        """
+        cdef cmdb.MDB_val api_key
+        cdef cmdb.MDB_val api_value
+        cdef int err
+
+        self.set_key(&api_key, key, NULL)
+        if value is not None:
+            if not isinstance(value, bytes):
+                value = memoryview(value).tobytes()
+            self.set_key(&api_value, value, NULL)
+            with nogil:
+                err = _mdb_del(self.metrics, txn.txn, self.dbi, &api_key,
+                               &api_value)
+        else:
+            with nogil:
+                err = _mdb_del(self.metrics, txn.txn, self.dbi, &api_key, NULL)
+        if err == cmdb.MDB_NOTFOUND:
+            raise KeyNotFoundError("Error deleting data: %s"
+                                   % cmdb.mdb_strerror(err))
+        elif err:
+            raise Exception("Error deleting data: %s"
+                            % cmdb.mdb_strerror(err))
+
+    def items(self, Txn txn):
+        '''Return all the unique key values
+        '''
+        return self._walk(txn, MDB_NEXT_NODUP)
+
+    def dup_items(self, Txn txn):
+        '''Return all the key values
+        '''
+        return self._walk(txn, MDB_NEXT)
+
+    def _walk(self, Txn txn, unsigned int op):
         cdef cmdb.MDB_cursor *cursor
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
-        cdef long key_, value
+        cdef int err
 
         err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursor)
         if err:
             raise Exception("Error creating Cursor: %s"
                     % cmdb.mdb_strerror(err))
-        key_ = key
-        api_key.mv_size = sizeof(long)
-        api_key.mv_data = <void*>&key_
-        api_value.mv_size = 0
-        api_value.mv_data = NULL
-
         try:
-            if not cmdb.mdb_cursor_get(cursor, &api_key,
-                                    &api_value, MDB_SET_RANGE):
-                key_ = (<long*>api_key.mv_data)[0]
-                if key == key_:
-                    # if the key is present, skip all the possible dups
-                    api_value.mv_size = 0
-                    api_value.mv_data = NULL
-                    cmdb.mdb_cursor_get(cursor, &api_key,
-                                        &api_value, MDB_LAST_DUP)
-                while not cmdb.mdb_cursor_get(cursor, &api_key,
-                                                &api_value, MDB_NEXT):
-                    key_ = (<long*>api_key.mv_data)[0]
-                    value = (<long *>api_value.mv_data)[0]
-                    yield key_, value
-            else:
-                yield None, None
+            while True:
+                with nogil:
+                    err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                          &api_value, op)
+                if err:
+                    break
+                yield self.key_of(&api_key), self.value_of(&api_value)
         finally:
             cmdb.mdb_cursor_close(cursor)
 
-    def get_ge(self, Txn txn, long key_):
-        for key, value in self.get_eq(txn, key_):
-            yield key, value
-        for key, value in self.get_gt(txn, key_):
-            yield key, value
+    def get_dup(self, Txn txn, key):
+        cdef cmdb.MDB_cursor *cursor
+        cdef cmdb.MDB_val api_key
+        cdef cmdb.MDB_val api_value
+        cdef int err
 
-    def get_range(self, Txn txn, long key_begin, long key_end):
-        if key_begin > key_end:
-            raise KeyError("Keys are out of order")
-        for key, value in self.get_ge(txn, key_begin):
-            if key <= key_end:
-                yield key, value
-            else:
-                break
+        self.set_key(&api_key, key, NULL)
+        err = cmdb.mdb_cursor_open(txn.txn, self.dbi, &cursor)
+        if err:
+            raise Exception("Error creating cursor: %s"
+                            % cmdb.mdb_strerror(err))
+        try:
+            with nogil:
+                err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                      &api_value, cmdb.MDB_SET)
+            while not err:
+                yield self.value_of(&api_value)
+                with nogil:
+                    err = _mdb_cursor_get(self.metrics, cursor, &api_key,
+                                          &api_value, cmdb.MDB_NEXT_DUP)
+        finally:
+            cmdb.mdb_cursor_close(cursor)
 
 
 cdef class Cursor:
     cdef cmdb.MDB_cursor *cursor
+    cdef Txn txn
+    cdef _Metrics *metrics
+    # length of the NUL terminator stored after each key and value
+    cdef size_t nul
 
     def __init__(self, Txn txn, DB dbi):
         err = cmdb.mdb_cursor_open(txn.txn, dbi.dbi, &self.cursor)
         if err:
             raise Exception("Error creating Cursor: %s"
                             % cmdb.mdb_strerror(err))
+        self.txn = txn
+        self.metrics = dbi.metrics
+        self.nul = 0 if isinstance(dbi, BytesDB) else 1
 
     def close(self):
         cmdb.mdb_cursor_close(self.cursor)
 
     def renew(self, Txn txn):
-        err = cmdb.mdb_cursor_renew(txn.txn, self.cursor)
+        cdef int err
+
+        with nogil:
+            err = cmdb.mdb_cursor_renew(txn.txn, self.cursor)
         if err:
             raise Exception("Error renewing Cursor: %s"
                             % cmdb.mdb_strerror(err))
+        self.txn = txn
 
     def get(self, key=None, value=None, unsigned int op=MDB_NEXT):
         """Move the cursor to specified key value.
@@ -1064,41 +2651,95 @@ cdef class Cursor:
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
         cdef char *key_, *value_
+        cdef int err
 
         if key:
-            api_key.mv_size = len(key) + 1
+            api_key.mv_size = len(key) + self.nul
             api_key.mv_data = <char*>key
             op = MDB_SET if op == MDB_NEXT else op
         else:
             api_key.mv_size = 0
             api_key.mv_data = NULL
         if value:
-            api_value.mv_size = len(value) + 1
+            api_value.mv_size = len(value) + self.nul
             api_value.mv_data = <char*>value
         else:
             api_value.mv_size = 0
             api_value.mv_data = NULL
 
-        if not cmdb.mdb_cursor_get(self.cursor, &api_key, &api_value, op):
+        with nogil:
+            err = _mdb_cursor_get(self.metrics, self.cursor, &api_key,
+                                  &api_value, op)
+        if not err:
             value_ = <char*>api_value.mv_data
             if key is not None:
-                return key, value_[:api_value.mv_size-1]
+                return key, value_[:api_value.mv_size - self.nul]
+            else:
+                key_ = <char*>api_key.mv_data
+                return key_[:api_key.mv_size - self.nul], value_[:api_value.mv_size - self.nul]
+        else:
+            return None, None
+
+    def get_buffer(self, key=None, value=None, unsigned int op=MDB_NEXT):
+        """Same as get, but the value is returned as a read-only memoryview
+        into the memory map, valid for the lifetime of the cursor's txn.
+        """
+        cdef cmdb.MDB_val api_key
+        cdef cmdb.MDB_val api_value
+        cdef char *key_
+        cdef int err
+
+        if key:
+            api_key.mv_size = len(key) + self.nul
+            api_key.mv_data = <char*>key
+            op = MDB_SET if op == MDB_NEXT else op
+        else:
+            api_key.mv_size = 0
+            api_key.mv_data = NULL
+        if value:
+            api_value.mv_size = len(value) + self.nul
+            api_value.mv_data = <char*>value
+        else:
+            api_value.mv_size = 0
+            api_value.mv_data = NULL
+
+        with nogil:
+            err = _mdb_cursor_get(self.metrics, self.cursor, &api_key,
+                                  &api_value, op)
+        if not err:
+            view = self.txn.view(api_value.mv_data,
+                                 api_value.mv_size - self.nul)
+            if key is not None:
+                return key, view
             else:
                 key_ = <char*>api_key.mv_data
-                return key_[:api_key.mv_size-1], value_[:api_value.mv_size-1]
+                return key_[:api_key.mv_size - self.nul], view
         else:
             return None, None
 
+    def iterbuffers(self, unsigned int op=MDB_NEXT):
+        """Iterate the (key, memoryview) pairs reached by repeatedly moving
+        the cursor with op, see get_buffer.
+        """
+        while True:
+            key, view = self.get_buffer(op=op)
+            if key is None:
+                break
+            yield key, view
+
     def put(self, key, value, unsigned int flags=0):
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
+        cdef int err
 
-        api_key.mv_size = len(key) + 1
+        api_key.mv_size = len(key) + self.nul
         api_key.mv_data = <char*>key
-        api_value.mv_size = len(value) + 1
+        api_value.mv_size = len(value) + self.nul
         api_value.mv_data = <char*>value
 
-        err = cmdb.mdb_cursor_put(self.cursor, &api_key, &api_value, flags)
+        with nogil:
+            err = _mdb_cursor_put(self.metrics, self.cursor, &api_key,
+                                  &api_value, flags)
         if err == cmdb.MDB_MAP_FULL:
             raise MapFullError("Error putting data: %s"
                                % cmdb.mdb_strerror(err))
@@ -1111,15 +2752,20 @@ cdef class Cursor:
 
 
     def delete(self, unsigned int flags=0):
-        err = cmdb.mdb_cursor_del(self.cursor, flags)
+        cdef int err
+
+        with nogil:
+            err = _mdb_cursor_del(self.metrics, self.cursor, flags)
         if err:
             raise Exception("Error deleting Cursor: %s"
                             % cmdb.mdb_strerror(err))
 
     def count_dups(self):
         cdef size_t rval = 0
+        cdef int err
 
-        err = cmdb.mdb_cursor_count(self.cursor, &rval)
+        with nogil:
+            err = cmdb.mdb_cursor_count(self.cursor, &rval)
         if err:
             raise Exception("Error counting Cursor: %s"
                             % cmdb.mdb_strerror(err))
@@ -1141,6 +2787,7 @@ cdef class IntCursor(Cursor):
         cdef cmdb.MDB_val api_value
         cdef char *key_, *value_
         cdef long ikey
+        cdef int err
 
         if key is not None:
             ikey = key
@@ -1151,19 +2798,59 @@ cdef class IntCursor(Cursor):
             api_key.mv_size = 0
             api_key.mv_data = NULL
         if value is not None:
-            api_value.mv_size = len(value) + 1
+            api_value.mv_size = len(value) + self.nul
             api_value.mv_data = <char*>value
         else:
             api_value.mv_size = 0
             api_value.mv_data = NULL
 
-        if not cmdb.mdb_cursor_get(self.cursor, &api_key, &api_value, op):
+        with nogil:
+            err = _mdb_cursor_get(self.metrics, self.cursor, &api_key,
+                                  &api_value, op)
+        if not err:
             value_ = <char*>api_value.mv_data
             if key is not None:
-                return key, value_[:api_value.mv_size-1]
+                return key, value_[:api_value.mv_size - self.nul]
             else:
                 return long((<long*>api_key.mv_data)[0]),\
-                        value_[:api_value.mv_size-1]
+                        value_[:api_value.mv_size - self.nul]
+        else:
+            return None, None
+
+    def get_buffer(self, key=None, value=None, unsigned int op=MDB_NEXT):
+        """Same as get, but the value is returned as a read-only memoryview
+        into the memory map, valid for the lifetime of the cursor's txn.
+        """
+        cdef cmdb.MDB_val api_key
+        cdef cmdb.MDB_val api_value
+        cdef long ikey
+        cdef int err
+
+        if key is not None:
+            ikey = key
+            api_key.mv_size = sizeof(long)
+            api_key.mv_data = <void*>&ikey
+            op = MDB_SET if op == MDB_NEXT else op
+        else:
+            api_key.mv_size = 0
+            api_key.mv_data = NULL
+        if value is not None:
+            api_value.mv_size = len(value) + self.nul
+            api_value.mv_data = <char*>value
+        else:
+            api_value.mv_size = 0
+            api_value.mv_data = NULL
+
+        with nogil:
+            err = _mdb_cursor_get(self.metrics, self.cursor, &api_key,
+                                  &api_value, op)
+        if not err:
+            view = self.txn.view(api_value.mv_data,
+                                 api_value.mv_size - self.nul)
+            if key is not None:
+                return key, view
+            else:
+                return long((<long*>api_key.mv_data)[0]), view
         else:
             return None, None
 
@@ -1171,14 +2858,17 @@ cdef class IntCursor(Cursor):
         cdef cmdb.MDB_val api_key
         cdef cmdb.MDB_val api_value
         cdef long ikey
+        cdef int err
 
         ikey = key
         api_key.mv_size = sizeof(long)
         api_key.mv_data = <void*>&ikey
-        api_value.mv_size = len(value) + 1
+        api_value.mv_size = len(value) + self.nul
         api_value.mv_data = <char*>value
 
-        err = cmdb.mdb_cursor_put(self.cursor, &api_key, &api_value, flags)
+        with nogil:
+            err = _mdb_cursor_put(self.metrics, self.cursor, &api_key,
+                                  &api_value, flags)
         if err == cmdb.MDB_MAP_FULL:
             raise MapFullError("Error putting data: %s"
                                % cmdb.mdb_strerror(err))
@@ -1192,6 +2882,411 @@ cdef class IntCursor(Cursor):
 
 DEFAULT_DB_NAME = '_default'
 IDENTITY_FN = lambda val: val
+_MISSING = object()
+
+# Env flags of the Writer durability profiles, from safest to fastest
+DURABILITY_FLAGS = {
+    'sync': MDB_WRITEMAP,
+    'meta-nosync': MDB_WRITEMAP | MDB_NOMETASYNC,
+    'map-async': MDB_WRITEMAP | MDB_MAPASYNC,
+    'nosync': MDB_WRITEMAP | MDB_NOSYNC,
+}
+
+
+def _durability_flags(durability):
+    try:
+        return DURABILITY_FLAGS[durability]
+    except KeyError:
+        raise ValueError("Unknown durability: %r" % (durability,))
+
+
+def _pair_size(key, value):
+    """Approximate number of bytes a (key, value) pair adds to a txn.
+    """
+    cdef size_t nbytes = 0
+    for item in (key, value):
+        if isinstance(item, array.array):
+            nbytes += len(item) * item.itemsize
+            continue
+        try:
+            nbytes += len(item) + 1
+        except TypeError:
+            nbytes += sizeof(long)
+    return nbytes
+
+
+def _split_batch(batch):
+    """Return the index closest to the middle of batch at which the key
+    changes, so that no dup run is split, or 0 if there is none.
+    """
+    cdef Py_ssize_t mid = len(batch) // 2
+    cdef Py_ssize_t i
+    for i in range(mid, len(batch)):
+        if batch[i][0] != batch[i - 1][0]:
+            return i
+    for i in range(mid - 1, 0, -1):
+        if batch[i][0] != batch[i - 1][0]:
+            return i
+    return 0
+
+
+def _read_run(run):
+    while True:
+        try:
+            yield pickle.load(run)
+        except EOFError:
+            break
+
+
+def _lmdb_order(bint int_key, bint int_val):
+    """Return a sort key putting (key, value) pairs in LMDB order, which
+    compares integer keys and dups as unsigned longs.
+    """
+    mask = <unsigned long>-1
+    return lambda pair: (pair[0] & mask if int_key else pair[0],
+                         pair[1] & mask if int_val else pair[1])
+
+
+def external_sort(pairs, chunk_size=MDB_COMMIT_THRESHOLD, key=None):
+    """Sort an iterable of (key, value) pairs too large for memory, by key
+    then value or by key(pair) if given.
+
+    Sorted runs of chunk_size pairs are spilled to temporary files and then
+    merged lazily; input fitting in a single run never touches the disk.
+    """
+    import heapq
+    import itertools
+    import tempfile
+
+    if key is not None:
+        # decorate, as heapq.merge only takes a key from Python 3.5
+        decorated = ((key(pair), i, pair) for i, pair in enumerate(pairs))
+        for _, _, pair in external_sort(decorated, chunk_size):
+            yield pair
+        return
+
+    pairs = iter(pairs)
+    chunk = sorted(itertools.islice(pairs, chunk_size))
+    if len(chunk) < chunk_size:
+        for pair in chunk:
+            yield pair
+        return
+
+    runs = []
+    try:
+        while chunk:
+            run = tempfile.TemporaryFile()
+            runs.append(run)
+            for pair in chunk:
+                pickle.dump(pair, run, pickle.HIGHEST_PROTOCOL)
+            run.seek(0)
+            chunk = sorted(itertools.islice(pairs, chunk_size))
+        for pair in heapq.merge(*[_read_run(run) for run in runs]):
+            yield pair
+    finally:
+        for run in runs:
+            run.close()
+
+
+cdef class Codec:
+    """Base of the value codecs selectable by name on Writer, Reader and
+    DupReader, see get_codec.
+
+    Subclasses define encode, turning a value into bytes, and decode,
+    turning them back. encode_many and decode_many apply them to a batch
+    in a compiled loop, calling the codecs of this module directly rather
+    than as Python methods.
+    """
+    cpdef bytes encode(self, value):
+        raise NotImplementedError()
+
+    cpdef object decode(self, bytes data):
+        raise NotImplementedError()
+
+    cpdef list encode_many(self, values):
+        cdef list encoded = []
+        for value in values:
+            encoded.append(self.encode(value))
+        return encoded
+
+    cpdef list decode_many(self, datas):
+        cdef list decoded = []
+        for data in datas:
+            decoded.append(self.decode(data))
+        return decoded
+
+
+cdef class StructCodec(Codec):
+    """Fixed-width records packed with a struct format, e.g. '<qd'.
+
+    A record is a tuple, or a single value if the format has one field.
+    """
+    cdef object packer
+    cdef bint scalar
+
+    def __init__(self, fmt):
+        import struct
+        self.packer = struct.Struct(fmt)
+        self.scalar = len(self.packer.unpack(b'\0' * self.packer.size)) == 1
+
+    cpdef bytes encode(self, value):
+        if self.scalar:
+            return self.packer.pack(value)
+        return self.packer.pack(*value)
+
+    cpdef object decode(self, bytes data):
+        record = self.packer.unpack(data)
+        if self.scalar:
+            return record[0]
+        return record
+
+
+cdef class VarintCodec(Codec):
+    """Lists of integers packed as zigzag varints, from one byte for small
+    values. With delta, the differences between consecutive integers are
+    stored instead, which suits sorted lists such as posting lists.
+    """
+    cdef bint delta
+
+    def __init__(self, bint delta=False):
+        self.delta = delta
+
+    cpdef bytes encode(self, value):
+        cdef Py_ssize_t n = len(value)
+        cdef unsigned char *buf
+        cdef Py_ssize_t pos = 0
+        cdef long item, prev = 0
+        cdef unsigned long zigzag
+
+        buf = <unsigned char *>PyMem_Malloc(n * (sizeof(long) * 8 // 7 + 1)
+                                            + 1)
+        if buf == NULL:
+            raise MemoryError()
+        try:
+            for obj in value:
+                item = obj
+                if self.delta:
+                    # wrap around rather than overflow a signed long
+                    item, prev = <long>(<unsigned long>item -
+                                        <unsigned long>prev), item
+                zigzag = ((<unsigned long>item << 1) ^
+                          -(<unsigned long>item >> (sizeof(long) * 8 - 1)))
+                while zigzag >= 0x80:
+                    buf[pos] = (zigzag & 0x7f) | 0x80
+                    zigzag >>= 7
+                    pos += 1
+                buf[pos] = zigzag
+                pos += 1
+            return (<char *>buf)[:pos]
+        finally:
+            PyMem_Free(buf)
+
+    cpdef object decode(self, bytes data):
+        cdef const unsigned char *buf = data
+        cdef Py_ssize_t size = len(data)
+        cdef Py_ssize_t pos = 0
+        cdef unsigned long zigzag
+        cdef unsigned int shift
+        cdef long item, prev = 0
+        cdef list values = []
+
+        while pos < size:
+            zigzag = 0
+            shift = 0
+            while True:
+                if pos >= size:
+                    raise Exception("Error decoding data: truncated varint")
+                if shift >= sizeof(long) * 8:
+                    raise Exception("Error decoding data: varint too long")
+                zigzag |= <unsigned long>(buf[pos] & 0x7f) << shift
+                shift += 7
+                pos += 1
+                if not buf[pos - 1] & 0x80:
+                    break
+            item = <long>(zigzag >> 1) ^ -<long>(zigzag & 1)
+            if self.delta:
+                item = <long>(<unsigned long>item + <unsigned long>prev)
+                prev = item
+            values.append(item)
+        return values
+
+
+cdef enum:
+    # the most output raw deflate produces per input byte
+    _DEFLATE_MAX_RATIO = 1032
+
+
+cdef class ZlibCodec(Codec):
+    """Values compressed with raw deflate, optionally primed with a shared
+    dictionary of byte strings common to the values, see train_zdict.
+
+    Small values barely compress on their own; a dictionary lets them
+    refer to the content it holds. Values are bytes, and the same zdict
+    must be used to decode.
+    """
+    cdef z_stream deflater
+    cdef z_stream inflater
+    cdef bint deflater_ready
+    cdef bint inflater_ready
+    cdef bytes zdict
+
+    def __init__(self, int level=6, bytes zdict=None):
+        cdef int err
+
+        self.zdict = zdict
+        err = deflateInit2(&self.deflater, level, Z_DEFLATED, -15, 8,
+                           Z_DEFAULT_STRATEGY)
+        if err != Z_OK:
+            raise Exception("Error creating codec: zlib error %d" % err)
+        self.deflater_ready = True
+        err = inflateInit2(&self.inflater, -15)
+        if err != Z_OK:
+            raise Exception("Error creating codec: zlib error %d" % err)
+        self.inflater_ready = True
+
+    def __dealloc__(self):
+        if self.deflater_ready:
+            deflateEnd(&self.deflater)
+        if self.inflater_ready:
+            inflateEnd(&self.inflater)
+
+    cpdef bytes encode(self, value):
+        cdef bytes data = value
+        cdef bytes header = _varint(len(data))
+        cdef size_t bound
+        cdef unsigned char *buf
+        cdef int err
+
+        deflateReset(&self.deflater)
+        if self.zdict:
+            deflateSetDictionary(&self.deflater, self.zdict, len(self.zdict))
+        bound = deflateBound(&self.deflater, len(data))
+        buf = <unsigned char *>PyMem_Malloc(len(header) + bound)
+        if buf == NULL:
+            raise MemoryError()
+        try:
+            memcpy(buf, <char *>header, len(header))
+            self.deflater.next_in = data
+            self.deflater.avail_in = len(data)
+            self.deflater.next_out = buf + len(header)
+            self.deflater.avail_out = bound
+            err = deflate(&self.deflater, Z_FINISH)
+            if err != Z_STREAM_END:
+                raise Exception("Error encoding data: zlib error %d" % err)
+            return (<char *>buf)[:len(header) + self.deflater.total_out]
+        finally:
+            PyMem_Free(buf)
+
+    cpdef object decode(self, bytes data):
+        cdef const unsigned char *buf = data
+        cdef size_t size = 0
+        cdef unsigned int shift = 0
+        cdef Py_ssize_t pos = 0
+        cdef bytes value
+        cdef int err
+
+        while True:
+            if pos >= len(data):
+                raise Exception("Error decoding data: truncated header")
+            if shift >= sizeof(size_t) * 8:
+                raise Exception("Error decoding data: header too long")
+            size |= <size_t>(buf[pos] & 0x7f) << shift
+            shift += 7
+            pos += 1
+            if not buf[pos - 1] & 0x80:
+                break
+        # the header is not trusted: deflate expands at most 1032:1, so
+        # anything larger is corrupt and must not be allocated
+        if size > <size_t>(len(data) - pos) * _DEFLATE_MAX_RATIO + 1024:
+            raise Exception("Error decoding data: bad length %d" % size)
+        value = PyBytes_FromStringAndSize(NULL, size)
+        inflateReset(&self.inflater)
+        if self.zdict:
+            inflateSetDictionary(&self.inflater, self.zdict, len(self.zdict))
+        self.inflater.next_in = buf + pos
+        self.inflater.avail_in = len(data) - pos
+        self.inflater.next_out = <unsigned char *>PyBytes_AS_STRING(value)
+        self.inflater.avail_out = size
+        err = inflate(&self.inflater, Z_FINISH)
+        if err != Z_STREAM_END or self.inflater.total_out != size:
+            raise Exception("Error decoding data: zlib error %d" % err)
+        return value
+
+
+cdef bytes _varint(size_t n):
+    cdef unsigned char buf[10]
+    cdef int pos = 0
+    while n >= 0x80:
+        buf[pos] = (n & 0x7f) | 0x80
+        n >>= 7
+        pos += 1
+    buf[pos] = n
+    return (<char *>buf)[:pos + 1]
+
+
+def train_zdict(samples, size=4096, n=8):
+    """Build a ZlibCodec dictionary of at most size bytes out of the n byte
+    substrings most common across samples, the most common last since
+    deflate reaches recent bytes most cheaply.
+    """
+    import collections
+
+    counts = collections.Counter()
+    for sample in samples:
+        counts.update(set(sample[i:i + n]
+                          for i in range(0, len(sample) - n + 1)))
+    chunks = [chunk for chunk, count in counts.most_common(size // n)
+              if count > 1]
+    return b''.join(reversed(chunks))
+
+
+cdef class MsgpackCodec(Codec):
+    """Records serialised by the msgpack package, which must be installed.
+    encode_many packs a batch with a single Packer, where msgpack.packb
+    builds one per value.
+    """
+    cdef object packb
+    cdef object unpackb
+    cdef object Packer
+
+    def __init__(self):
+        import msgpack
+        self.packb = msgpack.packb
+        self.unpackb = msgpack.unpackb
+        self.Packer = msgpack.Packer
+
+    cpdef bytes encode(self, value):
+        return self.packb(value)
+
+    cpdef object decode(self, bytes data):
+        return self.unpackb(data)
+
+    cpdef list encode_many(self, values):
+        pack = self.Packer().pack
+        return [pack(value) for value in values]
+
+
+CODECS = {
+    'varint': VarintCodec,
+    'delta-varint': lambda: VarintCodec(delta=True),
+    'zlib': ZlibCodec,
+    'msgpack': MsgpackCodec,
+}
+
+
+def get_codec(codec):
+    """Return the Codec named codec, one of the CODECS or 'struct:<fmt>',
+    e.g. 'struct:<qd'. A Codec or None is returned as is.
+    """
+    if codec is None or isinstance(codec, Codec):
+        return codec
+    name, _, fmt = codec.partition(':')
+    if name == 'struct':
+        return StructCodec(fmt)
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise ValueError("Unknown codec: %r" % (codec,))
 
 
 def mdb_write_handle(path,                          # the path of mdb
@@ -1199,9 +3294,10 @@ def mdb_write_handle(path,                          # the path of mdb
                      db_name=DEFAULT_DB_NAME,       # the name of database
                      dup=True,                      # duplicate values
                      int_key=False,                 # integer key
-                     int_val=False                  # integer value
+                     int_val=False,                 # integer value
+                     durability='nosync'            # see DURABILITY_FLAGS
                      ):
-    env = Env(path, flags=MDB_NOSYNC | MDB_WRITEMAP, mapsize=size)
+    env = Env(path, flags=_durability_flags(durability), mapsize=size)
     txn = env.begin_txn()
     flags = MDB_CREATE
     flags |= MDB_DUPSORT if dup else 0
@@ -1229,6 +3325,767 @@ def mdb_read_handle(path,                           # the path of mdb
     return env, txn, db
 
 
+cdef enum:
+    # seconds an idle pooled txn may pin its snapshot without max_txn_age
+    _IDLE_TXN_AGE = 1
+
+
+cdef class _PooledTxn:
+    cdef Txn txn
+    cdef long ops
+    cdef double started
+    cdef bint active
+    cdef bint busy
+    cdef object __weakref__
+
+    def __dealloc__(self):
+        # the thread-local storage of an exited thread is being cleared,
+        # give its reader slot back unless the pool closed the txn already
+        if self.txn is not None:
+            self.txn.abort()
+
+
+cdef class _ReadTxnPool:
+    """Per-thread read-only transactions of an Env opened with MDB_NOTLS.
+
+    Each thread keeps one txn which is reset between uses and renewed on
+    demand, so it holds on to its reader slot and is never begun again;
+    the txn is aborted when the thread exits. A txn stays on its snapshot
+    for max_txn_ops operations, or until it is max_txn_age seconds old if
+    that is not 0, before being reset. With max_txn_ops above 1, the txns
+    of threads that went idle are reset by the next thread to acquire one
+    once they are max_txn_age (or _IDLE_TXN_AGE) seconds old, so they do
+    not keep old snapshots from being reclaimed.
+    """
+    cdef Env env
+    cdef long max_txn_ops
+    cdef double max_txn_age
+    cdef double idle_age
+    cdef double swept
+    cdef object local
+    cdef object lock
+    cdef object txns
+
+    def __init__(self, Env env, long max_txn_ops=1, double max_txn_age=0):
+        self.env = env
+        self.max_txn_ops = max_txn_ops
+        self.max_txn_age = max_txn_age
+        self.idle_age = max_txn_age or _IDLE_TXN_AGE
+        self.swept = time.time()
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.txns = weakref.WeakSet()
+
+    def acquire(self):
+        cdef _PooledTxn pooled = getattr(self.local, 'pooled', None)
+        if pooled is None:
+            pooled = _PooledTxn()
+            pooled.txn = self.env.begin_txn(flags=MDB_RDONLY)
+            pooled.active = True
+            pooled.started = time.time()
+            self.local.pooled = pooled
+            with self.lock:
+                self.txns.add(pooled)
+        if self.max_txn_ops == 1:
+            # reset on every release, so never left on an old snapshot
+            self._renew(pooled)
+            return pooled.txn
+        with self.lock:
+            self._sweep()
+            self._renew(pooled)
+            pooled.busy = True
+        return pooled.txn
+
+    def release(self):
+        cdef _PooledTxn pooled = self.local.pooled
+        pooled.ops += 1
+        if self.max_txn_ops == 1:
+            self._reset(pooled)
+            return
+        with self.lock:
+            pooled.busy = False
+            self._reset(pooled)
+
+    cdef _renew(self, _PooledTxn pooled):
+        if pooled.active:
+            if not self._stale(pooled):
+                return
+            pooled.txn.reset()
+        pooled.txn.renew()
+        pooled.active = True
+        pooled.ops = 0
+        if self.max_txn_ops != 1 or self.max_txn_age:
+            pooled.started = time.time()
+
+    cdef _reset(self, _PooledTxn pooled):
+        if self._stale(pooled):
+            pooled.txn.reset()
+            pooled.active = False
+
+    cdef _sweep(self):
+        cdef _PooledTxn pooled
+        cdef double now = time.time()
+        if now - self.swept < self.idle_age:
+            return
+        self.swept = now
+        for pooled in self.txns:
+            if (pooled.active and not pooled.busy and
+                    now - pooled.started >= self.idle_age):
+                pooled.txn.reset()
+                pooled.active = False
+
+    cdef bint _stale(self, _PooledTxn pooled):
+        return (pooled.ops >= self.max_txn_ops or
+                (self.max_txn_age and
+                 time.time() - pooled.started >= self.max_txn_age))
+
+    def close(self):
+        cdef _PooledTxn pooled
+        with self.lock:
+            for pooled in list(self.txns):
+                pooled.txn.abort()
+                pooled.txn = None
+            self.txns.clear()
+        self.local = threading.local()
+
+
+cdef size_t _last_txnid(Env env) except? 0:
+    cdef cmdb.MDB_envinfo info
+    cdef int err = cmdb.mdb_env_info(env.env, &info)
+    if err:
+        raise Exception("Error 'info'ing environment: %s"
+                        % cmdb.mdb_strerror(err))
+    return info.me_last_txnid
+
+
+cdef class _ValueCache:
+    """Decoded values of a read-only Env, keyed by key and bounded to
+    capacity bytes, as sized by the caller.
+
+    Every lookup compares the Env's me_last_txnid with the one the
+    values were read under and drops them all if a txn has committed
+    since, so the cache never serves anything older than what a fresh
+    read txn would see. Subclasses choose what to evict.
+    """
+    cdef Env env
+    cdef size_t txnid
+    cdef readonly size_t capacity
+    cdef readonly size_t nbytes
+    cdef readonly long hits
+    cdef readonly long misses
+    cdef object lock
+
+    def __init__(self, Env env, size_t capacity):
+        self.env = env
+        self.capacity = capacity
+        self.txnid = _last_txnid(env)
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        cdef size_t txnid = _last_txnid(self.env)
+        with self.lock:
+            if txnid != self.txnid:
+                self._clear()
+                self.txnid = txnid
+            value = self._lookup(key, _MISSING)
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def put(self, key, value, size_t size, size_t txnid):
+        """Cache the decoded value of key, read in the txn of id txnid.
+        It is dropped unless that is the txn the cached values were read
+        under, as an older snapshot may hold a value since overwritten.
+        """
+        if size > self.capacity:
+            return
+        with self.lock:
+            if txnid == self.txnid:
+                self._store(key, value, size)
+
+    def clear(self):
+        with self.lock:
+            self._clear()
+
+    def stats(self):
+        return dict(hits=self.hits,
+                    misses=self.misses,
+                    entries=len(self),
+                    nbytes=self.nbytes,
+                    capacity=self.capacity)
+
+    # _lookup(key, default), _store(key, value, size) and _clear() are
+    # defined by the subclasses, see CACHE_POLICIES
+    cdef object _lookup(self, key, default):
+        return default
+
+    cdef _store(self, key, value, size_t size):
+        pass
+
+    cdef _clear(self):
+        pass
+
+
+cdef class _LRUCache(_ValueCache):
+    """_ValueCache evicting the least recently used values.
+    """
+    cdef object entries
+
+    def __init__(self, Env env, size_t capacity):
+        _ValueCache.__init__(self, env, capacity)
+        self.entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    cdef object _lookup(self, key, default):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return default
+        self.entries[key] = entry
+        return entry[0]
+
+    cdef _store(self, key, value, size_t size):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+        while self.entries and self.nbytes + size > self.capacity:
+            self.nbytes -= self.entries.popitem(last=False)[1][1]
+        self.entries[key] = (value, size)
+        self.nbytes += size
+
+    cdef _clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+
+cdef class _ARCCache(_ValueCache):
+    """_ValueCache evicting by the Adaptive Replacement Cache policy,
+    weighted by size.
+
+    Values seen once live in recent, those seen again in frequent. Keys
+    recently evicted from either are remembered in a ghost list, and a
+    miss on one moves the byte target of recent towards the list that
+    would have hit, so a scan does not flush the frequently used values.
+    """
+    cdef object recent
+    cdef object frequent
+    cdef object recent_ghosts
+    cdef object frequent_ghosts
+    cdef size_t recent_bytes
+    cdef size_t recent_ghost_bytes
+    cdef size_t frequent_ghost_bytes
+    cdef size_t target
+
+    def __init__(self, Env env, size_t capacity):
+        _ValueCache.__init__(self, env, capacity)
+        self.recent = collections.OrderedDict()
+        self.frequent = collections.OrderedDict()
+        self.recent_ghosts = collections.OrderedDict()
+        self.frequent_ghosts = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.recent) + len(self.frequent)
+
+    cdef object _lookup(self, key, default):
+        entry = self.recent.pop(key, None)
+        if entry is not None:
+            self.recent_bytes -= entry[1]
+        else:
+            entry = self.frequent.pop(key, None)
+            if entry is None:
+                return default
+        self.frequent[key] = entry
+        return entry[0]
+
+    cdef _store(self, key, value, size_t size):
+        cdef size_t ghost_size, delta
+        entry = self.recent.pop(key, None)
+        if entry is not None:
+            self.recent_bytes -= entry[1]
+        else:
+            entry = self.frequent.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+            self.frequent[key] = (value, size)
+            self.nbytes += size
+            self._replace(0)
+            return
+
+        ghost_size = self.recent_ghosts.pop(key, 0)
+        if ghost_size:
+            self.recent_ghost_bytes -= ghost_size
+            delta = size * max(1, self.frequent_ghost_bytes //
+                                  max(self.recent_ghost_bytes, 1))
+            self.target = min(self.capacity, self.target + delta)
+            self._replace(size)
+            self.frequent[key] = (value, size)
+        else:
+            ghost_size = self.frequent_ghosts.pop(key, 0)
+            if ghost_size:
+                self.frequent_ghost_bytes -= ghost_size
+                delta = size * max(1, self.recent_ghost_bytes //
+                                      max(self.frequent_ghost_bytes, 1))
+                self.target -= min(self.target, delta)
+                self._replace(size)
+                self.frequent[key] = (value, size)
+            else:
+                self._replace(size)
+                self.recent[key] = (value, size)
+                self.recent_bytes += size
+        self.nbytes += size
+        self._trim_ghosts()
+
+    cdef _replace(self, size_t size):
+        # evicts into the ghost lists until size more bytes fit
+        while self.nbytes + size > self.capacity:
+            if self.recent and (self.recent_bytes > self.target or
+                                not self.frequent):
+                key, entry = self.recent.popitem(last=False)
+                self.recent_bytes -= entry[1]
+                self.recent_ghosts[key] = entry[1]
+                self.recent_ghost_bytes += entry[1]
+            elif self.frequent:
+                key, entry = self.frequent.popitem(last=False)
+                self.frequent_ghosts[key] = entry[1]
+                self.frequent_ghost_bytes += entry[1]
+            else:
+                break
+            self.nbytes -= entry[1]
+
+    cdef _trim_ghosts(self):
+        while (self.recent_ghosts and
+               self.recent_bytes + self.recent_ghost_bytes > self.capacity):
+            self.recent_ghost_bytes -= \
+                self.recent_ghosts.popitem(last=False)[1]
+        while (self.frequent_ghosts and
+               self.nbytes + self.recent_ghost_bytes +
+               self.frequent_ghost_bytes > 2 * self.capacity):
+            self.frequent_ghost_bytes -= \
+                self.frequent_ghosts.popitem(last=False)[1]
+
+    cdef _clear(self):
+        # the ghost lists only hold keys, so they survive a commit
+        self.recent.clear()
+        self.frequent.clear()
+        self.recent_bytes = 0
+        self.nbytes = 0
+
+
+CACHE_POLICIES = {
+    'lru': _LRUCache,
+    'arc': _ARCCache,
+}
+
+
+def _value_cache(Env env, cache_bytes, cache_policy):
+    if not cache_bytes:
+        return None
+    try:
+        cache_cls = CACHE_POLICIES[cache_policy]
+    except KeyError:
+        raise ValueError("Unknown cache policy: %r" % (cache_policy,))
+    return cache_cls(env, cache_bytes)
+
+
+cdef inline unsigned long long _mix64(unsigned long long h) nogil:
+    # the finalizer of MurmurHash3
+    h ^= h >> 33
+    h *= 0xff51afd7ed558ccdULL
+    h ^= h >> 33
+    h *= 0xc4ceb9fe1a85ec53ULL
+    h ^= h >> 33
+    return h
+
+
+cdef unsigned long long _hash_bytes(const unsigned char *data,
+                                    size_t size) nogil:
+    # FNV-1a, mixed so that every bit depends on every byte
+    cdef unsigned long long h = 14695981039346656037ULL
+    cdef size_t i
+    for i in range(size):
+        h ^= data[i]
+        h *= 1099511628211ULL
+    return _mix64(h ^ size)
+
+
+# bytes of bits per record of a Bloom filter database, so that a commit
+# rewrites only the chunks its keys changed
+cdef enum:
+    _BLOOM_CHUNK = 1024
+
+
+cdef class BloomFilter:
+    """Set of keys answering membership with no false negatives and a
+    tunable rate of false positives.
+
+    nhashes bits out of nbits are set per key, picked by double hashing.
+    Keys are strings, or integers hashed as the longs of an integer keyed
+    database.
+    """
+    cdef readonly size_t nbits
+    cdef readonly int nhashes
+    cdef readonly size_t count
+    cdef readonly bytearray bits
+    cdef unsigned char *data
+    # a byte per chunk of bits, set when add changes it
+    cdef bytearray dirty
+
+    def __init__(self, size_t nbits, int nhashes, bits=None,
+                 size_t count=0):
+        nbits = max(nbits, 8)
+        if bits is None:
+            bits = bytearray((nbits + 7) // 8)
+        elif len(bits) != (nbits + 7) // 8:
+            raise ValueError("Expected %d bytes of bits, got %d"
+                             % ((nbits + 7) // 8, len(bits)))
+        self.nbits = nbits
+        self.nhashes = max(nhashes, 1)
+        self.count = count
+        self.bits = bits
+        self.data = <unsigned char*>PyByteArray_AS_STRING(self.bits)
+        self.dirty = bytearray(b'\x01') * (
+            (len(bits) + _BLOOM_CHUNK - 1) // _BLOOM_CHUNK)
+
+    @classmethod
+    def for_capacity(cls, size_t nkeys, double fpp=0.01):
+        """Return a filter sized to hold nkeys keys with a false positive
+        rate of fpp.
+        """
+        import math
+
+        nkeys = max(nkeys, 1)
+        nbits = int(math.ceil(nkeys * -math.log(fpp) / math.log(2) ** 2))
+        return cls(nbits, int(round(float(nbits) / nkeys * math.log(2))))
+
+    cdef unsigned long long _hash(self, key) except? 0:
+        cdef long ikey
+        if isinstance(key, bytes):
+            return _hash_bytes(<unsigned char*>PyBytes_AS_STRING(key),
+                               len(key))
+        if isinstance(key, (int, long)):
+            ikey = key
+            return _hash_bytes(<unsigned char*>&ikey, sizeof(long))
+        return self._hash(bytes(memoryview(key)))
+
+    cpdef add(self, key):
+        cdef unsigned long long h1 = self._hash(key)
+        cdef unsigned long long h2 = _mix64(h1) | 1
+        cdef unsigned long long pos
+        cdef unsigned char *dirty = <unsigned char*>PyByteArray_AS_STRING(
+            self.dirty)
+        cdef int i
+        for i in range(self.nhashes):
+            pos = (h1 + i * h2) % self.nbits
+            if not self.data[pos >> 3] & (1 << (pos & 7)):
+                self.data[pos >> 3] |= 1 << (pos & 7)
+                dirty[(pos >> 3) // _BLOOM_CHUNK] = 1
+        self.count += 1
+
+    def __contains__(self, key):
+        cdef unsigned long long h1 = self._hash(key)
+        cdef unsigned long long h2 = _mix64(h1) | 1
+        cdef unsigned long long pos
+        cdef int i
+        for i in range(self.nhashes):
+            pos = (h1 + i * h2) % self.nbits
+            if not self.data[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+
+def _bloom_db_name(db_name):
+    return db_name + b'.bloom'
+
+
+# nbits, nhashes, count, stamp and generation of a saved Bloom filter
+_BLOOM_META = '<QIQQQ'
+
+
+def _bloom_chunk_key(size_t i):
+    import struct
+
+    return b'bits' + struct.pack('>I', i)
+
+
+def _load_bloom_meta(Txn txn, DB bloom_db):
+    """Return the (nbits, nhashes, count, stamp, generation) of the Bloom
+    filter saved in bloom_db, or None if there is none.
+
+    stamp is the id of the txn that last saved it, and generation counts
+    the times it was cleared or rebuilt.
+    """
+    import struct
+
+    try:
+        meta = bloom_db.get(txn, b'meta')
+    except KeyNotFoundError:
+        return None
+    if len(meta) != struct.calcsize(_BLOOM_META):
+        return None
+    return struct.unpack(_BLOOM_META, meta)
+
+
+def _load_bloom_chunks(Txn txn, DB bloom_db, BloomFilter bloom, chunks):
+    cdef size_t start, size
+
+    for i in chunks:
+        start = i * _BLOOM_CHUNK
+        size = min(_BLOOM_CHUNK, len(bloom.bits) - start)
+        chunk = bloom_db.get(txn, _bloom_chunk_key(i))
+        if len(chunk) != size:
+            raise ValueError("Error loading Bloom filter: chunk %d has %d "
+                             "bytes, expected %d" % (i, len(chunk), size))
+        memcpy(bloom.data + start, PyBytes_AS_STRING(chunk), size)
+
+
+def _load_bloom(Txn txn, DB bloom_db, meta):
+    """Return the BloomFilter saved in bloom_db, given its meta.
+    """
+    cdef BloomFilter bloom
+
+    nbits, nhashes, count = meta[:3]
+    bloom = BloomFilter(nbits, nhashes, count=count)
+    _load_bloom_chunks(txn, bloom_db, bloom, range(len(bloom.dirty)))
+    _bloom_saved(bloom)
+    return bloom
+
+
+def _load_bloom_stamps(Txn txn, DB bloom_db, size_t nchunks):
+    # the id of the txn that last wrote each chunk, as an array('L')
+    try:
+        stamps = array.array('L', bloom_db.get(txn, b'stamps'))
+    except KeyNotFoundError:
+        stamps = array.array('L')
+    if len(stamps) != nchunks:
+        stamps = array.array('L', [0]) * nchunks
+    return stamps
+
+
+def _save_bloom(Txn txn, DB bloom_db, BloomFilter bloom, size_t stamp,
+                size_t generation):
+    """Write the chunks of bloom changed since it was last saved in txn, a
+    write txn of id stamp. They stay marked changed until the txn is
+    committed, see _bloom_saved.
+    """
+    import struct
+
+    stamps = _load_bloom_stamps(txn, bloom_db, len(bloom.dirty))
+    i = bloom.dirty.find(b'\x01')
+    while i != -1:
+        start = i * _BLOOM_CHUNK
+        bloom_db.put(txn, _bloom_chunk_key(i),
+                     bytes(bloom.bits[start:start + _BLOOM_CHUNK]))
+        stamps[i] = stamp
+        i = bloom.dirty.find(b'\x01', i + 1)
+    # as bytes, arrays lacking the buffer interface on Python 2
+    bloom_db.put(txn, b'stamps', PyBytes_FromStringAndSize(
+        (<array.array>stamps).data.as_chars, len(stamps) * stamps.itemsize))
+    bloom_db.put(txn, b'meta', struct.pack(_BLOOM_META, bloom.nbits,
+                                          bloom.nhashes, bloom.count, stamp,
+                                          generation))
+
+
+def _bloom_saved(BloomFilter bloom):
+    # the txn of _save_bloom has committed
+    memset(PyByteArray_AS_STRING(bloom.dirty), 0, len(bloom.dirty))
+
+
+def _open_bloom(Env env, Txn txn, db_name, bint create=False):
+    """Open the Bloom filter database of db_name written by a Writer with
+    bloom_keys, or return None if there is none. A missing one is created
+    if create.
+    """
+    try:
+        return env.open_db(txn, name=_bloom_db_name(db_name),
+                           flags=MDB_CREATE if create else 0, binary=True)
+    except Exception:
+        return None
+
+
+cdef class _BloomSidecar:
+    """In-memory copy of the Bloom filter a Writer keeps next to its
+    database, brought up to date whenever a txn has committed since it
+    was read, by reloading the chunks written since.
+
+    The filter is only trusted when it was saved by the last commit to the
+    Env, as a commit that bypassed it may have added keys it misses.
+    """
+    cdef Env env
+    cdef DB bloom_db
+    cdef size_t txnid
+    cdef size_t stamp
+    cdef size_t generation
+    cdef BloomFilter bloom
+    cdef bint trusted
+    cdef object lock
+
+    def __init__(self, Env env, DB bloom_db):
+        self.env = env
+        self.bloom_db = bloom_db
+        self.lock = threading.Lock()
+        self.txnid = 0
+        self.trusted = False
+        with self.lock:
+            self._reload(_last_txnid(env))
+
+    cdef _reload(self, size_t txnid):
+        cdef BloomFilter bloom = self.bloom
+
+        txn = self.env.begin_txn(flags=MDB_RDONLY)
+        try:
+            meta = _load_bloom_meta(txn, self.bloom_db)
+            # the txn reads the snapshot of txnid unless one just committed
+            self.txnid = txnid
+            if (meta is None or meta[3] != txnid or
+                    _last_txnid(self.env) != txnid):
+                self.trusted = False
+                return
+            nbits, nhashes, count, stamp, generation = meta
+            if (bloom is None or generation != self.generation or
+                    nbits != bloom.nbits or nhashes != bloom.nhashes):
+                self.bloom = _load_bloom(txn, self.bloom_db, meta)
+            else:
+                # chunks only ever gain bits within a generation, so they
+                # can be updated in place under concurrent lookups
+                stamps = _load_bloom_stamps(txn, self.bloom_db,
+                                            len(bloom.dirty))
+                _load_bloom_chunks(txn, self.bloom_db, bloom,
+                                   [i for i, chunk_stamp in enumerate(stamps)
+                                    if chunk_stamp > self.stamp])
+                bloom.count = count
+            self.stamp = stamp
+            self.generation = generation
+            self.trusted = True
+        finally:
+            txn.commit()
+
+    def current(self):
+        """Return the filter as of the last commit, None if there is none
+        that can be trusted.
+        """
+        cdef size_t txnid = _last_txnid(self.env)
+        if txnid != self.txnid:
+            with self.lock:
+                if txnid != self.txnid:
+                    self._reload(txnid)
+        return self.bloom if self.trusted else None
+
+    def may_contain(self, key):
+        """Return False if key is certainly not in the database.
+        """
+        bloom = self.current()
+        return bloom is None or key in bloom
+
+
+def _index_db_name(db_name, name):
+    return db_name + b'.index.' + name
+
+
+def _index_values(fn, key, value):
+    """Return the set of values fn indexes the pair under: none if it
+    returns None, each of them if a list, tuple or set, else just one.
+    """
+    ivalues = fn(key, value)
+    if ivalues is None:
+        return set()
+    if isinstance(ivalues, (list, tuple, set, frozenset)):
+        return set(ivalues)
+    return set([ivalues])
+
+
+def _open_index(reader, name):
+    """Return the index DB of reader named name, opened on first use.
+    """
+    index_db = reader.index_dbs.get(name)
+    if index_db is not None:
+        return index_db
+    with reader.index_lock:
+        index_db = reader.index_dbs.get(name)
+        if index_db is None:
+            flags = MDB_DUPSORT
+            flags |= MDB_INTEGERDUP if reader.int_key else 0
+            txn = reader.env.begin_txn(flags=MDB_RDONLY)
+            try:
+                index_db = reader.env.open_db(
+                    txn, name=_index_db_name(reader.db_name, name),
+                    flags=flags, binary=reader.binary)
+            except Exception:
+                raise KeyNotFoundError("Error opening index: no index %r"
+                                       % (name,))
+            finally:
+                txn.commit()
+            reader.index_dbs[name] = index_db
+    return index_db
+
+
+def _tracked(owner, obj):
+    # an iterator or snapshot reading in a txn that owner.close ends
+    owner.tracked.add(obj)
+    return obj
+
+
+def _close_tracked(owner):
+    """Close the iterators and snapshots of a Reader, DupReader or
+    Snapshot still open, which must not outlive its txn or Env. A closed
+    iterator stops.
+    """
+    for obj in list(owner.tracked):
+        obj.close()
+    owner.tracked.clear()
+
+
+def _get_by_index(reader, name, value, bint dup):
+    index_db = _open_index(reader, name)
+    txn = reader.txns.acquire()
+    try:
+        if reader.int_key:
+            keys = list(index_db.get_dup_array(txn, value))
+        else:
+            keys = list(index_db.get_dup(txn, value))
+        values = reader.db.get_many(txn, keys, _MISSING, dup=dup)
+    finally:
+        reader.txns.release()
+    found = [(key, value) for key, value in zip(keys, values)
+             if value is not _MISSING]
+    if dup:
+        return [(key, [reader.decode_fn(v) for v in dups])
+                for key, dups in found]
+    if reader.codec is not None:
+        decoded = reader.codec.decode_many([value for _, value in found])
+        return list(zip([key for key, _ in found], decoded))
+    return [(key, reader.decode_fn(value)) for key, value in found]
+
+
+def _cached_many(reader, keys, default):
+    """get_many of a Reader or DupReader: the keys its cache misses, and
+    its Bloom filter does not rule out, are read by its _read_many,
+    _MISSING for those not found, and cached.
+    """
+    cache = reader.cache
+    bloom = reader.bloom.current() if reader.bloom is not None else None
+    if cache is None and bloom is None:
+        return [default if value is _MISSING else value
+                for value in reader._read_many(keys, None)]
+    keys = list(keys)
+    if cache is not None:
+        values = [cache.get(key, _MISSING) for key in keys]
+    else:
+        values = [_MISSING] * len(keys)
+    misses = [i for i, value in enumerate(values)
+              if value is _MISSING and (bloom is None or keys[i] in bloom)]
+    if misses:
+        found = reader._read_many([keys[i] for i in misses], cache)
+        for i, value in zip(misses, found):
+            values[i] = value
+    return [default if value is _MISSING else value for value in values]
+
+
 class DupReader(object):
     '''Class to read duplicate mdb database. Note txn in __init__
     aborts immediately to avoid the long-lived read txn. The mdb would
@@ -1238,21 +4095,57 @@ class DupReader(object):
     automatically. For readonly txn, call commit is exactly the same as abort,
     except that it remains database handles open. Reader Will close that
     mannually.
+
+    Point lookups reuse per-thread read txns, see Reader. Pass binary,
+    codec, metrics, max_dbs and the cache settings as for Reader; get and
+    get_many cache the decoded list of duplicates of a key. Like Reader,
+    lookups skip the keys ruled out by the Writer's Bloom filter.
     '''
     def __init__(self, path, db_name=DEFAULT_DB_NAME,
-                 int_key=False, int_val=False, decode_fn=None):
+                 int_key=False, int_val=False, decode_fn=None,
+                 max_txn_ops=1, max_txn_age=0, binary=False, codec=None,
+                 cache_bytes=0, cache_policy='lru', metrics=False, max_dbs=8):
         self.path = path
         self.db_name = db_name
-        self.env = Env(path, flags=MDB_RDONLY)
+        self.int_key = int_key
+        self.binary = binary
+        self.index_dbs = {}
+        self.index_lock = threading.Lock()
+        self.env = Env(path, flags=MDB_RDONLY | MDB_NOTLS, metrics=metrics,
+                       max_dbs=max_dbs)
         txn = self.env.begin_txn(flags=MDB_RDONLY)
         flags = MDB_DUPSORT
         flags |= MDB_INTEGERKEY if int_key else 0
         flags |= MDB_INTEGERDUP if int_val else 0
-        self.db = self.env.open_db(txn, name=db_name, flags=flags)
+        self.db = self.env.open_db(txn, name=db_name, flags=flags,
+                                   binary=binary)
+        bloom_db = _open_bloom(self.env, txn, db_name)
+        self.codec = get_codec(codec)
+        if self.codec is not None:
+            decode_fn = self.codec.decode
         self.decode_fn = decode_fn or IDENTITY_FN
         txn.commit()
+        self.txns = _ReadTxnPool(self.env, max_txn_ops, max_txn_age)
+        self.tracked = weakref.WeakSet()
+        self.cache = _value_cache(self.env, cache_bytes, cache_policy)
+        self.bloom = None
+        if bloom_db is not None:
+            self.bloom = _BloomSidecar(self.env, bloom_db)
 
     def get(self, key):
+        return _tracked(self, self._get(key))
+
+    def _get(self, key):
+        if self.bloom is not None and not self.bloom.may_contain(key):
+            return
+        if self.cache is not None:
+            values = self.cache.get(key, _MISSING)
+            if values is _MISSING:
+                values = self._read_many([key], self.cache)[0]
+            if values is not _MISSING:
+                for value in values:
+                    yield value
+            return
         txn = self.env.begin_txn(flags=MDB_RDONLY)
         values = self.db.get_dup(txn, key)
         try:
@@ -1261,17 +4154,54 @@ class DupReader(object):
         finally:
             txn.commit()
 
+    def get_many(self, keys, default=None):
+        """Return the list of duplicate values for each of keys, in order,
+        all read within one transaction. Missing keys map to default.
+        """
+        return _cached_many(self, keys, default)
+
+    def _read_many(self, keys, cache):
+        txn = self.txns.acquire()
+        try:
+            values = self.db.get_many(txn, keys, _MISSING, dup=True)
+            txnid = txn.id
+        finally:
+            self.txns.release()
+        if self.codec is not None:
+            decode_many = self.codec.decode_many
+        else:
+            decode_many = lambda dups: [self.decode_fn(v) for v in dups]
+        decoded = [dups if dups is _MISSING else decode_many(dups)
+                   for dups in values]
+        if cache is not None:
+            for key, dups, items in zip(keys, values, decoded):
+                if dups is not _MISSING:
+                    cache.put(key, items,
+                              sum(_pair_size(key, v) for v in dups), txnid)
+        return decoded
+
+    def get_by_index(self, name, value):
+        """Return the (key, list of values) pairs indexed under value by
+        the index name, see Reader.get_by_index.
+        """
+        return _get_by_index(self, name, value, True)
+
     def get_first(self, key, default=None):
-        txn = self.env.begin_txn(flags=MDB_RDONLY)
+        if self.bloom is not None and not self.bloom.may_contain(key):
+            return default
+        txn = self.txns.acquire()
         try:
             value = self.db.get(txn, key)
         except Exception:
             return default
         finally:
-            txn.commit()
-        return self.decode_fn(self.value)
+            self.txns.release()
+        return self.decode_fn(value)
 
     def iteritems(self):
+        return _tracked(self, self._iteritems())
+
+    def _iteritems(self):
         txn = self.env.begin_txn(flags=MDB_RDONLY)
         try:
             for key, value in self.db.dup_items(txn):
@@ -1279,50 +4209,242 @@ class DupReader(object):
         finally:
             txn.commit()
 
+    def snapshot(self):
+        """Return a Snapshot of the database, see Reader.snapshot.
+        """
+        return _tracked(self, Snapshot(self))
+
+    def metrics(self):
+        """Return the metrics of the Env, see Reader.metrics.
+        """
+        return self.env.metrics()
+
     def close(self):
+        _close_tracked(self)
+        self.txns.close()
         self.db.close()
         self.env.close()
         self.db = None
         self.env = None
 
     def __len__(self):
-        txn = self.env.begin_txn(flags=MDB_RDONLY)
-        nlen = self.db.stat(txn).get('ms_entries', 0)
-        txn.commit()
+        txn = self.txns.acquire()
+        try:
+            nlen = self.db.stat(txn).get('ms_entries', 0)
+        finally:
+            self.txns.release()
         return nlen
 
     def __del__(self):
-        if self.db is not None:
+        # __init__ may have failed before opening them
+        if getattr(self, 'db', None) is not None:
+            if getattr(self, 'txns', None) is not None:
+                self.txns.close()
             self.db.close()
-        if self.env is not None:
+        if getattr(self, 'env', None) is not None:
             self.env.close()
 
 
+def _decode_items(items, decode_fn):
+    for key, value in items:
+        yield key, decode_fn(value)
+
+
+class Snapshot(object):
+    """A consistent view of the database of a Reader or DupReader.
+
+    All reads share one read txn, so they observe the same committed
+    version however long the snapshot is kept, and get and get_many share
+    one cursor. Over a DupReader, they return the list of the dups of each
+    key and iteritems yields every dup. A live snapshot stops the writer
+    from reusing the pages it can see; age tells how many seconds it has
+    been open. close ends the iterators still open too.
+    """
+    def __init__(self, reader):
+        self.db = reader.db
+        self.decode_fn = reader.decode_fn
+        self.dup = isinstance(reader, DupReader)
+        self.txn = reader.env.begin_txn(flags=MDB_RDONLY)
+        try:
+            self.cursor = Cursor(self.txn, self.db)
+        except:
+            self.txn.abort()
+            raise
+        self.started = time.time()
+        self.tracked = weakref.WeakSet()
+
+    @property
+    def age(self):
+        return time.time() - self.started
+
+    def get(self, key, default=None):
+        return self.get_many([key], default)[0]
+
+    def get_many(self, keys, default=None):
+        values = self.db.get_many(self.txn, keys, _MISSING, self.dup,
+                                  self.cursor)
+        decode_fn = self.decode_fn
+        if self.dup:
+            return [default if value is _MISSING
+                    else [decode_fn(dup) for dup in value]
+                    for value in values]
+        return [default if value is _MISSING else decode_fn(value)
+                for value in values]
+
+    def _decoded(self, items):
+        return _decode_items(_tracked(self, items), self.decode_fn)
+
+    def iteritems(self):
+        if self.dup:
+            return self._decoded(self.db.dup_items(self.txn))
+        return self._decoded(self.db.items(self.txn))
+
+    def get_range(self, start=None, end=None, reverse=False, limit=None):
+        return self._decoded(self.db.get_range(self.txn, start, end,
+                                               reverse, limit))
+
+    def get_lt(self, key, reverse=False, limit=None):
+        return self._decoded(self.db.get_lt(self.txn, key, reverse, limit))
+
+    def get_le(self, key, reverse=False, limit=None):
+        return self._decoded(self.db.get_le(self.txn, key, reverse, limit))
+
+    def get_prefix(self, prefix, limit=None):
+        return self._decoded(self.db.get_prefix(self.txn, prefix, limit))
+
+    def close(self):
+        if self.txn is not None:
+            _close_tracked(self)
+            self.cursor.close()
+            self.txn.commit()
+            self.txn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 class Reader(object):
+    """Reader of a single database.
+
+    Point lookups (get, get_many and len) run in a per-thread read txn
+    that is reset after use and renewed for the next lookup instead of
+    being begun from scratch. By default every lookup sees the latest
+    commit; raise max_txn_ops to let that many lookups share a snapshot,
+    and set max_txn_age to bound how old, in seconds, it may get.
+    Iterators always run in a fresh txn of their own.
+
+    Pass binary to read a database written by a binary Writer, and the
+    codec it used, by name or as a Codec, to decode the values with it
+    instead of decode_fn.
+
+    Set cache_bytes to keep up to that many bytes of decoded values, as
+    sized by their encoded length, for get and get_many to serve without
+    reading or decoding them again. cache_policy is 'lru' or 'arc'. The
+    cache is dropped whenever a txn commits, so it is as fresh as the
+    txn of a lookup, and its hits and misses are counted in cache.stats().
+
+    If the Writer keeps a Bloom filter, see its bloom_keys, it is loaded
+    in memory and get and get_many return default for the keys it rules
+    out without searching the database.
+
+    With metrics, the operations of the Env are counted and timed, see
+    Env.metrics.
+
+    get_by_index looks values up through the indexes kept by the Writer;
+    max_dbs must be large enough to open them all, as for the Writer.
+    """
     def __init__(self, path, db_name=DEFAULT_DB_NAME,
-                 int_key=False, int_val=False, decode_fn=None):
+                 int_key=False, int_val=False, decode_fn=None,
+                 max_txn_ops=1, max_txn_age=0, binary=False, codec=None,
+                 cache_bytes=0, cache_policy='lru', metrics=False, max_dbs=8):
         self.path = path
         self.db_name = db_name
-        self.env = Env(path, flags=MDB_RDONLY)
+        self.int_key = int_key
+        self.binary = binary
+        self.index_dbs = {}
+        self.index_lock = threading.Lock()
+        self.env = Env(path, flags=MDB_RDONLY | MDB_NOTLS, metrics=metrics,
+                       max_dbs=max_dbs)
         txn = self.env.begin_txn(flags=MDB_RDONLY)
         flags= 0
         flags |= MDB_INTEGERKEY if int_key else 0
         flags |= MDB_INTEGERDUP if int_val else 0
-        self.db = self.env.open_db(txn, name=db_name, flags=flags)
+        self.db = self.env.open_db(txn, name=db_name, flags=flags,
+                                   binary=binary)
+        bloom_db = _open_bloom(self.env, txn, db_name)
+        self.codec = get_codec(codec)
+        if self.codec is not None:
+            decode_fn = self.codec.decode
         self.decode_fn = decode_fn or IDENTITY_FN
         txn.commit()
+        self.txns = _ReadTxnPool(self.env, max_txn_ops, max_txn_age)
+        self.tracked = weakref.WeakSet()
+        self.cache = _value_cache(self.env, cache_bytes, cache_policy)
+        self.bloom = None
+        if bloom_db is not None:
+            self.bloom = _BloomSidecar(self.env, bloom_db)
 
     def get(self, key, default=None):
-        txn = self.env.begin_txn(flags=MDB_RDONLY)
+        cache = self.cache
+        if cache is not None:
+            decoded = cache.get(key, _MISSING)
+            if decoded is not _MISSING:
+                return decoded
+        if self.bloom is not None and not self.bloom.may_contain(key):
+            return default
+        txn = self.txns.acquire()
         try:
             value = self.db.get(txn, key)
+            txnid = txn.id
         except Exception:
             return default
         finally:
-            txn.commit()
-        return self.decode_fn(value)
+            self.txns.release()
+        decoded = self.decode_fn(value)
+        if cache is not None:
+            cache.put(key, decoded, _pair_size(key, value), txnid)
+        return decoded
+
+    def get_many(self, keys, default=None):
+        """Return the values of keys, in order, all read within one
+        transaction. Missing keys map to default.
+        """
+        return _cached_many(self, keys, default)
+
+    def _read_many(self, keys, cache):
+        txn = self.txns.acquire()
+        try:
+            values = self.db.get_many(txn, keys, _MISSING)
+            txnid = txn.id
+        finally:
+            self.txns.release()
+        if self.codec is not None:
+            found = [value for value in values if value is not _MISSING]
+            found = iter(self.codec.decode_many(found))
+            decoded = [value if value is _MISSING else next(found)
+                       for value in values]
+        else:
+            decoded = [value if value is _MISSING else self.decode_fn(value)
+                       for value in values]
+        if cache is not None:
+            for key, value, item in zip(keys, values, decoded):
+                if value is not _MISSING:
+                    cache.put(key, item, _pair_size(key, value), txnid)
+        return decoded
+
+    def get_by_index(self, name, value):
+        """Return the (key, value) pairs indexed under value by the index
+        name of the Writer, resolved within one read txn.
+        """
+        return _get_by_index(self, name, value, False)
 
     def iteritems(self):
+        return _tracked(self, self._iteritems())
+
+    def _iteritems(self):
         txn = self.env.begin_txn(flags=MDB_RDONLY)
         try:
             for key, value in self.db.items(txn):
@@ -1330,43 +4452,272 @@ class Reader(object):
         finally:
             txn.commit()
 
+    def snapshot(self):
+        """Return a Snapshot of the database, to be used as a context
+        manager:
+
+            with reader.snapshot() as snap:
+                snap.get(key)
+        """
+        return _tracked(self, Snapshot(self))
+
+    def metrics(self):
+        """Return the metrics of the Env, see Env.metrics. Operations are
+        only counted and timed if the Reader was created with metrics.
+        """
+        return self.env.metrics()
+
     def close(self):
+        _close_tracked(self)
+        self.txns.close()
         self.db.close()
         self.env.close()
         self.db = None
         self.env = None
 
     def __len__(self):
-        txn = self.env.begin_txn(flags=MDB_RDONLY)
-        nlen = self.db.stat(txn).get('ms_entries', 0)
-        txn.commit()
+        txn = self.txns.acquire()
+        try:
+            nlen = self.db.stat(txn).get('ms_entries', 0)
+        finally:
+            self.txns.release()
         return nlen
 
     def __del__(self):
-        if self.db is not None:
+        # __init__ may have failed before opening them
+        if getattr(self, 'db', None) is not None:
+            if getattr(self, 'txns', None) is not None:
+                self.txns.close()
             self.db.close()
-        if self.env is not None:
+        if getattr(self, 'env', None) is not None:
             self.env.close()
 
 
 class Writer(object):
+    """Writer of a single database.
+
+    When a write fills the map, the map is grown by grow_factor, up to
+    max_mapsize bytes unless that is 0, and the interrupted batch is
+    replayed. Set grow_factor to 0 to get MapFullError instead.
+
+    If given, on_commit is called after every commit with a dict holding
+    the number of entries and bytes written and the commit latency.
+
+    With binary, string keys and values are stored as exact-length bytes
+    in a BytesDB, and must be read back by a binary Reader or DupReader.
+
+    codec, a name or a Codec, see get_codec, encodes the values in place of
+    encode_fn; mput and bulk_load encode them a batch at a time.
+
+    durability picks how commits reach the disk, see DURABILITY_FLAGS:
+    'sync' flushes every commit, 'meta-nosync' skips the flush of the meta
+    page, 'map-async' leaves the flush to the OS and 'nosync' skips it
+    altogether. Unless 'sync', the data at risk can be bounded by syncing
+    every flush_seconds from a background thread, and whenever
+    flush_bytes have been committed since the last sync. sync_stats holds
+    the count, total and maximum latency of those syncs.
+
+    With bloom_keys, a BloomFilter sized for that many keys at a false
+    positive rate of bloom_fpp is kept in the database db_name + '.bloom'
+    and updated in the txn of every commit, so that Readers can skip the
+    lookups of missing keys. It is built from the keys already present
+    if there is none yet. Deleted keys stay in the filter until
+    rebuild_bloom. Once a filter exists every Writer keeps it updated,
+    with bloom_keys or not, and rebuilds it if a commit bypassed it, such
+    as one made with the low-level DB API.
+
+    With metrics, the txns, writes, commits and map growths of the Env are
+    counted and timed, see Env.metrics.
+
+    indexes maps names to functions of (key, value) returning the value,
+    or list of values, to index the pair under, or None. Each index is a
+    duplicate key database db_name + '.index.' + name from those values
+    to the keys, updated in the txn of every put, mput, bulk_load and
+    delete, see Reader.get_by_index. Index values are strings. Values
+    replaced or deleted are decoded with decode_fn, or the codec, to
+    unindex them. All the databases must fit in max_dbs.
+    """
     def __init__(self, path, mapsize=10*MB, db_name=DEFAULT_DB_NAME,
                  dup=False, int_key=False, int_val=False,
-                 encode_fn=None, drop_on_mput=False):
+                 encode_fn=None, drop_on_mput=False,
+                 grow_factor=2, max_mapsize=0, on_commit=None,
+                 binary=False, codec=None, durability='nosync',
+                 flush_seconds=0, flush_bytes=0, bloom_keys=0,
+                 bloom_fpp=0.01, metrics=False, indexes=None,
+                 decode_fn=None, max_dbs=8):
+        self.codec = get_codec(codec)
+        if self.codec is not None:
+            encode_fn = self.codec.encode
+            decode_fn = self.codec.decode
+        if indexes and encode_fn is not None and decode_fn is None:
+            raise ValueError("decode_fn is required to index values encoded "
+                             "by encode_fn")
         # Check directory exists
         self.db_name = db_name
         self._check_mdb_dir(path)
-        self.env = Env(path, flags=MDB_NOSYNC | MDB_WRITEMAP, mapsize=mapsize)
+        self.env = Env(path, flags=_durability_flags(durability),
+                       mapsize=mapsize, metrics=metrics, max_dbs=max_dbs)
         txn = self.env.begin_txn()
         flags = MDB_CREATE
         flags |= MDB_DUPSORT if dup else 0
         flags |= MDB_INTEGERKEY if int_key else 0
         flags |= MDB_INTEGERDUP if int_val else 0
         self.flags = flags
-        self.db = self.env.open_db(txn, name=db_name, flags=flags)
+        self.db = self.env.open_db(txn, name=db_name, flags=flags,
+                                   binary=binary)
+        self.bloom = None
+        self.bloom_db = _open_bloom(self.env, txn, db_name,
+                                    create=bool(bloom_keys))
+        self.indexes = {}
+        created = []
+        for name, fn in (indexes or {}).items():
+            index_flags = MDB_DUPSORT
+            index_flags |= MDB_INTEGERDUP if int_key else 0
+            index_name = _index_db_name(db_name, name)
+            try:
+                index_db = self.env.open_db(txn, name=index_name,
+                                            flags=index_flags, binary=binary)
+            except Exception:
+                index_db = self.env.open_db(txn, name=index_name,
+                                            flags=index_flags | MDB_CREATE,
+                                            binary=binary)
+                created.append(name)
+            self.indexes[name] = (fn, index_db)
         self.encode_fn = encode_fn or IDENTITY_FN
+        self.decode_fn = decode_fn or IDENTITY_FN
         self.drop_on_mput = drop_on_mput
+        self.grow_factor = grow_factor
+        self.max_mapsize = max_mapsize
+        self.on_commit = on_commit
         txn.commit()
+        self.durability = durability
+        self.flush_seconds = flush_seconds
+        self.flush_bytes = flush_bytes
+        self.unsynced_bytes = 0
+        self.sync_stats = dict(count=0, seconds=0.0, max_seconds=0.0)
+        self.sync_lock = threading.Lock()
+        self.flusher = None
+        if flush_seconds and durability != 'sync':
+            self.flusher_stop = threading.Event()
+            self.flusher = threading.Thread(target=self._flush_every,
+                                            args=(flush_seconds,))
+            self.flusher.daemon = True
+            self.flusher.start()
+        self.bloom_keys = bloom_keys
+        self.bloom_fpp = bloom_fpp
+        self.bloom_stamp = 0
+        self.bloom_generation = 0
+        if self.bloom_db is not None:
+            txn = self.env.begin_txn()
+            try:
+                if self._bloom_begin(txn):
+                    _save_bloom(txn, self.bloom_db, self.bloom, txn.id,
+                                self.bloom_generation)
+                else:
+                    txn.abort()
+                    txn = None
+            except:
+                txn.abort()
+                raise
+            if txn is not None:
+                stamp = txn.id
+                txn.commit()
+                self._bloom_committed(stamp)
+        if created:
+            # an index added to a database holding data starts out with
+            # the entries of the pairs already stored
+            self._write_batch(lambda txn, batch: self._backfill(txn, created),
+                              [])
+
+    def _backfill(self, txn, names):
+        """Add the index entries of every stored pair to the indexes in
+        names, decoding each value once.
+        """
+        indexes = [self.indexes[name] for name in names]
+        for key, value in self.db._scan(txn, None, None, False, None, True,
+                                        False):
+            value = self.decode_fn(value)
+            for fn, index_db in indexes:
+                for ivalue in _index_values(fn, key, value):
+                    index_db.put(txn, ivalue, key)
+
+    def _bloom_begin(self, txn):
+        """Bring the Bloom filter up to date with the last commit, within
+        the write txn: reload it if another Writer saved it since, rebuild
+        it if there is none or a commit bypassed it. Returns True if it
+        was rebuilt, and needs saving.
+        """
+        meta = _load_bloom_meta(txn, self.bloom_db)
+        if meta is not None and meta[3] == _last_txnid(self.env):
+            if self.bloom is None or meta[3] != self.bloom_stamp:
+                self.bloom = _load_bloom(txn, self.bloom_db, meta)
+                self.bloom_stamp = meta[3]
+                self.bloom_generation = meta[4]
+            return False
+        nkeys = max(self.bloom_keys, self.db.stat(txn).get('ms_entries', 0))
+        bloom = BloomFilter.for_capacity(nkeys, self.bloom_fpp)
+        if meta is not None and meta[0] > bloom.nbits:
+            bloom = BloomFilter(meta[0], meta[1])
+        for key, _ in self.db.items(txn):
+            bloom.add(key)
+        self.bloom = bloom
+        self.bloom_generation = (meta[4] if meta is not None else 0) + 1
+        return True
+
+    def _bloom_committed(self, stamp):
+        _bloom_saved(self.bloom)
+        self.bloom_stamp = stamp
+
+    def rebuild_bloom(self, bloom_keys=None, bloom_fpp=None):
+        """Rebuild the Bloom filter from the keys in the database, sized
+        for bloom_keys keys, or at least as many as there are entries, at
+        a false positive rate of bloom_fpp. Defaults to the settings given
+        to the Writer.
+        """
+        bloom_keys = bloom_keys or self.bloom_keys
+        bloom_fpp = bloom_fpp or self.bloom_fpp
+        txn = self.env.begin_txn()
+        try:
+            if self.bloom_db is None:
+                self.bloom_db = _open_bloom(self.env, txn, self.db_name,
+                                            create=True)
+            meta = _load_bloom_meta(txn, self.bloom_db)
+            if meta is not None:
+                self.bloom_generation = max(self.bloom_generation, meta[4])
+            nkeys = max(bloom_keys, self.db.stat(txn).get('ms_entries', 0))
+            bloom = BloomFilter.for_capacity(nkeys, bloom_fpp)
+            for key, _ in self.db.items(txn):
+                bloom.add(key)
+            stamp = txn.id
+            _save_bloom(txn, self.bloom_db, bloom, stamp,
+                        self.bloom_generation + 1)
+        except:
+            txn.abort()
+            raise
+        txn.commit()
+        self.bloom = bloom
+        self.bloom_generation += 1
+        self._bloom_committed(stamp)
+
+    def sync(self):
+        """Flush the committed data to disk and record the latency.
+        """
+        with self.sync_lock:
+            self.unsynced_bytes = 0
+            started = time.time()
+            self.env.sync(True)
+            elapsed = time.time() - started
+            self.sync_stats['count'] += 1
+            self.sync_stats['seconds'] += elapsed
+            self.sync_stats['max_seconds'] = max(
+                self.sync_stats['max_seconds'], elapsed)
+
+    def metrics(self):
+        return self.env.metrics()
+
+    def _flush_every(self, seconds):
+        while not self.flusher_stop.wait(seconds):
+            self.sync()
 
     def _check_mdb_dir(self, path):
         import os
@@ -1379,42 +4730,810 @@ class Writer(object):
             else:
                 raise
 
+    def _stored(self, txn, key):
+        # the encoded values of key, before a write replaces or deletes them
+        if self.flags & MDB_DUPSORT:
+            return list(self.db.get_dup(txn, key))
+        try:
+            return [self.db.get(txn, key)]
+        except KeyNotFoundError:
+            return []
+
+    def _reindex(self, txn, key, old_values, new_values):
+        """Move the index entries of key from the encoded old_values it had
+        to the new_values it has, decoding each value once for all indexes.
+        """
+        decode_fn = self.decode_fn
+        old_values = [decode_fn(value) for value in old_values]
+        new_values = [decode_fn(value) for value in new_values]
+        for fn, index_db in self.indexes.values():
+            old = set()
+            for value in old_values:
+                old |= _index_values(fn, key, value)
+            new = set()
+            for value in new_values:
+                new |= _index_values(fn, key, value)
+            for ivalue in old - new:
+                try:
+                    index_db.delete(txn, ivalue, key)
+                except KeyNotFoundError:
+                    pass
+            for ivalue in new - old:
+                index_db.put(txn, ivalue, key)
+
+    def _put_batch(self, txn, batch):
+        if not self.indexes:
+            for key, value in batch:
+                self.db.put(txn, key, value)
+            return
+        for key, value in batch:
+            # a dup is added to the values of key, which keep their entries
+            old = [] if self.flags & MDB_DUPSORT else self._stored(txn, key)
+            self.db.put(txn, key, value)
+            self._reindex(txn, key, old, [value])
+
+    def _delete_batch(self, txn, batch):
+        for key, value in batch:
+            if not self.indexes:
+                self.db.delete(txn, key, value)
+                continue
+            old = self._stored(txn, key)
+            self.db.delete(txn, key, value)
+            self._reindex(txn, key, old,
+                          [v for v in old if value is not None and v != value])
+
+    def _write_batch(self, write_fn, batch, dups=False):
+        """Call write_fn(txn, batch) in a new txn and commit it, growing the
+        map and starting over whenever it fills up. A batch that does not
+        fit in one txn is split in two at a key boundary. With dups, batch
+        holds (key, values) pairs and each value counts as an entry.
+
+        Returns the size of the largest chunk of batch committed at once.
+        """
+        while True:
+            txn = self.env.begin_txn()
+            try:
+                if self.bloom_db is not None:
+                    self._bloom_begin(txn)
+                write_fn(txn, batch)
+                if self.bloom_db is not None:
+                    for item in batch:
+                        self.bloom.add(item[0])
+                    stamp = txn.id
+                    _save_bloom(txn, self.bloom_db, self.bloom, stamp,
+                                self.bloom_generation)
+            except MapFullError:
+                txn.abort()
+                if not self.grow_factor:
+                    raise
+                self.env.grow_mapsize(self.grow_factor, self.max_mapsize)
+                continue
+            except TxnFullError:
+                txn.abort()
+                half = _split_batch(batch)
+                if not half:
+                    raise
+                return max(self._write_batch(write_fn, batch[:half], dups),
+                           self._write_batch(write_fn, batch[half:], dups))
+            except:
+                txn.abort()
+                raise
+            started = time.time()
+            try:
+                txn.commit()
+            except MapFullError:
+                # a failed commit has already freed the txn
+                if not self.grow_factor:
+                    raise
+                self.env.grow_mapsize(self.grow_factor, self.max_mapsize)
+                continue
+            elapsed = time.time() - started
+            if self.bloom_db is not None:
+                self._bloom_committed(stamp)
+            if self.on_commit is not None or self.flush_bytes:
+                nbytes = sum([_pair_size(item[0], item[1]) for item in batch])
+                if self.on_commit is not None:
+                    if dups:
+                        entries = sum([len(item[1]) for item in batch])
+                    else:
+                        entries = len(batch)
+                    self.on_commit(dict(entries=entries, bytes=nbytes,
+                                        seconds=elapsed))
+                if self.flush_bytes and self.durability != 'sync':
+                    self.unsynced_bytes += nbytes
+                    if self.unsynced_bytes >= self.flush_bytes:
+                        self.sync()
+            return len(batch)
+
+    def _encode_pairs(self, pairs):
+        if self.codec is None:
+            for key, value in pairs:
+                yield key, self.encode_fn(value)
+            return
+        import itertools
+
+        pairs = iter(pairs)
+        while True:
+            chunk = list(itertools.islice(pairs, 1024))
+            if not chunk:
+                break
+            values = self.codec.encode_many([value for key, value in chunk])
+            for (key, _), value in zip(chunk, values):
+                yield key, value
+
     def put(self, key, value):
-        txn = self.env.begin_txn()
-        self.db.put(txn, key, self.encode_fn(value))
-        txn.commit()
+        self._write_batch(self._put_batch, [(key, self.encode_fn(value))])
 
-    def mput(self, data):
+    def delete(self, key, value=None):
+        """Delete all the values of key, or only value, and their index
+        entries. Raises KeyNotFoundError if there is nothing to delete.
+        """
+        if value is not None:
+            value = self.encode_fn(value)
+        self._write_batch(self._delete_batch, [(key, value)])
+
+    def mput(self, data, max_entries=MDB_COMMIT_THRESHOLD, max_bytes=0,
+             max_seconds=0):
+        """Write (key, value) pairs in batches.
+
+        A batch is committed once it holds max_entries pairs, max_bytes of
+        keys and encoded values, or was started max_seconds ago, whichever
+        comes first; 0 disables the bytes and time limits. When a batch
+        overflows the txn it is halved, and so is max_entries for the rest
+        of the call.
+        """
         if hasattr(data, "iteritems"):
             data = data.iteritems()
 
         if self.drop_on_mput:
             self.drop()
 
-        txn = self.env.begin_txn()
-        ncount = 0
-        for key, value in data:
-            self.db.put(txn, key, self.encode_fn(value))
-            ncount += 1
-            if ncount > MDB_COMMIT_THRESHOLD:
-                txn.commit()
-                txn = self.env.begin_txn()
-                ncount = 0
-        txn.commit()
+        batch = []
+        nbytes = 0
+        started = 0
+        for key, value in self._encode_pairs(data):
+            if max_seconds and not batch:
+                started = time.time()
+            batch.append((key, value))
+            if max_bytes:
+                nbytes += _pair_size(key, value)
+            if (len(batch) >= max_entries
+                    or (max_bytes and nbytes >= max_bytes)
+                    or (max_seconds and time.time() - started >= max_seconds)):
+                committed = self._write_batch(self._put_batch, batch)
+                if committed < len(batch):
+                    # the batch was split to fit in a txn
+                    max_entries = min(max_entries, committed)
+                batch = []
+                nbytes = 0
+        if batch:
+            self._write_batch(self._put_batch, batch)
+
+    def _put_multiple_batch(self, txn, batch):
+        for key, values in batch:
+            self.db.put_multiple(txn, key, values)
+            if self.indexes:
+                self._reindex(txn, key, [], list(values))
+
+    def mput_dups(self, data, max_entries=MDB_COMMIT_THRESHOLD):
+        """Write (key, values) pairs of an integer valued database, where
+        values is an array.array('l') or other buffer or iterable of longs
+        stored with one DB.put_multiple call per key. encode_fn is not
+        applied.
+
+        A batch is committed once it holds max_entries values; a key is
+        never split across batches.
+        """
+        if hasattr(data, "iteritems"):
+            data = data.iteritems()
+
+        if self.drop_on_mput:
+            self.drop()
+
+        batch = []
+        nvalues = 0
+        for key, values in data:
+            if not isinstance(values, array.array):
+                try:
+                    memoryview(values)
+                except TypeError:
+                    values = array.array('l', values)
+            batch.append((key, values))
+            nvalues += len(values)
+            if nvalues >= max_entries:
+                self._write_batch(self._put_multiple_batch, batch, True)
+                batch = []
+                nvalues = 0
+        if batch:
+            self._write_batch(self._put_multiple_batch, batch, True)
+
+    def bulk_load(self, data, presorted=True, strict=True):
+        """Load (key, value) pairs with DB.put_sorted in append mode.
+
+        The pairs must be sorted by key and then by encoded value unless
+        presorted is False, in which case they go through external_sort
+        first. Transactions are committed between keys only, once more than
+        MDB_COMMIT_THRESHOLD pairs are pending. Returns the number of pairs
+        written.
+        """
+        import itertools
+
+        if hasattr(data, "iteritems"):
+            data = data.iteritems()
+
+        if self.drop_on_mput:
+            self.drop()
+
+        data = self._encode_pairs(data)
+        if not presorted:
+            data = external_sort(data, key=_lmdb_order(
+                self.flags & MDB_INTEGERKEY, self.flags & MDB_INTEGERDUP))
+
+        def write_fn(txn, batch):
+            if not self.indexes:
+                return self.db.put_sorted(txn, batch, strict)
+            old = {}
+            if not self.flags & MDB_DUPSORT:
+                for key, _ in batch:
+                    old[key] = self._stored(txn, key)
+            self.db.put_sorted(txn, batch, strict)
+            for key, value in batch:
+                self._reindex(txn, key, old.get(key, []), [value])
+                if key in old:
+                    old[key] = [value]
+        batch = []
+        total = 0
+        for key, group in itertools.groupby(data, key=lambda pair: pair[0]):
+            batch.extend(group)
+            if len(batch) > MDB_COMMIT_THRESHOLD:
+                self._write_batch(write_fn, batch)
+                total += len(batch)
+                batch = []
+        if batch:
+            self._write_batch(write_fn, batch)
+        return total + len(batch)
 
     def drop(self):
         txn = self.env.begin_txn()
         self.db.drop(txn)
+        for _, index_db in self.indexes.values():
+            index_db.drop(txn)
+        if self.bloom_db is not None:
+            self._bloom_begin(txn)
+            self.bloom = BloomFilter(self.bloom.nbits, self.bloom.nhashes)
+            self.bloom_generation += 1
+            stamp = txn.id
+            _save_bloom(txn, self.bloom_db, self.bloom, stamp,
+                        self.bloom_generation)
         txn.commit()
+        if self.bloom_db is not None:
+            self._bloom_committed(stamp)
 
     def close(self):
+        if self.flusher is not None:
+            self.flusher_stop.set()
+            self.flusher.join()
+            self.flusher = None
+        if self.durability != 'sync' and (self.flush_seconds or
+                                          self.flush_bytes or
+                                          self.durability != 'nosync'):
+            self.sync()
         self.db.close()
         self.env.close()
         self.db = None
         self.env = None
 
     def __del__(self):
-        if self.db is not None:
+        # __init__ may have failed before opening them
+        if getattr(self, 'db', None) is not None:
             self.db.close()
-        if self.env is not None:
+        if getattr(self, 'env', None) is not None:
             self.env.close()
+
+
+class GroupCommitWriter(object):
+    """Writer batching the puts and deletes of many threads into group
+    commits.
+
+    put and delete queue an operation and return a concurrent.futures
+    Future. A background thread writes the queued operations in one txn
+    once max_entries are pending or the first of them has waited
+    max_seconds, then syncs the Env once if sync, so every write is
+    durable when its future resolves, at the cost of one fsync per batch.
+    writer_kwargs create the underlying Writer.
+
+    on_commit, if given in writer_kwargs, is called once the futures of a
+    batch are resolved; the first error it raises is raised again by
+    close. Python 2 needs the futures backport of concurrent.futures.
+    """
+    def __init__(self, path, max_entries=10000, max_seconds=0.01, sync=True,
+                 **writer_kwargs):
+        from concurrent.futures import Future
+        try:
+            import queue
+        except ImportError:
+            import Queue as queue
+
+        self.on_commit = writer_kwargs.pop('on_commit', None)
+        self.commit_stats = []
+        self.callback_error = None
+        if self.on_commit is not None:
+            writer_kwargs['on_commit'] = self.commit_stats.append
+        self.writer = Writer(path, **writer_kwargs)
+        self.Future = Future
+        self.max_entries = max_entries
+        self.max_seconds = max_seconds
+        self.sync = sync
+        self.queue = queue.Queue()
+        self.close_lock = threading.Lock()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, key, value):
+        return self._submit(key, self.writer.encode_fn(value), False)
+
+    def delete(self, key, value=None):
+        """Delete all the values of key, or only value, see DB.delete.
+        """
+        return self._submit(key, value, True)
+
+    def _submit(self, key, value, bint delete):
+        future = self.Future()
+        # queued under the lock, so never behind the sentinel of close
+        with self.close_lock:
+            if self.closed:
+                raise Exception("Error putting data: writer is closed")
+            self.queue.put((key, value, delete, future))
+        return future
+
+    def _run(self):
+        try:
+            import queue
+        except ImportError:
+            import Queue as queue
+
+        closing = False
+        while not closing:
+            op = self.queue.get()
+            if op is None:
+                break
+            batch = [op]
+            deadline = time.time() + self.max_seconds
+            while len(batch) < self.max_entries:
+                try:
+                    op = self.queue.get(timeout=max(0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                if op is None:
+                    closing = True
+                    break
+                batch.append(op)
+            self._commit([op for op in batch
+                          if op[3].set_running_or_notify_cancel()])
+
+    def _write_ops(self, txn, batch, errors):
+        # a delete of a missing key changes nothing and is reported on its
+        # own future; any other error fails the whole batch in _commit,
+        # so an index is never left behind its database
+        writer = self.writer
+        for key, value, delete, future in batch:
+            if not delete:
+                writer._put_batch(txn, [(key, value)])
+                continue
+            try:
+                writer._delete_batch(txn, [(key, value)])
+            except KeyNotFoundError as e:
+                errors[future] = e
+
+    def _commit(self, batch):
+        errors = {}
+        if not batch:
+            return
+        try:
+            self.writer._write_batch(
+                lambda txn, batch: self._write_ops(txn, batch, errors), batch)
+            if self.sync:
+                self.writer.sync()
+        except Exception as e:
+            for _, _, _, future in batch:
+                future.set_exception(e)
+            return
+        finally:
+            stats = self.commit_stats[:]
+            del self.commit_stats[:]
+        for _, _, _, future in batch:
+            if future in errors:
+                future.set_exception(errors[future])
+            else:
+                future.set_result(None)
+        # the batch is committed whatever the callback does
+        try:
+            for stat in stats:
+                self.on_commit(stat)
+        except Exception as e:
+            if self.callback_error is None:
+                self.callback_error = e
+
+    def close(self):
+        """Commit the queued operations and close the writer.
+        """
+        with self.close_lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        self.writer.close()
+        if self.callback_error is not None:
+            raise self.callback_error
+
+
+def migrate_to_bytes(src_path, dst_path, db_name=DEFAULT_DB_NAME,
+                     dup=False, mapsize=0):
+    """Rewrite a database of NUL terminated strings at src_path into a new
+    binary database at dst_path, readable with binary=True.
+
+    Dropping the NUL byte keeps the key and value order, so the pairs are
+    bulk loaded in append mode. mapsize defaults to that of the source.
+    Returns the number of pairs written.
+    """
+    if dup:
+        reader = DupReader(src_path, db_name)
+    else:
+        reader = Reader(src_path, db_name)
+    try:
+        mapsize = mapsize or reader.env.info()['me_mapsize']
+        writer = Writer(dst_path, mapsize, db_name, dup=dup, binary=True)
+        try:
+            return writer.bulk_load(reader.iteritems(), strict=False)
+        finally:
+            writer.close()
+    finally:
+        reader.close()
+
+
+def _shard_path(path, int shard):
+    name = '%d' % shard
+    if isinstance(path, bytes):
+        name = name.encode('ascii')
+    import os
+    return os.path.join(path, name)
+
+
+def _shard_of(key, int nshards, boundaries):
+    """Return the shard of key: by range if boundaries, the sorted keys
+    starting each shard but the first, otherwise by a hash that is stable
+    across processes.
+    """
+    import bisect
+    import zlib
+
+    if boundaries:
+        return bisect.bisect_right(boundaries, key)
+    if isinstance(key, (int, long)):
+        return key % nshards
+    return (zlib.crc32(key) & 0xffffffff) % nshards
+
+
+def _shard_mput(task):
+    path, writer_kwargs, pairs = task
+    writer = Writer(path, **writer_kwargs)
+    try:
+        writer.mput(pairs)
+    finally:
+        writer.close()
+    return len(pairs)
+
+
+def _merge_sorted(iterables, bint reverse=False):
+    """Merge iterables of (key, value) pairs sorted by key, ascending or
+    descending, keeping the pairs of equal keys in iterable order.
+    """
+    import heapq
+
+    heap = []
+    for i, it in enumerate(iterables):
+        it = iter(it)
+        for key, value in it:
+            heap.append((_Descending(key) if reverse else key, i, value, it))
+            break
+    heapq.heapify(heap)
+    while heap:
+        key, i, value, it = heap[0]
+        yield (key.key if reverse else key), value
+        for key, value in it:
+            heapq.heapreplace(
+                heap, (_Descending(key) if reverse else key, i, value, it))
+            break
+        else:
+            heapq.heappop(heap)
+
+
+class _Descending(object):
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+class ShardedWriter(object):
+    """Writer partitioning keys over several environments, the shards,
+    stored in the numbered directories under path.
+
+    Keys are spread by hash over nshards shards, or by range if given
+    boundaries, the sorted keys starting each shard but the first. The
+    layout is saved under path and reused when reopened. mput writes the
+    shards in parallel from a pool of processes, each shard being a Writer
+    created with writer_kwargs, which must be picklable.
+    """
+    def __init__(self, path, nshards=None, boundaries=None, processes=None,
+                 **writer_kwargs):
+        self.path = path
+        self.nshards, self.boundaries = _open_layout(path, nshards,
+                                                     boundaries)
+        self.drop_on_mput = writer_kwargs.pop('drop_on_mput', False)
+        self.writer_kwargs = writer_kwargs
+        self.pool = None
+        if processes != 1:
+            # forked before any Env is opened, as LMDB requires
+            import multiprocessing
+            self.pool = multiprocessing.Pool(processes)
+        for shard in range(self.nshards):
+            _shard_mput((_shard_path(path, shard), writer_kwargs, []))
+
+    def shard_of(self, key):
+        return _shard_of(key, self.nshards, self.boundaries)
+
+    def put(self, key, value):
+        self.mput([(key, value)])
+
+    def mput(self, data, chunk_size=MDB_COMMIT_THRESHOLD):
+        """Write (key, value) pairs, chunk_size pairs per shard at a time,
+        one process per shard.
+        """
+        import itertools
+
+        if hasattr(data, "iteritems"):
+            data = data.iteritems()
+
+        if self.drop_on_mput:
+            self.drop()
+
+        data = iter(data)
+        while True:
+            batches = [[] for _ in range(self.nshards)]
+            for key, value in itertools.islice(data,
+                                               chunk_size * self.nshards):
+                batches[self.shard_of(key)].append((key, value))
+            tasks = [(_shard_path(self.path, shard), self.writer_kwargs,
+                      batch)
+                     for shard, batch in enumerate(batches) if batch]
+            if not tasks:
+                break
+            if self.pool is None:
+                for task in tasks:
+                    _shard_mput(task)
+            else:
+                self.pool.map(_shard_mput, tasks)
+
+    def drop(self):
+        for shard in range(self.nshards):
+            writer = Writer(_shard_path(self.path, shard),
+                            **self.writer_kwargs)
+            try:
+                writer.drop()
+            finally:
+                writer.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+def _open_layout(path, nshards, boundaries):
+    """Return the (nshards, boundaries) layout saved under path, saving the
+    one given if there is none yet.
+    """
+    import os
+
+    layout_path = os.path.join(path, b'layout' if isinstance(path, bytes)
+                               else 'layout')
+    if boundaries is not None:
+        boundaries = list(boundaries)
+        if boundaries != sorted(boundaries):
+            raise ValueError("Shard boundaries are out of order")
+        nshards = len(boundaries) + 1
+    if os.path.exists(layout_path):
+        with open(layout_path, 'rb') as f:
+            layout = pickle.load(f)
+        if nshards is not None and (nshards, boundaries) != layout:
+            raise ValueError("Shard layout differs from the one at %r"
+                             % (path,))
+        return layout
+    if not nshards:
+        raise ValueError("Either nshards or boundaries is required")
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    with open(layout_path, 'wb') as f:
+        pickle.dump((nshards, boundaries), f, 2)
+    return nshards, boundaries
+
+
+class ShardedReader(object):
+    """Reader of the shards written by a ShardedWriter.
+
+    Each shard is a Reader, or a DupReader if dup, created with
+    reader_kwargs. iteritems and get_range merge the shards in key order,
+    which is LMDB's for string keys and non-negative integer keys.
+    """
+    def __init__(self, path, dup=False, **reader_kwargs):
+        self.path = path
+        self.nshards, self.boundaries = _open_layout(path, None, None)
+        reader_cls = DupReader if dup else Reader
+        self.readers = [reader_cls(_shard_path(path, shard), **reader_kwargs)
+                        for shard in range(self.nshards)]
+
+    def shard_of(self, key):
+        return _shard_of(key, self.nshards, self.boundaries)
+
+    def get(self, key, *args):
+        return self.readers[self.shard_of(key)].get(key, *args)
+
+    def get_many(self, keys, default=None):
+        """Return the values of keys, in order, with one get_many per
+        shard.
+        """
+        keys = list(keys)
+        shards = [[] for _ in range(self.nshards)]
+        for i, key in enumerate(keys):
+            shards[self.shard_of(key)].append(i)
+        values = [default] * len(keys)
+        for shard, indexes in enumerate(shards):
+            if not indexes:
+                continue
+            found = self.readers[shard].get_many([keys[i] for i in indexes],
+                                                 default)
+            for i, value in zip(indexes, found):
+                values[i] = value
+        return values
+
+    def _shards(self, start, end, bint reverse):
+        # the shards that may hold keys in [start, end], in scan order
+        shards = range(self.nshards)
+        if self.boundaries:
+            first = 0 if start is None else self.shard_of(start)
+            last = self.nshards - 1 if end is None else self.shard_of(end)
+            shards = range(first, last + 1)
+        return list(reversed(shards)) if reverse else list(shards)
+
+    def _merge(self, iterables, bint reverse):
+        import itertools
+
+        if self.boundaries:
+            return itertools.chain(*iterables)
+        return _merge_sorted(iterables, reverse)
+
+    def iteritems(self):
+        return self._merge([self.readers[shard].iteritems()
+                            for shard in self._shards(None, None, False)],
+                           False)
+
+    def get_range(self, start=None, end=None, reverse=False, limit=None):
+        """Return the key values with start <= key <= end across the
+        shards, see DB.get_range.
+        """
+        import itertools
+
+        items = self._merge([_snapshot_range(self.readers[shard], start, end,
+                                             reverse, limit)
+                             for shard in self._shards(start, end, reverse)],
+                            reverse)
+        if limit is not None:
+            items = itertools.islice(items, limit)
+        return items
+
+    def close(self):
+        for reader in self.readers:
+            reader.close()
+
+    def __len__(self):
+        return sum([len(reader) for reader in self.readers])
+
+
+def _snapshot_range(reader, start, end, reverse, limit):
+    snapshot = reader.snapshot()
+    try:
+        for item in snapshot.get_range(start, end, reverse, limit):
+            yield item
+    finally:
+        snapshot.close()
+
+
+def split_keys(reader, int n):
+    """Return up to n - 1 sorted keys splitting the database of reader
+    into n ranges of roughly even size.
+
+    The ranges hold even shares of ms_entries, counting every dup: the
+    keys are walked once with a cursor, without reading their values, to
+    find the key at each share, so the split holds whatever the key
+    distribution. n is capped by the number of leaf pages, the finest
+    useful split.
+    """
+    with reader.snapshot() as snapshot:
+        txn, db = snapshot.txn, snapshot.db
+        stat = db.stat(txn)
+        entries = stat['ms_entries']
+        n = max(1, min(n, stat['ms_leaf_pages']))
+        if not entries or n == 1:
+            return []
+        keys = []
+        for key in db._keys_at(txn, [entries * i // n for i in range(1, n)]):
+            if not keys or key != keys[-1]:
+                keys.append(key)
+        return keys
+
+
+def _scan_range(task):
+    path, reader_kwargs, fn, start, end = task
+    dup = reader_kwargs.pop('dup', False)
+    reader = (DupReader if dup else Reader)(path, **reader_kwargs)
+    try:
+        with reader.snapshot() as snapshot:
+            items = snapshot.db._scan(snapshot.txn, start, end, False, None,
+                                      True, False)
+            return fn(snapshot._decoded(items))
+    finally:
+        reader.close()
+
+
+def parallel_scan(path, fn, reduce_fn=None, workers=None, ranges=None,
+                  **reader_kwargs):
+    """Map fn over the database at path split into key ranges, in a pool
+    of worker processes each opening its own read-only Env.
+
+    fn is called with an iterator of the (key, value) pairs of a range and
+    must be picklable, as must reader_kwargs, which create the Reader, or
+    DupReader if dup, of every worker. The keyspace is split into ranges,
+    by default 4 per worker, see split_keys; the pool hands them out one
+    at a time so that uneven ranges still keep every worker busy.
+
+    Returns the results of fn in key order, or their reduction with
+    reduce_fn if given.
+    """
+    import functools
+    import multiprocessing
+
+    workers = workers or multiprocessing.cpu_count()
+    dup = reader_kwargs.pop('dup', False)
+    reader = (DupReader if dup else Reader)(path, **reader_kwargs)
+    try:
+        keys = split_keys(reader, ranges or 4 * workers)
+    finally:
+        reader.close()
+    reader_kwargs['dup'] = dup
+    bounds = [None] + keys + [None]
+    tasks = [(path, dict(reader_kwargs), fn, start, end)
+             for start, end in zip(bounds, bounds[1:])]
+    if workers == 1:
+        results = [_scan_range(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(_scan_range, tasks, 1)
+        finally:
+            pool.close()
+            pool.join()
+    if reduce_fn is None:
+        return results
+    return functools.reduce(reduce_fn, results)
@@ -0,0 +1,155 @@
+"""asyncio front-end for pymdb-lightning.
+
+AsyncReader and AsyncWriter run the blocking Reader and Writer calls in
+thread pools, where LMDB runs without the GIL, so that an event loop
+never waits on a page fault or a commit:
+
+    reader = mdb_aio.AsyncReader('/tmp/mdbtest')
+    value = await reader.get('foo')
+    async for key, value in reader.get_range('a', 'f'):
+        ...
+
+Paths and database names may be str, and are encoded; keys and values
+are bytes, as for mdb itself. Requires Python 3.7 or later.
+"""
+import asyncio
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import mdb
+
+
+def _native(path, kwargs):
+    # Env and open_db take char * names
+    db_name = kwargs.get('db_name', mdb.DEFAULT_DB_NAME)
+    if isinstance(db_name, str):
+        kwargs['db_name'] = db_name.encode()
+    return os.fsencode(path), kwargs
+
+
+class AsyncReader(object):
+    """Reader whose lookups run in a pool of max_workers threads.
+
+    Iterators are streamed chunk_size pairs at a time, each chunk read in
+    the pool. reader_kwargs create the Reader, or DupReader if dup.
+    """
+    def __init__(self, path, max_workers=4, chunk_size=1000, dup=False,
+                 **reader_kwargs):
+        reader_cls = mdb.DupReader if dup else mdb.Reader
+        path, reader_kwargs = _native(path, reader_kwargs)
+        self.reader = reader_cls(path, **reader_kwargs)
+        self.chunk_size = chunk_size
+        self.executor = ThreadPoolExecutor(max_workers)
+        self.streams = set()
+
+    def _run(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, fn,
+                                                          *args)
+
+    async def get(self, key, *args):
+        if isinstance(self.reader, mdb.DupReader):
+            return await self._run(lambda: list(self.reader.get(key)))
+        return await self._run(self.reader.get, key, *args)
+
+    async def get_many(self, keys, default=None):
+        return await self._run(self.reader.get_many, list(keys), default)
+
+    async def _stream(self, items):
+        next_chunk = lambda: list(itertools.islice(items, self.chunk_size))
+        self.streams.add(items)
+        try:
+            while True:
+                chunk = await self._run(next_chunk)
+                if not chunk:
+                    break
+                for item in chunk:
+                    yield item
+        finally:
+            # ends the txn of an iterator left unfinished, unless close
+            # already did
+            if items in self.streams:
+                self.streams.discard(items)
+                await self._run(items.close)
+
+    def iteritems(self):
+        """Asynchronously iterate all the (key, value) pairs.
+        """
+        return self._stream(self.reader.iteritems())
+
+    def get_range(self, start=None, end=None, reverse=False, limit=None):
+        """Asynchronously iterate the (key, value) pairs with
+        start <= key <= end, see mdb.DB.get_range.
+        """
+        return self._stream(self._range(start, end, reverse, limit))
+
+    def _range(self, start, end, reverse, limit):
+        with self.reader.snapshot() as snapshot:
+            for item in snapshot.get_range(start, end, reverse, limit):
+                yield item
+
+    async def close(self):
+        streams, self.streams = self.streams, set()
+        for items in streams:
+            await self._run(items.close)
+        await self._run(self.reader.close)
+        self.executor.shutdown()
+
+
+class AsyncWriter(object):
+    """Writer coalescing the puts of concurrent coroutines into group
+    commits.
+
+    Puts made while a commit is in progress are queued and written
+    together in the next txn by a single writer thread, so many producers
+    share one commit instead of paying one each. put returns once its
+    txn is committed. writer_kwargs create the Writer; drop_on_mput is
+    not supported.
+    """
+    def __init__(self, path, **writer_kwargs):
+        writer_kwargs.pop('drop_on_mput', None)
+        path, writer_kwargs = _native(path, writer_kwargs)
+        self.writer = mdb.Writer(path, **writer_kwargs)
+        self.executor = ThreadPoolExecutor(1)
+        self.pending = []
+        self.flusher = None
+
+    def _run(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, fn,
+                                                          *args)
+
+    async def put(self, key, value):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((key, value, future))
+        if self.flusher is None:
+            self.flusher = asyncio.ensure_future(self._flush())
+        await future
+
+    async def mput(self, data):
+        """Write (key, value) pairs with Writer.mput, bypassing the queue.
+        """
+        await self._run(self.writer.mput, data)
+
+    async def _flush(self):
+        try:
+            while self.pending:
+                batch, self.pending = self.pending, []
+                try:
+                    await self._run(self.writer.mput,
+                                    [(key, value) for key, value, _ in batch])
+                except Exception as e:
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_result(None)
+        finally:
+            self.flusher = None
+
+    async def close(self):
+        if self.flusher is not None:
+            await self.flusher
+        await self._run(self.writer.close)
+        self.executor.shutdown()
@@ -0,0 +1,546 @@
+"""Benchmarks for pymdb-lightning.
+
+Builds synthetic datasets in every database flavour and measures writes,
+point reads, duplicate reads, scans and range queries through both the
+low-level (Env/DB) and the Writer/Reader APIs, then reports throughput,
+latency percentiles, RSS and map usage. For example:
+
+    python -m mdb_bench /tmp/mdbbench --keys 100000 --threads 1 4 \\
+        --processes 4 --json results.json
+    python -m mdb_bench /tmp/mdbbench --compare results.json
+
+Reads run in the given numbers of threads sharing one Env, and of
+processes each opening its own. Writes always run in a single thread.
+Results are JSON so that runs can be compared; --compare prints the
+change in ops/s against an earlier run.
+"""
+from __future__ import print_function
+
+import argparse
+import bisect
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import mdb
+
+timer = getattr(time, 'perf_counter', time.time)
+
+DB_NAME = b'bench'
+
+# flavour: (int_key, int_val)
+FLAVOURS = {
+    'str': (False, False),
+    'strint': (False, True),
+    'intstr': (True, False),
+    'intint': (True, True),
+}
+APIS = ('low', 'high')
+READ_OPS = ('get', 'get_dup', 'items', 'dup_items', 'get_range')
+WRITE_OPS = ('mput', 'put')
+DISTRIBUTIONS = ('uniform', 'zipf', 'sequential')
+
+
+class Dataset(object):
+    """Keys and values of a synthetic dataset of one flavour: nkeys keys,
+    each with dups values, strings being value_size bytes long.
+    """
+    def __init__(self, flavour, nkeys, dups=1, value_size=100):
+        self.flavour = flavour
+        self.int_key, self.int_val = FLAVOURS[flavour]
+        self.nkeys = nkeys
+        self.dups = dups
+        self.value_size = value_size
+
+    def key(self, i):
+        if self.int_key:
+            return i
+        return ('%012d' % i).encode()
+
+    def value(self, i, j):
+        if self.int_val:
+            return i * self.dups + j
+        return ('%d' % j).encode().ljust(self.value_size, b'v')
+
+    def pairs(self, indices):
+        for i in indices:
+            key = self.key(i)
+            for j in range(self.dups):
+                yield key, self.value(i, j)
+
+
+def _key_indices(distribution, nkeys, nops, seed):
+    """Return the nops indices of the keys to look up."""
+    rand = random.Random(seed)
+    if distribution == 'sequential':
+        start = rand.randrange(nkeys)
+        return [(start + i) % nkeys for i in range(nops)]
+    if distribution == 'zipf':
+        # s = 1.1 over the keys in a random order, so hot keys are spread
+        # over the tree
+        weights = [1.0 / (rank ** 1.1) for rank in range(1, nkeys + 1)]
+        cumulative = []
+        total = 0.0
+        for weight in weights:
+            total += weight
+            cumulative.append(total)
+        ranked = list(range(nkeys))
+        random.Random(0).shuffle(ranked)
+        return [ranked[min(bisect.bisect(cumulative, rand.random() * total),
+                           nkeys - 1)]
+                for _ in range(nops)]
+    return [rand.randrange(nkeys) for _ in range(nops)]
+
+
+class Target(object):
+    """An open database of a Dataset, with one method per read op taking
+    the index of a key and returning the number of entries read.
+    """
+    def __init__(self, path, dataset, api, range_size=100):
+        self.dataset = dataset
+        self.api = api
+        self.range_size = range_size
+        dup = dataset.dups > 1
+        if api == 'low':
+            flags = mdb.MDB_DUPSORT if dup else 0
+            flags |= mdb.MDB_INTEGERKEY if dataset.int_key else 0
+            flags |= mdb.MDB_INTEGERDUP if dataset.int_val else 0
+            self.env = mdb.Env(path, flags=mdb.MDB_RDONLY)
+            txn = self.env.begin_txn(flags=mdb.MDB_RDONLY)
+            self.db = self.env.open_db(txn, name=DB_NAME, flags=flags)
+            txn.commit()
+            self.local = threading.local()
+            self.txns = []
+            self.lock = threading.Lock()
+        else:
+            reader_cls = mdb.DupReader if dup else mdb.Reader
+            self.reader = reader_cls(path, db_name=DB_NAME,
+                                     int_key=dataset.int_key,
+                                     int_val=dataset.int_val)
+
+    def txn(self):
+        # low-level readers keep one txn per thread, renewed per op
+        txn = getattr(self.local, 'txn', None)
+        if txn is None:
+            txn = self.local.txn = self.env.begin_txn(flags=mdb.MDB_RDONLY)
+            with self.lock:
+                self.txns.append(txn)
+        else:
+            txn.renew()
+        return txn
+
+    def done(self, txn):
+        txn.reset()
+
+    def get(self, i):
+        key = self.dataset.key(i)
+        if self.api == 'high':
+            if isinstance(self.reader, mdb.DupReader):
+                self.reader.get_first(key)
+            else:
+                self.reader.get(key)
+            return 1
+        txn = self.txn()
+        try:
+            self.db.get(txn, key)
+        finally:
+            self.done(txn)
+        return 1
+
+    def get_dup(self, i):
+        key = self.dataset.key(i)
+        if self.api == 'high':
+            return len(list(self.reader.get(key)))
+        txn = self.txn()
+        try:
+            return len(list(self.db.get_dup(txn, key)))
+        finally:
+            self.done(txn)
+
+    def _scan(self, dup):
+        if self.api == 'high':
+            if dup or not isinstance(self.reader, mdb.DupReader):
+                return sum(1 for _ in self.reader.iteritems())
+            # DupReader.iteritems yields every duplicate
+            with self.reader.snapshot() as snap:
+                return sum(1 for _ in snap.iteritems())
+        txn = self.txn()
+        try:
+            items = self.db.dup_items(txn) if dup else self.db.items(txn)
+            return sum(1 for _ in items)
+        finally:
+            self.done(txn)
+
+    def items(self, i):
+        return self._scan(False)
+
+    def dup_items(self, i):
+        return self._scan(True)
+
+    def get_range(self, i):
+        i = min(i, self.dataset.nkeys - self.range_size)
+        start = self.dataset.key(i)
+        end = self.dataset.key(i + self.range_size - 1)
+        if self.api == 'high':
+            with self.reader.snapshot() as snap:
+                return sum(1 for _ in snap.get_range(start, end))
+        txn = self.txn()
+        try:
+            return sum(1 for _ in self.db.get_range(txn, start, end))
+        finally:
+            self.done(txn)
+
+    def close(self):
+        if self.api == 'high':
+            self.reader.close()
+        else:
+            for txn in self.txns:
+                txn.abort()
+            self.db.close()
+            self.env.close()
+
+
+def _run_op(target, op, indices):
+    """Run op for each of indices, returning the number of entries read and
+    the latency of every call.
+    """
+    fn = getattr(target, op)
+    latencies = []
+    entries = 0
+    for i in indices:
+        started = timer()
+        entries += fn(i)
+        latencies.append(timer() - started)
+    return entries, latencies
+
+
+_target = None
+
+
+def _open_target(path, dataset, api, range_size):
+    global _target
+    _target = Target(path, dataset, api, range_size)
+
+
+def _process_op(task):
+    op, indices = task
+    return _run_op(_target, op, indices)
+
+
+def _wait(_):
+    time.sleep(0.01)
+
+
+def _rss_kb():
+    """Return the resident set size of the process in KB, or its peak
+    where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * resource.getpagesize() // 1024
+    except (IOError, OSError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _map_usage(path):
+    env = mdb.Env(path, flags=mdb.MDB_RDONLY)
+    try:
+        info = env.info()
+        psize = env.stat()['ms_psize']
+    finally:
+        env.close()
+    return info['me_mapsize'], (info['me_last_pgno'] + 1) * psize
+
+
+def _percentile(latencies, q):
+    return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+
+def _result(config, op, api, mode, workers, entries, calls, seconds,
+            latencies):
+    latencies.sort()
+    mapsize, map_used = _map_usage(config['path'])
+    return dict(flavour=config['flavour'], api=api, op=op, mode=mode,
+                workers=workers, calls=calls, entries=entries,
+                seconds=seconds,
+                ops_per_sec=calls / seconds if seconds else 0.0,
+                entries_per_sec=entries / seconds if seconds else 0.0,
+                p50_us=_percentile(latencies, 0.5) * 1e6,
+                p99_us=_percentile(latencies, 0.99) * 1e6,
+                rss_kb=_rss_kb(),
+                max_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                children_max_rss_kb=resource.getrusage(
+                    resource.RUSAGE_CHILDREN).ru_maxrss,
+                mapsize=mapsize, map_used=map_used)
+
+
+def bench_writes(path, dataset, api, batch=10000, nputs=10000, seed=0):
+    """Load dataset into a fresh database at path, timing every batch of
+    batch keys, then time nputs single-key puts of new keys. Returns the
+    results of 'mput' and 'put'.
+    """
+    shutil.rmtree(path, ignore_errors=True)
+    config = dict(path=path, flavour=dataset.flavour)
+    dup = dataset.dups > 1
+    order = list(range(dataset.nkeys))
+    random.Random(seed).shuffle(order)
+    batches = [order[i:i + batch] for i in range(0, len(order), batch)]
+    extra = list(range(dataset.nkeys, dataset.nkeys + nputs))
+    mapsize = max(dataset.nkeys * dataset.dups * (dataset.value_size + 64)
+                  * 4, 10 * mdb.MB)
+    results = []
+    if api == 'high':
+        writer = mdb.Writer(path, mapsize=mapsize, db_name=DB_NAME, dup=dup,
+                            int_key=dataset.int_key, int_val=dataset.int_val)
+        write_batch = lambda indices: writer.mput(dataset.pairs(indices))
+        put = lambda key, value: writer.put(key, value)
+        close = writer.close
+    else:
+        flags = mdb.MDB_CREATE
+        flags |= mdb.MDB_DUPSORT if dup else 0
+        flags |= mdb.MDB_INTEGERKEY if dataset.int_key else 0
+        flags |= mdb.MDB_INTEGERDUP if dataset.int_val else 0
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        env = mdb.Env(path, mapsize=mapsize)
+        txn = env.begin_txn()
+        db = env.open_db(txn, name=DB_NAME, flags=flags)
+        txn.commit()
+
+        def write_batch(indices):
+            txn = env.begin_txn()
+            for key, value in dataset.pairs(indices):
+                db.put(txn, key, value)
+            txn.commit()
+
+        def put(key, value):
+            txn = env.begin_txn()
+            db.put(txn, key, value)
+            txn.commit()
+
+        def close():
+            db.close()
+            env.close()
+
+    timings = []
+    for op, calls, fn in (
+            ('mput', batches, write_batch),
+            ('put', [[i] for i in extra],
+             lambda indices: put(dataset.key(indices[0]),
+                                 dataset.value(indices[0], 0)))):
+        latencies = []
+        entries = 0
+        started = timer()
+        for indices in calls:
+            call_started = timer()
+            fn(indices)
+            latencies.append(timer() - call_started)
+            entries += len(indices) * (dataset.dups if op == 'mput' else 1)
+        timings.append((op, entries, len(calls), timer() - started,
+                        latencies))
+    close()
+    # the map is only opened again once the writer has closed it
+    return [_result(config, op, api, 'thread', 1, entries, calls, seconds,
+                    latencies)
+            for op, entries, calls, seconds, latencies in timings
+            if latencies]
+
+
+def bench_reads(path, dataset, api, op, workers, mode='thread', nops=10000,
+                distribution='uniform', range_size=100, seed=0):
+    """Time nops calls of the read op in each of workers threads, or
+    processes, against the database at path.
+    """
+    if op in ('items', 'dup_items'):
+        nops = 1
+    elif op == 'get_range':
+        nops = max(1, nops // range_size)
+    tasks = [(op, _key_indices(distribution, dataset.nkeys, nops,
+                               seed + worker))
+             for worker in range(workers)]
+    config = dict(path=path, flavour=dataset.flavour)
+    if mode == 'process':
+        pool = multiprocessing.Pool(workers, _open_target,
+                                    (path, dataset, api, range_size))
+        try:
+            pool.map(_wait, range(workers), 1)
+            started = timer()
+            outcomes = pool.map(_process_op, tasks, 1)
+            seconds = timer() - started
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        target = Target(path, dataset, api, range_size)
+        outcomes = [None] * workers
+
+        def worker(n):
+            outcomes[n] = _run_op(target, op, tasks[n][1])
+
+        threads = [threading.Thread(target=worker, args=(n,))
+                   for n in range(workers)]
+        started = timer()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = timer() - started
+        target.close()
+    latencies = []
+    entries = 0
+    for worker_entries, worker_latencies in outcomes:
+        entries += worker_entries
+        latencies.extend(worker_latencies)
+    return _result(config, op, api, mode, workers, entries, len(latencies),
+                   seconds, latencies)
+
+
+def run(args):
+    """Run the benchmarks selected by the parsed command line arguments
+    and return the JSON document of their results.
+    """
+    results = []
+    for flavour in args.flavours:
+        dataset = Dataset(flavour, args.keys, args.dups, args.value_size)
+        for api in args.apis:
+            path = os.path.join(args.workdir, '%s-%s' % (flavour, api))
+            if not isinstance(path, bytes):
+                # Env takes a char * path
+                path = path.encode()
+            for result in bench_writes(path, dataset, api, args.batch,
+                                       args.puts, args.seed):
+                if result['op'] in args.ops:
+                    results.append(result)
+                    _report(result, sys.stderr)
+            for op in args.ops:
+                if op in WRITE_OPS:
+                    continue
+                if op in ('get_dup', 'dup_items') and args.dups < 2:
+                    continue
+                for mode, counts in (('thread', args.threads),
+                                     ('process', args.processes)):
+                    for workers in counts:
+                        result = bench_reads(path, dataset, api, op, workers,
+                                             mode, args.reads,
+                                             args.distribution,
+                                             args.range_size, args.seed)
+                        results.append(result)
+                        _report(result, sys.stderr)
+            shutil.rmtree(path, ignore_errors=True)
+    return dict(meta=dict(started=args.started, argv=args.argv,
+                          python=platform.python_version(),
+                          platform=platform.platform(),
+                          cpus=multiprocessing.cpu_count(),
+                          keys=args.keys, dups=args.dups,
+                          value_size=args.value_size,
+                          distribution=args.distribution, seed=args.seed),
+                results=results)
+
+
+def _result_key(result):
+    return (result['flavour'], result['api'], result['op'], result['mode'],
+            result['workers'])
+
+
+def _report(result, out):
+    print('%-7s %-5s %-10s %-8s %3d %12.0f ops/s %10.1f p50us %10.1f p99us'
+          % (_result_key(result) + (result['ops_per_sec'], result['p50_us'],
+                                    result['p99_us'])), file=out)
+
+
+def compare(baseline, current, out=sys.stdout):
+    """Print the change in ops/s and p99 latency of every result of current
+    also found in baseline, both JSON documents returned by run.
+    """
+    for name in ('keys', 'dups', 'value_size', 'distribution'):
+        if baseline['meta'].get(name) != current['meta'].get(name):
+            print('warning: %s differs: %r before, %r now'
+                  % (name, baseline['meta'].get(name),
+                     current['meta'].get(name)), file=out)
+    before = dict((_result_key(r), r) for r in baseline['results'])
+    for result in current['results']:
+        old = before.get(_result_key(result))
+        if old is None or not old['ops_per_sec']:
+            continue
+        print('%-7s %-5s %-10s %-8s %3d %+8.1f%% ops/s %+8.1f%% p99'
+              % (_result_key(result) +
+                 (100.0 * (result['ops_per_sec'] / old['ops_per_sec'] - 1),
+                  100.0 * (result['p99_us'] / old['p99_us'] - 1)
+                  if old['p99_us'] else 0.0)), file=out)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark pymdb-lightning.')
+    parser.add_argument('path', nargs='?', default='/tmp/mdbbench',
+                        help='directory to create the benchmark databases '
+                             'in, in a temporary directory removed after')
+    parser.add_argument('--keys', type=int, default=100000)
+    parser.add_argument('--dups', type=int, default=1,
+                        help='values per key; get_dup and dup_items need 2+')
+    parser.add_argument('--value-size', type=int, default=100)
+    parser.add_argument('--flavours', nargs='+', choices=sorted(FLAVOURS),
+                        default=sorted(FLAVOURS))
+    parser.add_argument('--apis', nargs='+', choices=APIS, default=APIS)
+    parser.add_argument('--ops', nargs='+', choices=WRITE_OPS + READ_OPS,
+                        default=WRITE_OPS + READ_OPS)
+    parser.add_argument('--distribution', choices=DISTRIBUTIONS,
+                        default='uniform')
+    parser.add_argument('--threads', nargs='*', type=int, default=[1])
+    parser.add_argument('--processes', nargs='*', type=int, default=[])
+    parser.add_argument('--reads', type=int, default=10000,
+                        help='point reads per worker')
+    parser.add_argument('--puts', type=int, default=1000,
+                        help='single-key puts, one commit each')
+    parser.add_argument('--batch', type=int, default=10000,
+                        help='keys per mput batch')
+    parser.add_argument('--range-size', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='FILE',
+                        help="write the results to FILE, '-' for stdout")
+    parser.add_argument('--compare', metavar='FILE',
+                        help='print the change against an earlier --json')
+    args = parser.parse_args(argv)
+    args.argv = argv
+    args.started = time.strftime('%Y-%m-%dT%H:%M:%S')
+    return args
+
+
+def main(argv):
+    args = parse_args(argv)
+    created = not os.path.isdir(args.path)
+    if created:
+        os.makedirs(args.path)
+    # only the databases of this run are removed, whatever else is in path
+    args.workdir = tempfile.mkdtemp(prefix='mdb_bench-', dir=args.path)
+    try:
+        document = run(args)
+    finally:
+        shutil.rmtree(args.workdir, ignore_errors=True)
+        if created:
+            try:
+                os.rmdir(args.path)
+            except OSError:
+                pass
+    if args.json == '-':
+        json.dump(document, sys.stdout, indent=1, sort_keys=True)
+        print()
+    elif args.json:
+        with open(args.json, 'w') as out:
+            json.dump(document, out, indent=1, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(json.load(baseline), document)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,3 +1,4 @@
+import sys
 from distutils.core import setup
 from distutils.extension import Extension
 from Cython.Distutils import build_ext
@@ -12,8 +13,13 @@ setup(
     author = 'Chango Inc.',
     keywords=['mdb-ligtning', 'mdb', 'lmdb', 'key-value store'],
     license='MIT',
+    # GroupCommitWriter needs concurrent.futures, a backport on Python 2
+    requires = [] if sys.version_info >= (3,) else ['futures'],
+    # the asyncio front-end is Python 3.7+ code
+    py_modules = ['mdb_bench'] + (['mdb_aio'] if sys.version_info >= (3, 7)
+                                  else []),
     ext_modules = [Extension("mdb", ["db.pyx", ],
-                             libraries=["lmdb"],
+                             libraries=["lmdb", "z"],
                              library_dirs=["/usr/local/lib"],
                              include_dirs=["/usr/local/include"],
                              runtime_library_dirs=["/usr/local/lib"])]
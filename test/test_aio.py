@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+from unittest import TestCase, skipIf
+try:
+    import asyncio
+    import mdb_aio
+except (ImportError, SyntaxError):
+    mdb_aio = None
+
+
+@skipIf(mdb_aio is None, 'asyncio front-end requires Python 3.7')
+class TestAsync(TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        import shutil
+        asyncio.set_event_loop(None)
+        self.loop.close()
+        try:
+            shutil.rmtree('./test_aio')
+        except OSError:
+            pass
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def keys(self, items):
+        keys = []
+        while True:
+            try:
+                keys.append(self.run_async(items.__anext__())[0])
+            except StopAsyncIteration:
+                return keys
+
+    def test_group_commit(self):
+        commits = []
+        writer = mdb_aio.AsyncWriter('./test_aio', on_commit=commits.append)
+        self.run_async(asyncio.gather(*[writer.put(b'%03d' % i, b'value')
+                                        for i in range(100)]))
+        self.run_async(writer.close())
+        self.assertEqual(sum(commit['entries'] for commit in commits), 100)
+        self.assertTrue(len(commits) < 100)
+
+        reader = mdb_aio.AsyncReader('./test_aio', chunk_size=7)
+        self.assertEqual(self.run_async(reader.get(b'042')), b'value')
+        self.assertEqual(self.run_async(reader.get_many([b'001', b'x'])),
+                         [b'value', None])
+        self.assertEqual(len(self.keys(reader.iteritems())), 100)
+        self.assertEqual(self.keys(reader.get_range(b'010', b'012')),
+                         [b'010', b'011', b'012'])
+        self.run_async(reader.close())
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import mdb
+from unittest import TestCase
+
+
+class TestCodec(TestCase):
+
+    def test_varint(self):
+        values = [0, 1, -1, 127, 128, -129, 2 ** 62, -2 ** 63]
+        codec = mdb.get_codec('varint')
+        self.assertEqual(codec.decode(codec.encode(values)), values)
+        codec = mdb.get_codec('delta-varint')
+        self.assertEqual(codec.decode(codec.encode(values)), values)
+        self.assertEqual(len(codec.encode(range(1000, 2000))), 1001)
+        extremes = [2 ** 63 - 1, -2 ** 63, 2 ** 63 - 1]
+        self.assertEqual(codec.decode(codec.encode(extremes)), extremes)
+
+    def test_struct(self):
+        codec = mdb.get_codec('struct:<qd')
+        self.assertEqual(codec.decode(codec.encode((3, 1.5))), (3, 1.5))
+        codec = mdb.get_codec('struct:<q')
+        self.assertEqual(codec.decode_many(codec.encode_many([1, 2])), [1, 2])
+
+    def test_zlib(self):
+        samples = ['{"user": %d, "country": "CA", "active": true}' % i
+                   for i in range(100)]
+        zdict = mdb.train_zdict(samples)
+        codec = mdb.ZlibCodec(zdict=zdict)
+        encoded = codec.encode(samples[0])
+        self.assertTrue(len(encoded) < len(mdb.ZlibCodec().encode(samples[0])))
+        self.assertEqual(codec.decode(encoded), samples[0])
+        self.assertEqual(codec.decode(codec.encode('')), '')
+        self.assertRaises(Exception, codec.decode, '\xff\xff\xff\xff\x0f')
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, mdb.get_codec, 'nope')
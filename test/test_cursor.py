@@ -79,3 +79,35 @@ class TestCursor(TestCase):
         key, value = cursor.get('delete', 'done2', op=mdb.MDB_NEXT_DUP)
         cursor.delete()
         self.assertEqual(cursor.get('delete'), ('delete', 'done'))
+
+    def test_iterbuffers(self):
+        cursor = mdb.Cursor(self.txn, self.db)
+        cursor.put('a', 'foo', mdb.MDB_APPENDDUP)
+        cursor.put('b', 'bar', mdb.MDB_APPENDDUP)
+        cursor = mdb.Cursor(self.txn, self.db)
+        self.assertEqual([(key, view.tobytes())
+                          for key, view in cursor.iterbuffers()],
+                         [('a', 'foo'), ('b', 'bar')])
+
+    def test_buffer_slice(self):
+        if not hasattr(memoryview, 'release'):
+            self.skipTest('memoryviews cannot be released before Python 3.2')
+        self.db.put(self.txn, 'a', 'foo')
+        cursor = mdb.Cursor(self.txn, self.db)
+        key, view = cursor.get_buffer()
+        part = view[1:]
+        self.assertRaises(BufferError, self.txn.commit)
+        self.assertEqual(part.tobytes(), 'oo')
+        del part
+        self.txn.commit()
+        self.assertRaises(ValueError, view.tobytes)
+        self.txn = self.env.begin_txn()
+
+    def test_bytes_db_buffers(self):
+        db = self.env.open_db(self.txn, 'test_cursor_bytes', binary=True)
+        db.put(self.txn, 'a', 'foo\x00')
+        cursor = mdb.Cursor(self.txn, db)
+        self.assertEqual([(key, view.tobytes())
+                          for key, view in cursor.iterbuffers()],
+                         [('a', 'foo\x00')])
+        db.drop(self.txn, 1)
@@ -38,6 +38,18 @@ class TestDB(TestCase):
         self.assertRaises(StopIteration, items.next)
         db.close()
 
+    def test_close_aborts_write_txn(self):
+        txn = self.env.begin_txn()
+        db = self.env.open_db(txn, 'test_db')
+        db.put(txn, 'left', 'open')
+        self.env.close()
+        self.env = mdb.Env(self.path, mapsize=1 * mdb.MB, max_dbs=8)
+        txn = self.env.begin_txn()
+        db = self.env.open_db(txn, 'test_db')
+        self.assertRaises(mdb.KeyNotFoundError, db.get, txn, 'left')
+        txn.abort()
+        db.close()
+
     def test_put(self):
         # all keys must be sorted
         txn = self.env.begin_txn()
@@ -168,3 +180,142 @@ class TestDB(TestCase):
         txn = self.env.begin_txn()
         self.assertEqual(db.get(txn, 'delete'), 'done1')
         db.close()
+
+    def test_get_many(self):
+        self.drop_mdb()
+        txn = self.env.begin_txn()
+        db = self.env.open_db(txn, 'test_db')
+        db.put(txn, 'b', 'bar')
+        db.put(txn, 'b', 'bar1')
+        db.put(txn, 'a', 'foo')
+        txn.commit()
+        txn = self.env.begin_txn()
+        self.assertEqual(db.get_many(txn, ['b', 'missing', 'a']),
+                         ['bar', None, 'foo'])
+        self.assertEqual(db.get_many(txn, ['missing', 'b'], default=''),
+                         ['', 'bar'])
+        self.assertEqual(db.get_many(txn, ['b', 'a'], dup=True),
+                         [['bar', 'bar1'], ['foo']])
+        txn.commit()
+        db.close()
+
+    def test_get_buffer(self):
+        txn = self.env.begin_txn()
+        db = self.env.open_db(txn, 'test_db')
+        db.put(txn, 'buffer', 'value')
+        txn.commit()
+        txn = self.env.begin_txn()
+        view = db.get_buffer(txn, 'buffer')
+        self.assertTrue(view.readonly)
+        self.assertEqual(view.tobytes(), 'value')
+        self.assertRaises(mdb.KeyNotFoundError, db.get_buffer, txn, 'nobuffer')
+        txn.commit()
+        if hasattr(memoryview, 'release'):
+            self.assertRaises(ValueError, view.tobytes)
+        db.close()
+
+    def test_put_sorted(self):
+        self.drop_mdb()
+        txn = self.env.begin_txn()
+        db = self.env.open_db(txn, 'test_db')
+        self.assertEqual(db.put_sorted(txn, [('a', '1'), ('a', '2'), ('b', '1')]),
+                         3)
+        with self.assertRaises(mdb.KeyExistError):
+            db.put_sorted(txn, [('0', '1')])
+        self.assertEqual(db.put_sorted(txn, [('0', '1')], strict=False), 1)
+        txn.commit()
+        txn = self.env.begin_txn()
+        self.assertEqual(list(db.dup_items(txn)),
+                         [('0', '1'), ('a', '1'), ('a', '2'), ('b', '1')])
+        txn.commit()
+        db.close()
+
+    def test_get_range(self):
+        self.drop_mdb()
+        txn = self.env.begin_txn()
+        db = self.env.open_db(txn, 'test_db')
+        db.put(txn, 'a', '1')
+        db.put(txn, 'ab', '2')
+        db.put(txn, 'ab', '3')
+        db.put(txn, 'abc', '4')
+        db.put(txn, 'b', '5')
+        txn.commit()
+        txn = self.env.begin_txn()
+        self.assertEqual(list(db.get_range(txn, 'ab', 'abc')),
+                         [('ab', '2'), ('ab', '3'), ('abc', '4')])
+        self.assertEqual(list(db.get_range(txn, 'aa', 'abz', reverse=True)),
+                         [('abc', '4'), ('ab', '3'), ('ab', '2')])
+        self.assertEqual(list(db.get_range(txn, end='ab', limit=2)),
+                         [('a', '1'), ('ab', '2')])
+        self.assertEqual(list(db.get_range(txn, 'abd')), [('b', '5')])
+        with self.assertRaises(KeyError):
+            list(db.get_range(txn, 'b', 'a'))
+        txn.commit()
+        db.close()
+
+    def test_get_range_no_dups(self):
+        # MDB_LAST_DUP fails on a database without MDB_DUPSORT
+        txn = self.env.begin_txn()
+        db = self.env.open_db(txn, 'test_nodup', flags=mdb.MDB_CREATE)
+        for key in ('a', 'b', 'c', 'd'):
+            db.put(txn, key, key + '1')
+        txn.commit()
+        txn = self.env.begin_txn()
+        self.assertEqual(list(db.get_range(txn, 'a', 'c', reverse=True)),
+                         [('c', 'c1'), ('b', 'b1'), ('a', 'a1')])
+        self.assertEqual(list(db.get_range(txn, end='d', reverse=True,
+                                           limit=2)),
+                         [('d', 'd1'), ('c', 'c1')])
+        self.assertEqual([key for key, _ in db.get_ne(txn, 'b')],
+                         ['a', 'c', 'd'])
+        self.assertEqual(len(list(db.get_ne(txn, 'x'))), 4)
+        # rewriting the excluded key mid-scan moves it in the map
+        items = db.get_ne(txn, 'b')
+        self.assertEqual(next(items), ('a', 'a1'))
+        db.put(txn, 'b', 'b2' * 100)
+        self.assertEqual([key for key, _ in items], ['c', 'd'])
+        txn.commit()
+        db.close()
+
+    def test_get_prefix(self):
+        self.drop_mdb()
+        txn = self.env.begin_txn()
+        db = self.env.open_db(txn, 'test_db')
+        db.put(txn, 'a', '1')
+        db.put(txn, 'ab', '2')
+        db.put(txn, 'abc', '3')
+        db.put(txn, 'b', '4')
+        txn.commit()
+        txn = self.env.begin_txn()
+        self.assertEqual(list(db.get_prefix(txn, 'ab')),
+                         [('ab', '2'), ('abc', '3')])
+        self.assertEqual(list(db.get_prefix(txn, 'a', limit=1)), [('a', '1')])
+        self.assertEqual(list(db.get_prefix(txn, 'c')), [])
+        txn.commit()
+        db.close()
+
+    def test_bytes_db(self):
+        txn = self.env.begin_txn()
+        db = self.env.open_db(txn, 'test_bytes_db', binary=True)
+        self.assertTrue(isinstance(db, mdb.BytesDB))
+        db.put(txn, 'a\x00b', bytearray('\x00\x01'))
+        db.put(txn, 'a\x00b', 'zz')
+        db.put(txn, 'c', 'd')
+        txn.commit()
+        txn = self.env.begin_txn()
+        self.assertEqual(db.get(txn, 'c'), 'd')
+        self.assertEqual(list(db.get_dup(txn, 'a\x00b')), ['\x00\x01', 'zz'])
+        self.assertEqual(list(db.items(txn)),
+                         [('a\x00b', '\x00\x01'), ('c', 'd')])
+        self.assertEqual(db.get_many(txn, ['c', 'x']), ['d', None])
+        self.assertEqual(db.get_buffer(txn, 'c').tobytes(), 'd')
+        self.assertRaises(TypeError, db.get, txn, u'c')
+        self.assertRaises(TypeError, db.put, txn, bytearray('e'), 'f')
+        cursor = mdb.Cursor(txn, db)
+        self.assertEqual(cursor.get('c'), ('c', 'd'))
+        cursor.put('e\x00', 'f\x00')
+        self.assertEqual(db.get(txn, 'e\x00'), 'f\x00')
+        db.delete(txn, 'e\x00')
+        self.assertEqual(db.stat(txn)['ms_entries'], 3)
+        txn.commit()
+        db.close()
@@ -172,3 +172,94 @@ class TestDB(TestCase):
         self.assertEqual(db.get(txn, 17), 171)
         txn.commit()
         db.close()
+
+    def test_get_many(self):
+        txn = self.env.begin_txn()
+        db = self.env.open_db(txn, 'test_db',
+                              flags=mdb.MDB_CREATE|mdb.MDB_DUPSORT|mdb.MDB_INTEGERKEY|mdb.MDB_INTEGERDUP)
+        db.put(txn, 19, 1)
+        db.put(txn, 19, 2)
+        db.put(txn, 18, 3)
+        txn.commit()
+        txn = self.env.begin_txn()
+        self.assertEqual(db.get_many(txn, [19, 20, 18]), [1, None, 3])
+        self.assertEqual(db.get_many(txn, [19, 20], default=0, dup=True),
+                         [[1, 2], 0])
+        txn.commit()
+        db.close()
+
+    def test_get_less_than_reverse(self):
+        txn = self.env.begin_txn()
+        db = self.env.open_db(txn, 'test_db',
+                              flags=mdb.MDB_CREATE|mdb.MDB_DUPSORT|mdb.MDB_INTEGERKEY|mdb.MDB_INTEGERDUP)
+        for key, value in [(1, 1), (2, 2), (2, 21), (3, 3), (4, 4)]:
+            db.put(txn, key, value)
+        txn.commit()
+        txn = self.env.begin_txn()
+        self.assertEqual(list(db.get_lt(txn, 3, reverse=True, limit=2)),
+                         [(2, 21), (2, 2)])
+        self.assertEqual(list(db.get_le(txn, 3, reverse=True, limit=2)),
+                         [(3, 3), (2, 21)])
+        self.assertEqual(list(db.get_lt(txn, 1, reverse=True)), [])
+        self.assertEqual(list(db.get_range(txn, 2, 3, reverse=True)),
+                         [(3, 3), (2, 21), (2, 2)])
+        txn.commit()
+        db.close()
+
+    def test_get_dup_array(self):
+        import array
+        txn = self.env.begin_txn()
+        db = self.env.open_db(txn, 'test_db',
+                              flags=mdb.MDB_CREATE|mdb.MDB_DUPSORT|mdb.MDB_INTEGERKEY|mdb.MDB_INTEGERDUP)
+        for value in range(10000):
+            db.put(txn, 5, value)
+        db.put(txn, 6, 60)
+        txn.commit()
+        txn = self.env.begin_txn()
+        self.assertEqual(db.get_dup_array(txn, 5),
+                         array.array('l', range(10000)))
+        self.assertEqual(db.get_dup_array(txn, 6), array.array('l', [60]))
+        self.assertEqual(len(db.get_dup_array(txn, 7)), 0)
+        txn.commit()
+        db.close()
+
+    def test_set_operations(self):
+        import array
+        txn = self.env.begin_txn()
+        db = self.env.open_db(txn, 'test_db',
+                              flags=mdb.MDB_CREATE|mdb.MDB_DUPSORT|mdb.MDB_INTEGERKEY|mdb.MDB_INTEGERDUP)
+        db.put_multiple(txn, 1, range(0, 3000, 2))
+        db.put_multiple(txn, 2, range(0, 3000, 3))
+        db.put_multiple(txn, 3, [-1, 6, 12, 13, 2998])
+        txn.commit()
+        txn = self.env.begin_txn()
+        self.assertEqual(db.intersect(txn, [1, 2, 3]),
+                         array.array('l', [6, 12]))
+        self.assertEqual(list(db.intersect(txn, [1, 2], limit=3)), [0, 6, 12])
+        self.assertEqual(len(db.intersect(txn, [1, 4])), 0)
+        self.assertEqual(list(db.union(txn, [3, 2], limit=4)), [0, 3, 6, 9])
+        self.assertEqual(len(db.union(txn, [1, 2, 3])), 2002)
+        # negative values sort last, as the dups compare unsigned
+        self.assertEqual(list(db.difference(txn, [3, 1, 2])), [13, -1])
+        self.assertEqual(len(db.difference(txn, [4, 1])), 0)
+        self.assertEqual(len(db.intersect(txn, [])), 0)
+        txn.commit()
+        db.close()
+
+    def test_put_multiple(self):
+        import array
+        txn = self.env.begin_txn()
+        db = self.env.open_db(txn, 'test_db',
+                              flags=mdb.MDB_CREATE|mdb.MDB_DUPSORT|mdb.MDB_INTEGERKEY|mdb.MDB_INTEGERDUP)
+        self.assertEqual(db.put_multiple(txn, 5, array.array('l', [4, 2, 8])), 3)
+        self.assertEqual(db.put_multiple(txn, 5, [6]), 1)
+        self.assertEqual(db.put_multiple(txn, 6, []), 0)
+        self.assertRaises(TypeError, db.put_multiple, txn, 5,
+                          array.array('b', [1]))
+        self.assertRaises(TypeError, db.put_multiple, txn, 5,
+                          array.array('d', [1.0]))
+        txn.commit()
+        txn = self.env.begin_txn()
+        self.assertEqual(list(db.get_dup(txn, 5)), [2, 4, 6, 8])
+        txn.commit()
+        db.close()
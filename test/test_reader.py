@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
 from unittest import TestCase
-from mdb import Writer, Reader, DupReader
+from mdb import Writer, Reader, DupReader, ShardedWriter, ShardedReader
+from mdb import KeyExistError, KeyNotFoundError
 from ujson import dumps, loads
 
 
+def _count(items):
+    return sum(1 for _ in items)
+
+
 class TestReaderWriter(TestCase):
     def setUp(self):
         pass
@@ -18,6 +23,10 @@ class TestReaderWriter(TestCase):
             shutil.rmtree('./test_rw_dup')
         except OSError:
             pass
+        try:
+            shutil.rmtree('./test_rw_shards')
+        except OSError:
+            pass
 
     def test_reader_and_writer(self):
         writer = Writer('./test_rw', encode_fn=dumps)
@@ -49,3 +58,493 @@ class TestReaderWriter(TestCase):
         self.assertEqual(list(values), ['spam', 'spam1'])
         values = reader.get('fixed')
         self.assertEqual(list(values), ['value0', 'value1', 'value4'])
+
+    def test_get_many(self):
+        writer = Writer('./test_rw_dup', dup=True, encode_fn=dumps)
+        writer.drop()
+        writer.mput([('foo', 'bar'), ('foo', 'bar1'), ('egg', 'spam')])
+        reader = Reader('./test_rw_dup', decode_fn=loads)
+        self.assertEqual(reader.get_many(['foo', 'nope', 'egg'], 'none'),
+                         ['bar', 'none', 'spam'])
+        reader = DupReader('./test_rw_dup', decode_fn=loads)
+        self.assertEqual(reader.get_many(['foo', 'nope', 'egg']),
+                         [['bar', 'bar1'], None, ['spam']])
+
+    def test_bulk_load(self):
+        writer = Writer('./test_rw_dup', dup=True)
+        writer.drop()
+        self.assertEqual(writer.bulk_load([('b', '2'), ('a', '1'), ('b', '1')],
+                                          presorted=False),
+                         3)
+        reader = DupReader('./test_rw_dup')
+        self.assertEqual(list(reader.iteritems()),
+                         [('a', '1'), ('b', '1'), ('b', '2')])
+
+    def test_bulk_load_negative_keys(self):
+        writer = Writer('./test_rw', int_key=True)
+        writer.drop()
+        self.assertEqual(writer.bulk_load([(-1, 'a'), (2, 'b'), (0, 'c')],
+                                          presorted=False),
+                         3)
+        self.assertRaises(KeyExistError, writer.bulk_load,
+                          [(-2, 'd'), (1, 'e')])
+        writer.close()
+        reader = Reader('./test_rw', int_key=True)
+        # LMDB orders integer keys as unsigned
+        self.assertEqual(list(reader.iteritems()),
+                         [(0, 'c'), (2, 'b'), (-1, 'a')])
+        reader.close()
+
+    def test_external_sort(self):
+        from mdb import external_sort
+        pairs = [(i % 7, i) for i in range(20)]
+        self.assertEqual(list(external_sort(pairs, chunk_size=3)),
+                         sorted(pairs))
+
+    def test_map_growth(self):
+        writer = Writer('./test_rw', mapsize=64 * 1024)
+        writer.drop()
+        writer.mput(('%08d' % i, 'x' * 200) for i in range(10000))
+        self.assertTrue(writer.env.info()['me_mapsize'] > 64 * 1024)
+        reader = Reader('./test_rw')
+        self.assertEqual(len(reader), 10000)
+
+    def test_map_growth_ceiling(self):
+        from mdb import MapFullError
+        writer = Writer('./test_rw', mapsize=64 * 1024,
+                        max_mapsize=128 * 1024)
+        writer.drop()
+        with self.assertRaises(MapFullError):
+            writer.mput(('%08d' % i, 'x' * 200) for i in range(10000))
+
+    def test_mput_batching(self):
+        stats = []
+        writer = Writer('./test_rw', on_commit=stats.append)
+        writer.drop()
+        writer.mput((('%04d' % i, 'value') for i in range(10)), max_entries=4)
+        self.assertEqual([s['entries'] for s in stats], [4, 4, 2])
+        self.assertEqual(stats[0]['bytes'], 4 * (5 + 6))
+        del stats[:]
+        writer.mput((('%04d' % i, 'value') for i in range(10)), max_bytes=30)
+        self.assertEqual([s['entries'] for s in stats], [3, 3, 3, 1])
+        self.assertEqual(len(Reader('./test_rw')), 10)
+        # an early commit by bytes leaves max_entries alone
+        del stats[:]
+        pairs = [('big%d' % i, 'x' * 1000) for i in range(2)]
+        pairs += [('s%03d' % i, 'v') for i in range(100)]
+        writer.mput(pairs, max_entries=50, max_bytes=1500)
+        self.assertEqual([s['entries'] for s in stats], [2, 50, 50])
+
+    def test_mput_dups(self):
+        import array
+        stats = []
+        writer = Writer('./test_rw_dup', dup=True, int_key=True,
+                        int_val=True, on_commit=stats.append)
+        writer.mput_dups([(1, array.array('l', range(1000))),
+                          (2, [7, 3]),
+                          (3, (v for v in [5]))], max_entries=500)
+        self.assertEqual([s['entries'] for s in stats], [1000, 3])
+        reader = DupReader('./test_rw_dup', int_key=True, int_val=True)
+        self.assertEqual(list(reader.get(1)), range(1000))
+        self.assertEqual(list(reader.get(2)), [3, 7])
+        self.assertEqual(list(reader.get(3)), [5])
+
+    def test_pooled_txns(self):
+        writer = Writer('./test_rw')
+        writer.drop()
+        writer.put('a', '1')
+        reader = Reader('./test_rw')
+        shared = Reader('./test_rw', max_txn_ops=2)
+        self.assertEqual(reader.get('a'), '1')
+        self.assertEqual(shared.get('a'), '1')
+        writer.put('a', '2')
+        self.assertEqual(reader.get('a'), '2')
+        self.assertEqual(shared.get('a'), '1')
+        self.assertEqual(shared.get('a'), '2')
+        items = reader.iteritems()
+        self.assertEqual(next(items), ('a', '2'))
+        self.assertEqual(reader.get_many(['a', 'b']), ['2', None])
+        self.assertEqual(list(items), [])
+        reader.close()
+        shared.close()
+
+    def test_close_open_iterators(self):
+        writer = Writer('./test_rw')
+        writer.drop()
+        writer.mput([('a', '1'), ('b', '2')])
+        reader = Reader('./test_rw')
+        items = reader.iteritems()
+        self.assertEqual(next(items), ('a', '1'))
+        snapshot = reader.snapshot()
+        ranged = snapshot.get_range()
+        self.assertEqual(next(ranged), ('a', '1'))
+        reader.close()
+        # closing the reader ended their txns and stopped them
+        self.assertEqual(list(items), [])
+        self.assertEqual(list(ranged), [])
+        self.assertTrue(snapshot.txn is None)
+        writer.close()
+
+    def test_pooled_txns_thread_exit(self):
+        import threading
+        import time
+        writer = Writer('./test_rw')
+        writer.drop()
+        writer.put('a', '1')
+        reader = Reader('./test_rw', max_txn_ops=100)
+        threads = [threading.Thread(target=reader.get, args=('a',))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # join may return just before the locals of a thread are cleared
+        deadline = time.time() + 5
+        while reader.env.reader_list() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(reader.env.reader_list(), [])
+        reader.close()
+        writer.close()
+
+    def test_snapshot(self):
+        writer = Writer('./test_rw')
+        writer.drop()
+        writer.mput({'a': '1', 'b': '2'})
+        reader = Reader('./test_rw')
+        with reader.snapshot() as snapshot:
+            writer.put('a', '3')
+            self.assertEqual(snapshot.get('a'), '1')
+            self.assertEqual(reader.get('a'), '3')
+            self.assertEqual(snapshot.get_many(['b', 'a']), ['2', '1'])
+            self.assertEqual(list(snapshot.get_range('a', 'b', reverse=True)),
+                             [('b', '2'), ('a', '1')])
+            self.assertTrue(snapshot.age >= 0)
+        reader.close()
+
+    def test_dup_snapshot(self):
+        writer = Writer('./test_rw_dup', dup=True)
+        writer.drop()
+        writer.mput([('a', '1'), ('a', '2'), ('b', '3')])
+        reader = DupReader('./test_rw_dup')
+        with reader.snapshot() as snapshot:
+            writer.put('a', '0')
+            self.assertEqual(snapshot.get('a'), ['1', '2'])
+            self.assertEqual(snapshot.get('c', []), [])
+            self.assertEqual(snapshot.get_many(['b', 'c', 'a']),
+                             [['3'], None, ['1', '2']])
+            self.assertEqual(list(snapshot.iteritems()),
+                             [('a', '1'), ('a', '2'), ('b', '3')])
+        reader.close()
+        writer.close()
+
+    def test_migrate_to_bytes(self):
+        from mdb import migrate_to_bytes
+        writer = Writer('./test_rw_dup', dup=True)
+        writer.drop()
+        writer.mput([('b', '2'), ('a', '1'), ('a', '0')])
+        writer.close()
+        self.assertEqual(migrate_to_bytes('./test_rw_dup', './test_rw',
+                                          dup=True), 3)
+        reader = DupReader('./test_rw', binary=True)
+        self.assertEqual(list(reader.iteritems()),
+                         [('a', '0'), ('a', '1'), ('b', '2')])
+        reader.close()
+
+    def test_codec(self):
+        writer = Writer('./test_rw', codec='delta-varint')
+        writer.drop()
+        writer.mput({'a': [1, 5, 9], 'b': []})
+        reader = Reader('./test_rw', codec='delta-varint')
+        self.assertEqual(reader.get('a'), [1, 5, 9])
+        self.assertEqual(reader.get_many(['b', 'c', 'a']), [[], None, [1, 5, 9]])
+        reader.close()
+
+    def test_sharded(self):
+        writer = ShardedWriter('./test_rw_shards', nshards=3, processes=2)
+        writer.mput(('%03d' % i, str(i)) for i in range(100))
+        writer.close()
+        reader = ShardedReader('./test_rw_shards')
+        self.assertEqual(len(reader), 100)
+        self.assertEqual(reader.get('042'), '42')
+        self.assertEqual(reader.get_many(['007', 'x', '099']), ['7', None, '99'])
+        self.assertEqual([key for key, _ in reader.iteritems()],
+                         ['%03d' % i for i in range(100)])
+        self.assertEqual(list(reader.get_range('010', '050', reverse=True,
+                                               limit=2)),
+                         [('050', '50'), ('049', '49')])
+        reader.close()
+
+    def test_sharded_by_range(self):
+        writer = ShardedWriter('./test_rw_shards', boundaries=[10, 20],
+                               processes=1, int_key=True)
+        writer.mput((i, str(i)) for i in range(30))
+        writer.close()
+        self.assertRaises(ValueError, ShardedWriter, './test_rw_shards',
+                          nshards=2, processes=1)
+        reader = ShardedReader('./test_rw_shards', int_key=True)
+        self.assertEqual([len(shard) for shard in reader.readers], [10, 10, 10])
+        self.assertEqual([key for key, _ in reader.get_range(8, 21)],
+                         range(8, 22))
+        reader.close()
+
+    def test_parallel_scan(self):
+        from operator import add
+        from mdb import parallel_scan, split_keys
+        writer = Writer('./test_rw')
+        writer.drop()
+        writer.mput(('key%05d' % i, 'x' * 100) for i in range(20000))
+        writer.close()
+        reader = Reader('./test_rw')
+        self.assertEqual(split_keys(reader, 4),
+                         ['key05000', 'key10000', 'key15000'])
+        reader.close()
+        self.assertEqual(parallel_scan('./test_rw', _count, workers=2,
+                                       ranges=4),
+                         [5000] * 4)
+        self.assertEqual(parallel_scan('./test_rw', _count, add, workers=1),
+                         20000)
+
+    def test_split_keys_skewed(self):
+        from mdb import split_keys
+        writer = Writer('./test_rw')
+        writer.drop()
+        keys = ['a%06d' % i for i in range(15000)]
+        keys += ['%s%04d' % (c, i) for c in 'bcdefghijk' for i in range(500)]
+        writer.mput((key, 'x' * 100) for key in keys)
+        writer.close()
+        reader = Reader('./test_rw')
+        self.assertEqual(split_keys(reader, 4),
+                         ['a005000', 'a010000', 'b0000'])
+        reader.close()
+
+    def test_group_commit(self):
+        import threading
+        from mdb import GroupCommitWriter
+        commits = []
+        writer = GroupCommitWriter('./test_rw', on_commit=commits.append)
+        futures = []
+
+        def produce(n):
+            for i in range(100):
+                futures.append(writer.put('%d-%d' % (n, i), 'value'))
+        threads = [threading.Thread(target=produce, args=(n,))
+                   for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for future in futures:
+            future.result()
+        self.assertTrue(len(commits) < 400)
+        self.assertEqual(writer.delete('0-0').result(), None)
+        self.assertRaises(Exception, writer.delete('missing').result)
+        writer.close()
+        reader = Reader('./test_rw')
+        self.assertEqual(len(reader), 399)
+        reader.close()
+
+    def test_group_commit_callback_error(self):
+        from mdb import GroupCommitWriter
+
+        def on_commit(stats):
+            raise ValueError('callback')
+        writer = GroupCommitWriter('./test_rw', on_commit=on_commit)
+        self.assertEqual(writer.put('a', '1').result(), None)
+        self.assertRaises(ValueError, writer.close)
+        self.assertRaises(Exception, writer.put, 'b', '2')
+        reader = Reader('./test_rw')
+        self.assertEqual(reader.get('a'), '1')
+        reader.close()
+
+    def test_durability(self):
+        self.assertRaises(ValueError, Writer, './test_rw', durability='fast')
+        writer = Writer('./test_rw', durability='map-async', flush_bytes=100)
+        for i in range(10):
+            writer.put('%02d' % i, 'x' * 20)
+        # each put is 24 bytes, so every fifth one flushes
+        self.assertEqual(writer.sync_stats['count'], 2)
+        writer.close()
+        writer = Writer('./test_rw', durability='sync')
+        writer.put('a', 'b')
+        self.assertEqual(writer.sync_stats['count'], 0)
+        writer.close()
+        self.assertEqual(Reader('./test_rw').get('a'), 'b')
+
+    def test_cache(self):
+        writer = Writer('./test_rw', encode_fn=dumps)
+        writer.mput(dict(('k%02d' % i, [i]) for i in range(50)))
+        for policy in ('lru', 'arc'):
+            reader = Reader('./test_rw', decode_fn=loads, cache_bytes=100,
+                            cache_policy=policy)
+            self.assertEqual(reader.get('k01'), [1])
+            self.assertEqual(reader.get('k01'), [1])
+            self.assertEqual(reader.get_many(['k01', 'k02', 'no'], 0),
+                             [[1], [2], 0])
+            stats = reader.cache.stats()
+            self.assertEqual(stats['hits'], 2)
+            self.assertEqual(stats['misses'], 3)
+            for i in range(50):
+                reader.get('k%02d' % i)
+            self.assertTrue(reader.cache.nbytes <= 100)
+            writer.put('k01', [100])
+            self.assertEqual(reader.get('k01'), [100])
+            writer.put('k01', [1])
+            reader.close()
+        writer.close()
+        self.assertRaises(ValueError, Reader, './test_rw', cache_bytes=100,
+                          cache_policy='mru')
+
+    def test_cache_old_snapshot(self):
+        writer = Writer('./test_rw')
+        writer.put('x', 'old')
+        reader = Reader('./test_rw', cache_bytes=1000, max_txn_ops=3)
+        self.assertEqual(reader.get('x'), 'old')
+        writer.put('x', 'new')
+        # the pooled txn still sees its snapshot, which must not be cached
+        values = [reader.get('x') for _ in range(6)]
+        self.assertEqual(values[2:], ['new'] * 4)
+        reader.close()
+        writer.close()
+
+    def test_bloom(self):
+        writer = Writer('./test_rw')
+        writer.mput(dict(('k%d' % i, 'v') for i in range(0, 1000, 2)))
+        writer.close()
+        writer = Writer('./test_rw', bloom_keys=1000, bloom_fpp=0.01)
+        self.assertEqual(len(writer.bloom), 500)
+        reader = Reader('./test_rw')
+        self.assertTrue(reader.bloom is not None)
+        bloom = reader.bloom.current()
+        for i in range(0, 1000, 2):
+            self.assertTrue('k%d' % i in bloom)
+        false_positives = sum(1 for i in range(1, 1000, 2)
+                              if 'k%d' % i in bloom)
+        self.assertTrue(false_positives < 25)
+        self.assertEqual(reader.get('k1', 'missing'), 'missing')
+        writer.put('k1', 'new')
+        self.assertEqual(reader.get('k1'), 'new')
+        self.assertEqual(reader.get_many(['k1', 'k3', 'k2']),
+                         ['new', None, 'v'])
+        writer.drop()
+        self.assertEqual(reader.get('k2'), None)
+        writer.close()
+        reader.close()
+
+    def test_bloom_bypassed(self):
+        writer = Writer('./test_rw', bloom_keys=1000)
+        writer.put('a', 'v')
+        writer.close()
+        # a Writer without bloom_keys keeps the filter updated
+        writer = Writer('./test_rw')
+        writer.put('zz', 'v')
+        reader = Reader('./test_rw')
+        self.assertEqual(reader.get('zz'), 'v')
+        self.assertTrue(reader.bloom.current() is not None)
+        # a low-level write leaves the filter untrusted until rebuilt
+        txn = writer.env.begin_txn()
+        writer.db.put(txn, 'raw', 'v')
+        txn.commit()
+        self.assertEqual(reader.bloom.current(), None)
+        self.assertEqual(reader.get('raw'), 'v')
+        writer.put('b', 'v')
+        self.assertTrue('raw' in reader.bloom.current())
+        self.assertEqual(reader.get_many(['raw', 'c']), ['v', None])
+        writer.close()
+        reader.close()
+
+    def test_metrics(self):
+        writer = Writer('./test_rw', metrics=True)
+        writer.mput(dict(('k%d' % i, 'v') for i in range(100)))
+        reader = Reader('./test_rw', metrics=True)
+        for i in range(10):
+            reader.get('k%d' % i)
+        reader.get('missing')
+        metrics = reader.metrics()
+        self.assertTrue(metrics['enabled'])
+        self.assertEqual(metrics['ops']['get']['count'], 11)
+        self.assertEqual(metrics['ops']['get']['notfound'], 1)
+        self.assertTrue(metrics['ops']['get']['p99_us'] >=
+                        metrics['ops']['get']['p50_us'] > 0)
+        self.assertEqual(writer.metrics()['ops']['put']['count'], 100)
+        with reader.snapshot():
+            writer.put('k0', 'w')
+            gauges = reader.metrics()['gauges']
+            self.assertEqual(gauges['active_readers'], 1)
+            self.assertEqual(gauges['oldest_reader_lag'], 1)
+        self.assertTrue(0 < gauges['map_utilisation'] < 1)
+        reader.env.reset_metrics()
+        self.assertEqual(reader.metrics()['ops']['get']['count'], 0)
+        reader.close()
+        writer.close()
+
+    def test_indexes(self):
+        by_city = lambda key, value: value['city']
+        by_tag = lambda key, value: value.get('tags')
+        writer = Writer('./test_rw', encode_fn=dumps, decode_fn=loads,
+                        indexes={'city': by_city, 'tag': by_tag})
+        writer.mput({'alice': {'city': 'paris', 'tags': ['a', 'b']},
+                     'bob': {'city': 'rome', 'tags': ['b']},
+                     'carl': {'city': 'paris'}})
+        reader = Reader('./test_rw', decode_fn=loads)
+        self.assertEqual(reader.get_by_index('city', 'paris'),
+                         [('alice', {'city': 'paris', 'tags': ['a', 'b']}),
+                          ('carl', {'city': 'paris'})])
+        self.assertEqual([key for key, _ in reader.get_by_index('tag', 'b')],
+                         ['alice', 'bob'])
+        writer.put('bob', {'city': 'paris'})
+        writer.delete('alice')
+        self.assertEqual([key for key, _ in
+                          reader.get_by_index('city', 'paris')],
+                         ['bob', 'carl'])
+        self.assertEqual(reader.get_by_index('city', 'rome'), [])
+        self.assertEqual(reader.get_by_index('tag', 'b'), [])
+        self.assertRaises(KeyNotFoundError, reader.get_by_index, 'zip', 'x')
+        reader.close()
+        writer.close()
+        self.assertRaises(ValueError, Writer, './test_rw', encode_fn=dumps,
+                          indexes={'city': by_city})
+
+        writer = Writer('./test_rw_dup', dup=True, int_key=True,
+                        indexes={'len': lambda key, value: str(len(value))})
+        writer.put(1, 'ab')
+        writer.put(1, 'abc')
+        writer.put(2, 'cd')
+        writer.delete(1, 'ab')
+        reader = DupReader('./test_rw_dup', int_key=True)
+        self.assertEqual(reader.get_by_index('len', '2'), [(2, ['cd'])])
+        self.assertEqual(reader.get_by_index('len', '3'), [(1, ['abc'])])
+        reader.close()
+        writer.close()
+
+    def test_index_added_later(self):
+        writer = Writer('./test_rw')
+        writer.drop()
+        writer.put('k', 'old')
+        writer.put('j', 'old')
+        writer.put('i', 'old')
+        writer.close()
+        writer = Writer('./test_rw', indexes={'v': lambda key, value: value})
+        writer.put('k', 'new')
+        writer.delete('j')
+        self.assertRaises(KeyNotFoundError, writer.delete, 'j')
+        reader = Reader('./test_rw')
+        self.assertEqual(reader.get_by_index('v', 'new'), [('k', 'new')])
+        self.assertEqual(reader.get_by_index('v', 'old'), [('i', 'old')])
+        reader.close()
+        writer.close()
+
+    def test_indexes_decode_once(self):
+        decoded = []
+
+        def decode(value):
+            decoded.append(value)
+            return loads(value)
+        writer = Writer('./test_rw', encode_fn=dumps, decode_fn=decode,
+                        indexes={'a': lambda key, value: value['a'],
+                                 'b': lambda key, value: value['b']})
+        writer.drop()
+        writer.put('k', {'a': 'x', 'b': 'y'})
+        writer.put('k', {'a': 'z', 'b': 'y'})
+        # the new value of each put, and the old one it replaces
+        self.assertEqual(len(decoded), 3)
+        writer.close()
@@ -116,3 +116,43 @@ class TestDB(TestCase):
         txn = self.env.begin_txn()
         self.assertEqual(db.get(txn, 'delete'), 11)
         db.close()
+
+    def test_set_operations(self):
+        # a database of its own, as drop_mdb creates test_db without the
+        # MDB_DUPFIXED flag the set operations need
+        txn = self.env.begin_txn()
+        db = self.env.open_db(txn, 'test_sets', mdb.MDB_DUPSORT|mdb.MDB_INTEGERDUP|mdb.MDB_CREATE)
+        db.drop(txn, 0)
+        db.put_multiple(txn, 'apple', [1, 4, 7, 9])
+        db.put_multiple(txn, 'pear', [2, 4, 9, 10])
+        db.put_multiple(txn, 'plum', [4, 5, 9])
+        txn.commit()
+        txn = self.env.begin_txn()
+        self.assertEqual(list(db.intersect(txn, ['apple', 'pear', 'plum'])),
+                         [4, 9])
+        self.assertEqual(list(db.union(txn, ['apple', 'plum'])),
+                         [1, 4, 5, 7, 9])
+        self.assertEqual(list(db.difference(txn, ['apple', 'pear'])), [1, 7])
+        self.assertEqual(list(db.intersect(txn, ['apple', 'fig'])), [])
+        txn.commit()
+        db.close()
+
+    def test_get_range_and_prefix(self):
+        self.drop_mdb()
+        txn = self.env.begin_txn()
+        db = self.env.open_db(txn, 'test_db', mdb.MDB_DUPSORT|mdb.MDB_INTEGERDUP|mdb.MDB_CREATE)
+        db.put(txn, 'a', 1)
+        db.put(txn, 'ab', 2)
+        db.put(txn, 'ab', 3)
+        db.put(txn, 'b', 4)
+        txn.commit()
+        txn = self.env.begin_txn()
+        self.assertEqual(list(db.get_range(txn, 'ab', 'b')),
+                         [('ab', 2), ('ab', 3), ('b', 4)])
+        self.assertEqual(list(db.get_range(txn, 'ab', reverse=True)),
+                         [('b', 4), ('ab', 3), ('ab', 2)])
+        self.assertEqual(list(db.get_prefix(txn, 'a')),
+                         [('a', 1), ('ab', 2), ('ab', 3)])
+        self.assertEqual(list(db.get_ne(txn, 'ab')), [('a', 1), ('b', 4)])
+        txn.commit()
+        db.close()